@@ -0,0 +1,345 @@
+"""Response cache for FloraCodex API data.
+
+Two tiers: a small in-process LRU for the hottest entries, backed by an
+sqlite file on disk that every gunicorn worker on the machine shares.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+CACHE_PATH = os.environ.get(
+    'FLORACODEX_CACHE_PATH',
+    os.path.join(tempfile.gettempdir(), 'tendril_api_cache.sqlite3'))
+CACHE_MAX_ENTRIES = int(os.environ.get('FLORACODEX_CACHE_MAX_ENTRIES', 1000))
+# Most rows kept in the sqlite file. Search pages are keyed by whatever query
+# string they were asked for, so without a cap the file only ever grows.
+CACHE_MAX_ROWS = int(os.environ.get('FLORACODEX_CACHE_MAX_ROWS', 50000))
+# Each process trims the file after this many writes to it
+PRUNE_EVERY = int(os.environ.get('FLORACODEX_CACHE_PRUNE_EVERY', 100))
+# Most idle connections a process keeps open to each sqlite file
+SQLITE_POOL_IDLE = int(os.environ.get('SQLITE_POOL_IDLE', 8))
+# Species data rarely changes upstream, so keep it for a day and allow serving
+# it stale for up to a week while a refresh happens in the background.
+CACHE_TTL = int(os.environ.get('FLORACODEX_CACHE_TTL', 24 * 60 * 60))
+STALE_TTL = int(os.environ.get('FLORACODEX_STALE_TTL', 7 * 24 * 60 * 60))
+# Slugs that came back 404 are remembered for a short while.
+NEGATIVE_TTL = int(os.environ.get('FLORACODEX_NEGATIVE_TTL', 10 * 60))
+
+
+def content_version(payload):
+    """Short hash of a response's serialized JSON, the same in every worker."""
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+class CacheEntry:
+    """A cached API response along with its expiry times.
+
+    `version` changes whenever the response data does, so pages built from
+    it can use it in their ETags.
+    """
+
+    __slots__ = ("data", "status", "expires_at", "stale_until", "version")
+
+    def __init__(self, data, status, expires_at, stale_until, version=None):
+        self.data = data
+        self.status = status
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.version = version
+
+    def is_fresh(self, now):
+        return now < self.expires_at
+
+    def is_usable(self, now):
+        return now < self.stale_until
+
+
+class SqlitePool:
+    """This process's open connections to one sqlite file, shared by all of
+    its threads and greenlets.
+
+    Connections are borrowed for a few statements at a time. Keeping one per
+    thread instead would, under gevent, mean one per greenlet: a new
+    connection, and schema check, for every request.
+    """
+
+    def __init__(self, path, schema=(), max_idle=SQLITE_POOL_IDLE):
+        self.path = path
+        self.schema = schema
+        self.max_idle = max_idle
+        self._idle = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.schema:
+            conn.execute(statement)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, opening one if none is idle."""
+        with self._lock:
+            # Connections can't cross a fork, so a child starts afresh
+            if self._pid != os.getpid():
+                self._idle = []
+                self._pid = os.getpid()
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                if self._pid == os.getpid() and len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+
+class DiskStore:
+    """sqlite-backed key/value store shared across worker processes.
+
+    sqlite errors (locked or unwritable file) are treated as a miss or a
+    skipped write, so the cache can never take a request down.
+
+    Every `prune_every` writes, entries too old to serve are deleted and, past
+    `max_rows`, the ones soonest to expire, so the file stays bounded.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_rows=CACHE_MAX_ROWS, prune_every=PRUNE_EVERY):
+        self.path = path
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+        self._writes = 0
+        self._pool = SqlitePool(path, schema=(
+            """CREATE TABLE IF NOT EXISTS api_cache (
+                key TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                stale_until REAL NOT NULL
+            )""",
+            "CREATE INDEX IF NOT EXISTS api_cache_expires_at ON api_cache (expires_at)"))
+
+    def get(self, key):
+        """Return the CacheEntry for key, expired or not, or None."""
+        try:
+            with self._pool.connection() as conn:
+                row = conn.execute(
+                    "SELECT data, status, expires_at, stale_until FROM api_cache WHERE key = ?",
+                    (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        return CacheEntry(json.loads(row[0]), row[1], row[2], row[3], content_version(row[0]))
+
+    def set(self, key, entry, payload=None):
+        """Store entry; payload is entry.data already serialized, if available.
+        Returns the number of entries a prune this write set off removed."""
+        try:
+            with self._pool.connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO api_cache (key, data, status, expires_at, stale_until) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, payload or json.dumps(entry.data), entry.status, entry.expires_at, entry.stale_until))
+        except sqlite3.Error:
+            return 0
+        # Not locked: a lost increment only delays the next prune a little
+        self._writes += 1
+        if self._writes >= self.prune_every:
+            self._writes = 0
+            return self.prune(time.time())
+        return 0
+
+    def prune(self, now):
+        """Delete entries too old to serve even as stale, then the ones
+        soonest to expire while there are more than max_rows. Returns count
+        removed."""
+        try:
+            with self._pool.connection() as conn:
+                removed = conn.execute("DELETE FROM api_cache WHERE stale_until <= ?", (now,)).rowcount
+                excess = conn.execute("SELECT count(*) FROM api_cache").fetchone()[0] - self.max_rows
+                if excess > 0:
+                    removed += conn.execute(
+                        "DELETE FROM api_cache WHERE key IN "
+                        "(SELECT key FROM api_cache ORDER BY expires_at LIMIT ?)", (excess,)).rowcount
+        except sqlite3.Error:
+            return 0
+        return removed
+
+
+class ResponseCache:
+    """LRU + disk cache with stale-while-revalidate and negative caching.
+
+    `fetch` callables passed to get_or_fetch must return a
+    (status_code, json_data) tuple. 200s are cached for `ttl`, 404s for
+    `negative_ttl`; anything else is passed through uncached.
+
+    Concurrent misses for the same key are coalesced into one fetch. If the
+    fetch raises, an expired copy still on disk is served instead, if any.
+    """
+
+    def __init__(self, store=None, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL,
+                 stale_ttl=STALE_TTL, negative_ttl=NEGATIVE_TTL):
+        self.store = store if store is not None else DiskStore()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._loading = {}
+        self.counters = {
+            "hits": 0,
+            "disk_hits": 0,
+            "stale_hits": 0,
+            "negative_hits": 0,
+            "fallback_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "evictions": 0,
+            "expired": 0
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _remember(self, key, entry):
+        """Put entry in the in-process LRU, evicting the oldest if full."""
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def lookup(self, key):
+        """Return a usable (fresh or stale) CacheEntry for key, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is None:
+            entry = self.store.get(key)
+            if entry is not None:
+                self._count("disk_hits")
+                self._remember(key, entry)
+        if entry is None:
+            return None
+        if not entry.is_usable(now):
+            with self._lock:
+                self._memory.pop(key, None)
+            self._count("expired")
+            return None
+        return entry
+
+    def put(self, key, status, data, ttl=None):
+        """Cache a response if its status is cacheable. Returns the entry or None."""
+        now = time.time()
+        if status == 200:
+            expires_at = now + (ttl if ttl is not None else self.ttl)
+            stale_until = expires_at + self.stale_ttl
+        elif status == 404:
+            expires_at = now + self.negative_ttl
+            stale_until = expires_at
+        else:
+            return None
+        payload = json.dumps(data)
+        entry = CacheEntry(data, status, expires_at, stale_until, content_version(payload))
+        self._remember(key, entry)
+        removed = self.store.set(key, entry, payload)
+        if removed:
+            self._count("evictions", removed)
+        return entry
+
+    def get_or_fetch(self, key, fetch, ttl=None):
+        """Return cached data for key, calling fetch() on a miss.
+
+        A stale entry is returned immediately and refreshed in a background
+        thread, so only true misses wait on the upstream API.
+        """
+        entry = self.lookup(key)
+        if entry is not None:
+            if entry.status == 404:
+                self._count("negative_hits")
+            elif entry.is_fresh(time.time()):
+                self._count("hits")
+            else:
+                self._count("stale_hits")
+                self._revalidate(key, fetch, ttl)
+            return entry.data
+
+        with self._lock:
+            future = self._loading.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._loading[key] = future
+        if not leader:
+            self._count("coalesced")
+            return future.result()
+
+        self._count("misses")
+        try:
+            status, data = fetch()
+            self.put(key, status, data, ttl)
+        except Exception as e:
+            expired = self.store.get(key)
+            if expired is None:
+                future.set_exception(e)
+                raise
+            self._count("fallback_hits")
+            data = expired.data
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+        future.set_result(data)
+        return data
+
+    def _revalidate(self, key, fetch, ttl):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                status, data = fetch()
+                self.put(key, status, data, ttl)
+            except Exception:
+                # Keep serving the stale copy; the next request will retry.
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def prune(self):
+        """Drop expired entries from the disk store."""
+        removed = self.store.prune(time.time())
+        self._count("evictions", removed)
+        return removed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._memory)
+        return stats
@@ -1,40 +1,84 @@
+import hashlib
 import os
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import Flask, Blueprint, current_app, render_template, request, flash, redirect, session, g, jsonify, abort, send_file, make_response, Response, stream_with_context
 import requests
-from models import db, connect_db, User, GrowingArea, PlantList, Plant, PlantList_Plants
-from trefle_requests import quick_search, get_one_plant
+from urllib.parse import parse_qs, urlencode, urlsplit
+from config import get_config
+from models import db, connect_db, User, GrowingArea, PlantList, Plant, PlantList_Plants, Species, SavedSearch, Job, LIGHT_LEVELS, SOIL_TEXTURES, SOIL_MOISTURES
+from trefle_requests import quick_search, get_one_plant, get_many_plants, get_next_page, prefetch_page, advanced_search, plant_version, UpstreamUnavailable
 from forms import UserAddForm, UserEditForm, LoginForm, GrowingAreaForm, NewPlantListForm, AddPlantForm
+from flask_wtf.csrf import validate_csrf
 from sqlalchemy.exc import IntegrityError
+from wtforms.validators import ValidationError
+import passwords
+import instrumentation
+import image_cache
+import jobs
+import autocomplete
+import garden_io
+import recommendations
+from fragments import cached_fragment, data_version
+from session_user import LazyUser, forget_user
 
 CURR_USER_KEY = "curr_user"
+CURR_USERNAME_KEY = "curr_username"
+
+bp = Blueprint('tendril', __name__)
 
-app = Flask(__name__)
-
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgres:///botanical'))
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or 'SECRET-SO-SECRET'
-toolbar = DebugToolbarExtension(app)
 trefle_token = os.environ.get('TREFLE_TOKEN')
 
-connect_db(app)
+DEFAULT_THUMBNAIL = "/static/images/thumbnail_default.png"
+# Resized images rarely change, so let browsers and proxies keep them for 30 days
+IMAGE_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def create_app(config=None, migrations=True):
+    """Build the app.
+
+    config is a profile name from config.py ("production", "development" or
+    "test") or a config class; by default FLASK_ENV picks the profile.
+    migrations=False leaves out the `flask db` commands, and importing
+    Alembic for them, in processes that only serve requests.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config if isinstance(config, type) else get_config(config))
+    if app.config['DEBUG_TOOLBAR']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    app.register_blueprint(bp)
+    instrumentation.init_app(app, db)
+    if migrations:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    return app
+
+
+def warm_up(app):
+    """Do the one-off work otherwise left to the first request that needs
+    it: compile every template and load Pillow for /img. gunicorn.conf.py
+    runs this in the master when preloading, so forked workers start with
+    it done and share the memory."""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    image_cache.load_pillow()
 
 #############################################################
 # User signup/login/logout
 #############################################################
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    g.user is a LazyUser; the users table is only queried if a handler needs
+    more than the id, username or profile fields.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = LazyUser(session[CURR_USER_KEY], session.get(CURR_USERNAME_KEY))
 
     else:
         g.user = None
@@ -43,12 +87,15 @@ def do_login(user):
     """Log in user."""
 
     session[CURR_USER_KEY] = user.id
+    session[CURR_USERNAME_KEY] = user.username
 
 def do_logout():
     """Logout user."""
 
     if CURR_USER_KEY in session:
+        forget_user(session[CURR_USER_KEY])
         del session[CURR_USER_KEY]
+    session.pop(CURR_USERNAME_KEY, None)
 
 def check_if_g_user():
     """Check to see if there is a user in Flask global. If so, return g.user, else return False."""
@@ -66,11 +113,78 @@ def username_match(username):
         if g_user.username == username:
             return True
 
+def is_admin():
+    """Check to see if g.user is one of the ADMIN_USERNAMES. Returns True or False."""
+    return bool(g.user) and g.user.username in current_app.config['ADMIN_USERNAMES']
+
+@bp.app_errorhandler(UpstreamUnavailable)
+def upstream_unavailable(e):
+    """FloraCodex is down (or the breaker is open) and nothing is cached."""
+    if request.accept_mimetypes.best == 'application/json' or request.path.startswith('/search/'):
+        return jsonify(errors=["Plant data is temporarily unavailable"]), 503, {"Retry-After": "30"}
+    return render_template('upstream-unavailable.html'), 503, {"Retry-After": "30"}
+
+@bp.app_errorhandler(passwords.HashingBusy)
+def hashing_busy(e):
+    """Too many logins/signups queued for password hashing: fail fast."""
+    return "The server is busy. Please try again in a few seconds.", 503, {"Retry-After": "5"}
+
+#############################################################
+# HTTP caching
+#############################################################
+
+def page_etag(versions):
+    """ETag for a page built from `versions` and shown to the current user."""
+    user_id = g.user.id if g.user else None
+    return hashlib.sha1(repr((user_id, versions)).encode()).hexdigest()
+
+def cacheable_page(versions, render, max_age=0, shared_max_age=0, weak=False):
+    """Return render()'s page with an ETag, or a 304 without rendering if
+    the client's copy is still current.
+
+    versions() returns a tuple of everything the page shows besides the
+    logged-in user, e.g. row timestamps and upstream cache versions, or None
+    if that can't be worked out cheaply; then the page is rendered and
+    versions() asked again afterwards. Pages with flash messages waiting
+    are always rendered and get no ETag.
+
+    Pages for anonymous users may be kept by shared caches (for
+    `shared_max_age`), and must be revalidated once `max_age` has passed.
+    Logged-in pages are private and revalidated every time, as they show
+    things the user can change, like their list names; the ETag makes that
+    a 304 when nothing has.
+    """
+    has_flashes = '_flashes' in session
+    parts = None if has_flashes else versions()
+    if parts is not None and request.if_none_match.contains_weak(page_etag(parts)):
+        response = Response(status=304)
+    else:
+        response = make_response(render())
+        if parts is None and not has_flashes:
+            parts = versions()
+
+    if parts is not None:
+        response.set_etag(page_etag(parts), weak=weak)
+    if g.user:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+        if shared_max_age:
+            response.cache_control.s_maxage = shared_max_age
+        if max_age:
+            response.cache_control.max_age = max_age
+        else:
+            response.cache_control.no_cache = True
+    # Logged-in and anonymous visitors see different pages at the same URL
+    response.vary.add('Cookie')
+    return response
+
 #############################################################
 # General Routes
 #############################################################
 
-@app.route('/')
+@bp.route('/')
 def show_landing_page():
     if g.user:
         return redirect(f"/{g.user.username}/garden")
@@ -80,32 +194,154 @@ def show_landing_page():
 # Search Routes
 #############################################################
 
-@app.route('/search')
+@bp.route('/search')
 def get_quick_search_results():
     """Show results for single-term search."""
     # TODO: refactor as JSON API endpoint; build page with JS; will make dealing with pagination more sensible
     search_term = request.args['term']
-    search_results = quick_search(trefle_token, search_term)
-    return render_template('search-results.html', search_term=search_term, search_results=search_results)
-
-@app.route('/search/next', methods=['GET'])
+    # Answer from the local species catalog; only go upstream on a miss
+    search_results = Species.search(search_term)
+    if not search_results["data"]:
+        search_results = quick_search(trefle_token, search_term)
+        prefetch_page(trefle_token, search_results.get("links", {}).get("next"))
+    plants = search_results.get("data") or []
+    cards = cached_fragment('fragments/search-cards.html', 'search', data_version(plants), plants=plants)
+    return render_template('search-results.html', search_term=search_term, search_results=search_results, cards=cards)
+
+# Query string params passed through to the API's /species endpoint
+ADVANCED_SEARCH_PREFIXES = ("filter[", "filter_not[", "range[", "order[")
+
+def search_page_json(results):
+    """Return a page of API search results as a JSON response, and start
+    prefetching the page after it."""
+    links = results.get("links", {})
+    prefetch_page(trefle_token, links.get("next"))
+    return jsonify(data=results.get("data", []), links=links, meta=results.get("meta", {}))
+
+# Largest page a local search cursor may ask for
+LOCAL_SEARCH_MAX_LIMIT = 100
+
+@bp.route('/search/next', methods=['GET'])
 def get_next_results_page():
-    """Get next page of search results. Return as JSON."""
-    pass;
+    """Get next page of search results. Return as JSON.
 
-@app.route('/search/advanced', methods=['GET'])
+    Takes the `links.next` cursor from a previous page as the `url` param:
+    an API cursor, or one from a local catalog search.
+    """
+    next_page_url = request.args.get('url', '')
+    if next_page_url.startswith(Species.SEARCH_PATH + '?'):
+        cursor = parse_qs(urlsplit(next_page_url).query)
+        try:
+            page = max(int(cursor.get('page', ['1'])[0]), 1)
+            limit = min(max(int(cursor.get('limit', ['30'])[0]), 1), LOCAL_SEARCH_MAX_LIMIT)
+        except ValueError:
+            return jsonify(errors=["page and limit must be numbers"]), 400
+        return jsonify(Species.search(cursor.get('q', [''])[0], page=page, limit=limit))
+    if not next_page_url.startswith('/api/v1/species'):
+        return jsonify(errors=["url must be a species search cursor"]), 400
+    return search_page_json(get_next_page(trefle_token, next_page_url))
+
+# Suggestions change only when plants are added, so browsers may reuse them briefly
+AUTOCOMPLETE_MAX_AGE = 5 * 60
+
+@bp.route('/autocomplete')
+def get_autocomplete_suggestions():
+    """Suggest plants whose scientific or common name starts with `prefix`.
+    Return JSON.
+
+    Answered from the memory-mapped prefix index, without the database or API.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), autocomplete.MAX_SUGGESTIONS)
+    except ValueError:
+        return jsonify(errors=["limit must be a number"]), 400
+    response = jsonify(suggestions=autocomplete.index.suggest(request.args.get('prefix', ''), limit))
+    response.cache_control.public = True
+    response.cache_control.max_age = AUTOCOMPLETE_MAX_AGE
+    return response
+
+# Growing area conditions, which /search/advanced answers from the local catalog
+CONDITION_SCALES = {"light_level": LIGHT_LEVELS, "soil_texture": SOIL_TEXTURES, "soil_moisture": SOIL_MOISTURES}
+CONDITIONS_PAGE_SIZE = 30
+
+def conditions_search_json():
+    """Return a page of local species matching growing area conditions as a
+    JSON response shaped like an API search page."""
+    conditions = {}
+    for name, scale in CONDITION_SCALES.items():
+        value = request.args.get(name)
+        if value:
+            if value not in scale:
+                return jsonify(errors=[f"{name} must be one of: {', '.join(scale)}"]), 400
+            conditions[name] = value
+    try:
+        if request.args.get("soil_ph"):
+            conditions["soil_ph"] = float(request.args["soil_ph"])
+        page = max(int(request.args.get("page", 1)), 1)
+    except ValueError:
+        return jsonify(errors=["soil_ph and page must be numbers"]), 400
+
+    query = Species.matching_conditions(**conditions)
+    matches = query.offset((page - 1) * CONDITIONS_PAGE_SIZE).limit(CONDITIONS_PAGE_SIZE + 1).all()
+    links = {"self": f"/search/advanced?{urlencode(dict(conditions, page=page))}"}
+    if len(matches) > CONDITIONS_PAGE_SIZE:
+        links["next"] = f"/search/advanced?{urlencode(dict(conditions, page=page + 1))}"
+    return jsonify(data=[species.serialize() for species in matches[:CONDITIONS_PAGE_SIZE]],
+                   links=links, meta={"total": query.order_by(None).count()})
+
+@bp.route('/search/advanced', methods=['GET'])
 def get_advanced_search_results():
-    """Handle advanced search request. Return JSON."""
-    pass;
+    """Handle advanced search request. Return JSON.
 
-@app.route('/plant/<plant_slug>')
+    Searches on growing area conditions (light_level, soil_texture,
+    soil_moisture, soil_ph) run against the local species catalog; API
+    filters are passed through to the API.
+    """
+    if any(request.args.get(name) for name in (*CONDITION_SCALES, "soil_ph")):
+        return conditions_search_json()
+    search_terms = {name: value for name, value in request.args.items()
+                    if name.startswith(ADVANCED_SEARCH_PREFIXES) or name in ("q", "page")}
+    if not search_terms:
+        return jsonify(errors=["No search terms given"]), 400
+    return search_page_json(advanced_search(trefle_token, search_terms))
+
+@bp.route('/plant/<plant_slug>')
 def get_plant_detail(plant_slug):
     """
     Show data for a given plant.
     If logged in user, give option to add to a plant list.
     """
     plant_details = get_one_plant(trefle_token, plant_slug)
-
+    if not plant_details.get("data"):
+        abort(404)
+    recommended_plants = recommendations.recommended([plant_details["data"]["id"]])
+
+    def versions():
+        upstream_version = plant_version(plant_slug)
+        if upstream_version is None:
+            return None
+        recommended_ids = tuple(plant.id for plant in recommended_plants)
+        if g.user:
+            return (upstream_version, recommended_ids,
+                    tuple((plant_list.id, plant_list.name) for plant_list in g.user.plant_lists))
+        return (upstream_version, recommended_ids)
+
+    # The add-plant form's CSRF token differs on every render, so pages for
+    # logged-in users only get a weak ETag
+    return cacheable_page(versions, lambda: render_plant_detail(plant_slug, plant_details, recommended_plants),
+                          max_age=5 * 60, shared_max_age=60 * 60, weak=bool(g.user))
+
+def render_plant_detail(plant_slug, plant_details, recommended_plants):
+    """Render a plant's page, with the add-plant form for logged-in users.
+
+    Everything but the form is the same for every visitor, so it comes from
+    the fragment cache.
+    """
+    version = plant_version(plant_slug)
+    fragments = {
+        "summary": cached_fragment('fragments/plant-summary.html', plant_slug, version, plant_details=plant_details),
+        "sources": cached_fragment('fragments/plant-sources.html', plant_slug, version, plant_details=plant_details)
+    }
     if g.user:
         add_plant_form = AddPlantForm()
         
@@ -125,16 +361,54 @@ def get_plant_detail(plant_slug):
         if plant_details["data"]["image_url"]:
             add_plant_form.plant_image_url.data = plant_details["data"]["image_url"]
         else:
-            add_plant_form.plant_image_url.data = "/static/images/thumbnail_default.png"
-        return render_template('plant-detail.html', plant_details=plant_details, form=add_plant_form)
+            add_plant_form.plant_image_url.data = DEFAULT_THUMBNAIL
+        return render_template('plant-detail.html', plant_details=plant_details, form=add_plant_form,
+                               recommended_plants=recommended_plants, **fragments)
     
-    return render_template('plant-detail.html', plant_details=plant_details)
+    return render_template('plant-detail.html', plant_details=plant_details, recommended_plants=recommended_plants,
+                           **fragments)
+
+def plant_image_url(plant_id):
+    """Find the original image URL for a plant id: a saved plant, then the
+    local species catalog, then the API."""
+    plant = Plant.query.get(plant_id) or Species.query.get(plant_id)
+    if plant is not None:
+        return plant.image_url if plant.image_url != DEFAULT_THUMBNAIL else None
+    try:
+        plant_details = get_one_plant(trefle_token, str(plant_id))
+    except UpstreamUnavailable:
+        return None
+    return (plant_details.get("data") or {}).get("image_url")
+
+@bp.route('/img/<int:plant_id>/<size>')
+def get_plant_image(plant_id, size):
+    """Serve a resized WebP (or JPEG) copy of a plant's photo.
+
+    Made once from the original and served from the on-disk image cache
+    after that. If the original can't be loaded, redirect to it instead,
+    as long as it is on one of image_cache.IMAGE_HOSTS.
+    """
+    if size not in image_cache.SIZES:
+        abort(404)
+    fmt = "webp" if "image/webp" in request.accept_mimetypes.values() else "jpeg"
+    try:
+        digest = image_cache.cache.get(plant_id, size, fmt, lambda: plant_image_url(plant_id))
+    except image_cache.ImageUnavailable as e:
+        return redirect(e.url if image_cache.allowed_url(e.url) else DEFAULT_THUMBNAIL)
+    if digest is None:
+        return redirect(DEFAULT_THUMBNAIL)
+
+    response = send_file(image_cache.cache.path_for(digest, fmt), mimetype=image_cache.FORMATS[fmt],
+                         add_etags=False, cache_timeout=IMAGE_MAX_AGE)
+    response.set_etag(digest)
+    response.vary.add("Accept")
+    return response.make_conditional(request)
 
 #############################################################
 # User Routes
 #############################################################
 
-@app.route('/register', methods=["GET", "POST"])
+@bp.route('/register', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -170,7 +444,7 @@ def signup():
     else:
         return render_template('register.html', form=form)
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
@@ -181,6 +455,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # Saves the password hash if authenticate upgraded it
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -189,14 +465,14 @@ def login():
 
     return render_template('login.html', form=form)
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """Handle logout of user."""
     do_logout()
     flash('You have been logged out.', 'warning')
     return redirect('/login')
 
-@app.route('/<username>/account')
+@bp.route('/<username>/account')
 def show_account_info(username):
     if g.user and g.user.username == username:
         return render_template('user-account.html')
@@ -208,26 +484,117 @@ def show_account_info(username):
 # Garden Routes
 #############################################################
 
-@app.route('/<username>/garden')
+@bp.route('/<username>/garden')
 def show_garden_page(username):
+    """Show a user's growing areas and plant lists.
+
+    Built from three queries no matter how many lists the user has: the user,
+    their growing areas, and their plant lists joined to each list's growing
+    area and plant count. The ETag check adds a fourth, and a revalidation
+    that gets a 304 stops after two.
+    """
     this_user = User.query.filter_by(username=username).first_or_404()
+
+    def versions():
+        # Counts catch deletions, latest update times catch everything else.
+        # Plant counts are covered because adding or removing a plant
+        # touches its list.
+        area_versions = (db.session.query(db.func.count(GrowingArea.id), db.func.max(GrowingArea.updated_at))
+                         .filter(GrowingArea.user_id == this_user.id).subquery())
+        list_versions = (db.session.query(db.func.count(PlantList.id), db.func.max(PlantList.updated_at))
+                         .filter(PlantList.user_id == this_user.id).subquery())
+        return tuple(db.session.query(area_versions, list_versions).one())
+
+    return cacheable_page(versions, lambda: render_garden_page(this_user, username))
+
+def render_garden_page(this_user, username):
     growing_areas = GrowingArea.query.filter_by(user_id=this_user.id).all()
-    plant_lists = PlantList.query.filter_by(user_id=this_user.id).all()
-    for p_list in plant_lists:
-        if p_list.growing_area:
-                growing_area = GrowingArea.query.get_or_404(p_list.growing_area)
-                p_list.growing_area = growing_area.name
+
+    plant_lists = (db.session.query(PlantList, PlantList.plant_count)
+                   .options(db.joinedload(PlantList.area))
+                   .filter(PlantList.user_id == this_user.id)
+                   .order_by(PlantList.id)
+                   .all())
     return render_template("user-garden.html", growing_areas=growing_areas, plant_lists=plant_lists, username=username)
 
+@bp.route('/<username>/garden/export')
+def export_garden(username):
+    """Download the user's growing areas, plant lists and plants as CSV or
+    NDJSON (?format=), streamed as it is read."""
+    if not g.user or g.user.username != username:
+        abort(403)
+    fmt = request.args.get('format', 'csv')
+    if fmt not in garden_io.FORMATS:
+        abort(400)
+    response = Response(stream_with_context(garden_io.export_garden(g.user.id, fmt)),
+                        mimetype=garden_io.FORMATS[fmt])
+    response.headers["Content-Disposition"] = f"attachment; filename={username}-garden.{fmt}"
+    return response
+
+# Content types another site's page can POST without a CORS preflight
+SIMPLE_CONTENT_TYPES = {"", "application/x-www-form-urlencoded", "multipart/form-data", "text/plain"}
+
+@bp.route('/<username>/garden/import', methods=['POST'])
+def import_garden(username):
+    """Add the areas, lists and plants in an uploaded garden file (the `file`
+    field, or the request body) to the user's garden. Return JSON.
+
+    A form upload needs a CSRF token (the `csrf_token` field or an
+    X-CSRFToken header); a raw body needs a content type like text/csv,
+    which other sites can't send without a preflight.
+
+    The file is read as it arrives and written in one transaction, so a bad
+    record leaves the garden as it was.
+    """
+    if not g.user or g.user.username != username:
+        return jsonify(errors=["Not authorized"]), 403
+    if request.mimetype in SIMPLE_CONTENT_TYPES and current_app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.form.get('csrf_token') or request.headers.get('X-CSRFToken'))
+        except ValidationError as e:
+            return jsonify(errors=[str(e)]), 400
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    fmt = request.args.get('format') or (upload.filename.rsplit('.', 1)[-1].lower() if upload else 'ndjson')
+    if fmt not in garden_io.FORMATS:
+        return jsonify(errors=[f"format must be one of: {', '.join(garden_io.FORMATS)}"]), 400
+    try:
+        counts = garden_io.import_garden(g.user.id, stream, fmt)
+    except (garden_io.GardenFileError, UnicodeDecodeError) as e:
+        db.session.rollback()
+        return jsonify(errors=[str(e)]), 400
+    if counts["plants"]:
+        # Cheaper than listing every imported plant
+        jobs.enqueue("update_autocomplete", key="update_autocomplete")
+        # Cheaper than counting each imported plant separately
+        jobs.enqueue("rebuild_recommendations", key="rebuild_recommendations")
+    db.session.commit()
+    return jsonify(imported=counts)
+
 #############################################################
 # Growing Area Routes
 #############################################################
 
-@app.route('/<username>/growing-area/<int:growing_area>')
+@bp.route('/<username>/growing-area/<int:growing_area>')
 def show_growing_area(username, growing_area):
-    pass;
+    """Show a growing area and the plants suited to it.
 
-@app.route('/<username>/new-growing-area', methods=['GET', 'POST'])
+    The plants come from the area's saved search, whose results were worked
+    out when it was saved.
+    """
+    area = (GrowingArea.query.join(User, User.id == GrowingArea.user_id)
+            .filter(GrowingArea.id == growing_area, User.username == username)
+            .first_or_404())
+    saved_search = SavedSearch.query.filter_by(growing_area_id=area.id).first()
+    if saved_search is None:
+        # Areas made before saved searches existed
+        saved_search = SavedSearch.for_growing_area(area)
+        db.session.commit()
+    plants = [species.serialize() for species in saved_search.species()]
+    return render_template("growing-areas/growing-area-detail.html", area=area, username=username,
+                           saved_search=saved_search, plants=plants)
+
+@bp.route('/<username>/new-growing-area', methods=['GET', 'POST'])
 def create_growing_area(username):
     """Render form for creating a new growing area in the user's garden"""
     
@@ -250,6 +617,9 @@ def create_growing_area(username):
                 notes = form.notes.data
             )
             db.session.add(growing_area)
+            db.session.flush()
+            # Work out which plants suit the area now, so its page doesn't have to
+            SavedSearch.for_growing_area(growing_area)
             db.session.commit()
 
         except IntegrityError:
@@ -265,12 +635,12 @@ def create_growing_area(username):
     return render_template("growing-areas/new-growing-area.html", form=form)
 
 
-@app.route('/<username>/edit-growing-area/<int:growing_area>', methods=['PATCH'])
+@bp.route('/<username>/edit-growing-area/<int:growing_area>', methods=['PATCH'])
 def edit_growing_area(username, growing_area):
     # TODO: flesh this out
     pass;
 
-@app.route('/<username>/delete-growing-area/<int:growing_area>', methods=['DELETE'])
+@bp.route('/<username>/delete-growing-area/<int:growing_area>', methods=['DELETE'])
 def delete_growing_area(username, growing_area):
     # TODO: flesh this out
     pass;
@@ -279,7 +649,7 @@ def delete_growing_area(username, growing_area):
 # Plant List Routes
 #############################################################
 
-@app.route('/<username>/new-plant-list', methods=['GET', 'POST'])
+@bp.route('/<username>/new-plant-list', methods=['GET', 'POST'])
 def new_plant_list(username):
     """Renders form to create new plant list. Handles form submission."""
     if not username_match(username):
@@ -298,8 +668,6 @@ def new_plant_list(username):
     form.growing_area.choices = growing_area_names
 
 
-   # TODO: check for edge case (User already has plant list with same name)
-
     if form.validate_on_submit():   
         db.session.rollback()
         try:
@@ -313,7 +681,11 @@ def new_plant_list(username):
             db.session.add(plant_list)
             db.session.commit()
 
-        except IntegrityError:
+        except IntegrityError as e:
+            db.session.rollback()
+            if 'uq_plant_lists_user_id_name' in str(e.orig):
+                flash("You already have a plant list with that name.", 'warning')
+                return render_template("plant-lists/new-plant-list.html", form=form)
             flash("Sorry, something went wrong.", 'warning')
             if g.user:
                 return redirect(f"/{g.user.username}/garden")
@@ -325,73 +697,212 @@ def new_plant_list(username):
 
     return render_template("plant-lists/new-plant-list.html", form=form)
 
-@app.route('/<username>/plant-list/<int:plant_list_id>')
+# Plants shown per page of a plant list
+PLANT_LIST_PAGE_SIZE = 60
+
+def plant_list_page(plant_list):
+    """Return the page of plant_list's plants after the `after` param (a
+    plant id), and the `after` value for the next page or None."""
+    after = request.args.get('after', 0, type=int)
+    plants = plant_list.plant_page(after, PLANT_LIST_PAGE_SIZE + 1)
+    next_after = plants[PLANT_LIST_PAGE_SIZE - 1].id if len(plants) > PLANT_LIST_PAGE_SIZE else None
+    return plants[:PLANT_LIST_PAGE_SIZE], next_after
+
+@bp.route('/<username>/plant-list/<int:plant_list_id>')
 def show_plant_list(username, plant_list_id):
+    plant_list = PlantList.query.options(db.joinedload(PlantList.area)).get_or_404(plant_list_id)
+    plants, next_after = plant_list_page(plant_list)
+    recommended_plants = recommendations.recommended([plant.id for plant in plants], on_list_id=plant_list.id)
+
+    def versions():
+        plant_versions = tuple((plant.slug, plant_version(plant.slug)) for plant in plants)
+        if any(version is None for slug, version in plant_versions):
+            return None
+        area_version = plant_list.area.updated_at if plant_list.area else None
+        return (plant_list.updated_at, area_version, plant_versions, tuple(plant.id for plant in recommended_plants))
+
+    return cacheable_page(versions, lambda: render_plant_list(plant_list, username, plants, next_after,
+                                                              recommended_plants))
+
+def render_plant_list(plant_list, username, plants, next_after, recommended_plants):
+    # Fetch full species data for this page's plants in parallel
+    plant_details = get_many_plants(trefle_token, [plant.slug for plant in plants])
+    growing_area_name = plant_list.area.name if plant_list.area else None
+    return render_template('/plant-lists/plant-list-detail.html', plant_list=plant_list, username=username,
+                           growing_area_name=growing_area_name, plants=plants, plant_details=plant_details,
+                           next_after=next_after, first_page=not request.args.get('after'),
+                           recommended_plants=recommended_plants)
+
+@bp.route('/<username>/plant-list/<int:plant_list_id>/plants', methods=['GET'])
+def get_plant_list_plants(username, plant_list_id):
+    """Get a page of the plants on a list. Return JSON.
+
+    Pages are keyed on plant id: pass `links.next` from one page to get the
+    next. `meta.total` is the number of plants on the whole list.
+    """
     plant_list = PlantList.query.get_or_404(plant_list_id)
-    if plant_list.growing_area:
-        growing_area = GrowingArea.query.get_or_404(plant_list.growing_area)
-        growing_area_name = growing_area.name
-        return render_template('/plant-lists/plant-list-detail.html', plant_list=plant_list, username=username, growing_area_name=growing_area_name)
-    else:
-        return render_template('/plant-lists/plant-list-detail.html', plant_list=plant_list, username=username)
-        
+    plants, next_after = plant_list_page(plant_list)
+    base_url = f"/{username}/plant-list/{plant_list.id}/plants"
+    links = {"self": request.full_path.rstrip("?")}
+    if next_after is not None:
+        links["next"] = f"{base_url}?after={next_after}"
+    return jsonify(data=[plant._asdict() for plant in plants], links=links, meta={"total": plant_list.plant_count})
+
 # Add Plant to List
-@app.route('/<username>/plant-list/add-plant', methods=['POST'])
+@bp.route('/<username>/plant-list/add-plant', methods=['POST'])
 def add_plant_to_list(username):
     if not username_match(username):
         flash("Not authorized.", "warning")
-        redirect("/")
+        return redirect("/")
     
     form = AddPlantForm(request.form)
-    form.plant_id.data = int(form.plant_id.data)
-    print("Plant ID", form.plant_id.data)
-    print("Plant slug", form.plant_slug.data)
-    print("Plant scientific name", form.plant_scientific_name.data)
 
     # TODO: "TypeError: 'NoneType' object is not iterable" But if you look at form, all of the necessary data is there. This error only happens when the form is validated, like so:
     # if form.validate_on_submit():
     # The error goes away if we change it to the following:
-    if form:   
-    
-        db.session.rollback()
+    if form:
+        plant_list = PlantList.query.filter_by(id=form.plant_list.data, user_id=g.user.id).first()
+        if plant_list is None:
+            flash("Sorry, something went wrong.", 'warning')
+            return redirect(f"/{g.user.username}/garden")
+        plant = {
+            "id": int(form.plant_id.data),
+            "slug": form.plant_slug.data,
+            "scientific_name": form.plant_scientific_name.data,
+            "image_url": form.plant_image_url.data
+        }
         try:
-            # Check to see if plant is already in plants table
-            # If not, add it to plants table 
-            plant = None
-            if Plant.query.get(form.plant_id.data):
-                plant = Plant.query.get(form.plant_id.data)
-            else:
-                plant = Plant(
-                    id = form.plant_id.data,
-                    slug = form.plant_slug.data,
-                    scientific_name = form.plant_scientific_name.data,
-                    image_url = form.plant_image_url.data
-                )
-            db.session.add(plant)
-            db.session.commit()
-
-            # Add plant and plant list to join table
-            plant_on_list = PlantList_Plants(
-                plant_list_id = form.plant_list.data,
-                plant_id = plant.id
-            )
-            db.session.add(plant_on_list)
+            # Inserts the plant if it's new and adds it to the list, in one transaction
+            if plant_list.add_plants([plant]):
+                queue_enrichment(plant_list, [plant])
             db.session.commit()
             flash(f"Plant successfully added to list!")
 
         except IntegrityError:
+            db.session.rollback()
             flash("Sorry, something went wrong.", 'warning')
             if g.user:
                 return redirect(f"/{g.user.username}/garden")
             else:
                 return redirect("/")
     return redirect(f"/{g.user.username}/garden")
-    
-# TODO: Both of these
 
-# Delete Plant from List
-# /username/plant-list/id/delete-plant
+def queue_enrichment(plant_list, plants):
+    """Queue jobs for plants newly added to plant_list: refresh them from the
+    API, make their resized images, add them to the autocomplete index and
+    count them towards recommendations. Caller should commit."""
+    jobs.enqueue_many("enrich_plant", [({"plant_id": plant["id"], "slug": plant["slug"]}, f"enrich_plant:{plant['id']}")
+                                       for plant in plants])
+    if plants:
+        jobs.enqueue("update_autocomplete", {"plant_ids": [plant["id"] for plant in plants]})
+        jobs.enqueue("update_recommendations",
+                     {"plant_list_id": plant_list.id, "plant_ids": [plant["id"] for plant in plants]})
+
+# Most plants that can be added or removed in one request
+MAX_BULK_PLANTS = 1000
+
+def own_plant_list(username, plant_list_id):
+    """Return g.user's plant list with this id, or abort with a JSON error."""
+    if not username_match(username):
+        abort(make_response(jsonify(errors=["Not authorized"]), 403))
+    return PlantList.query.filter_by(id=plant_list_id, user_id=g.user.id).first_or_404()
+
+def bulk_request_values(name):
+    """Return the JSON request body's list called name, or abort with a 400."""
+    values = (request.get_json(silent=True) or {}).get(name) or []
+    if not isinstance(values, list) or len(values) > MAX_BULK_PLANTS:
+        abort(make_response(jsonify(errors=[f"{name} must be a list of at most {MAX_BULK_PLANTS} items"]), 400))
+    return values
+
+def plant_rows(plant_ids, slugs):
+    """Find Plant column values for plant ids and slugs.
+
+    Looks in the plants table, then the local species catalog, then (for
+    slugs only) the API, with at most one query per table and the API calls
+    made concurrently. Returns (rows, values that weren't found).
+    """
+    wanted_ids = set(plant_ids)
+    wanted_slugs = set(slugs)
+    rows = []
+
+    def take(plant):
+        if plant.id in wanted_ids or plant.slug in wanted_slugs:
+            wanted_ids.discard(plant.id)
+            wanted_slugs.discard(plant.slug)
+            rows.append({"id": plant.id, "slug": plant.slug,
+                         "scientific_name": plant.scientific_name, "image_url": plant.image_url})
+
+    for model in (Plant, Species):
+        if wanted_ids or wanted_slugs:
+            matches = (model.query
+                       .with_entities(model.id, model.slug, model.scientific_name, model.image_url)
+                       .filter(db.or_(model.id.in_(wanted_ids), model.slug.in_(wanted_slugs))))
+            for plant in matches:
+                take(plant)
+
+    if wanted_slugs:
+        plant_details = get_many_plants(trefle_token, sorted(wanted_slugs))
+        for slug, details in plant_details.items():
+            data = (details or {}).get("data")
+            if data:
+                wanted_slugs.discard(slug)
+                rows.append({"id": data["id"], "slug": data["slug"],
+                             "scientific_name": data["scientific_name"], "image_url": data.get("image_url")})
+    return rows, sorted(wanted_ids) + sorted(wanted_slugs)
+
+@bp.route('/<username>/plant-list/<int:plant_list_id>/plants', methods=['POST'])
+def add_plants_to_list(username, plant_list_id):
+    """Add many plants to a list in one transaction. Return JSON.
+
+    Takes a JSON body with `plant_ids` and/or `slugs`. Plants already on
+    the list are skipped; ids and slugs that can't be found are returned in
+    `not_found`.
+    """
+    plant_list = own_plant_list(username, plant_list_id)
+    plant_ids = bulk_request_values("plant_ids")
+    slugs = bulk_request_values("slugs")
+    if not all(isinstance(plant_id, int) for plant_id in plant_ids):
+        return jsonify(errors=["plant_ids must be integers"]), 400
+
+    rows, not_found = plant_rows(plant_ids, [str(slug) for slug in slugs])
+    added = plant_list.add_plants(rows)
+    queue_enrichment(plant_list, [row for row in rows if row["id"] in added])
+    db.session.commit()
+    return jsonify(added=added, not_found=not_found)
+
+@bp.route('/<username>/plant-list/<int:plant_list_id>/plants', methods=['DELETE'])
+def remove_plants_from_list(username, plant_list_id):
+    """Take many plants off a list in one transaction. Return JSON.
+
+    Takes a JSON body with `plant_ids`.
+    """
+    plant_list = own_plant_list(username, plant_list_id)
+    plant_ids = bulk_request_values("plant_ids")
+    if not all(isinstance(plant_id, int) for plant_id in plant_ids):
+        return jsonify(errors=["plant_ids must be integers"]), 400
 
-# Assign List to Growing/Planting Area
-# /username/plant-list/id/add-plant
+    removed = plant_list.remove_plants(plant_ids)
+    db.session.commit()
+    return jsonify(removed=removed)
 
+#############################################################
+# Job Routes
+#############################################################
+
+@bp.route('/jobs/status')
+def show_job_status():
+    """Return job counts by kind and status, and the queue's lag, as JSON.
+    Admins only."""
+    if not is_admin():
+        abort(403)
+    return jsonify(jobs.status())
+
+@bp.route('/jobs/<int:job_id>')
+def show_job(job_id):
+    """Return one job's status, payload and last error as JSON. Admins only."""
+    if not is_admin():
+        abort(403)
+    return jsonify(Job.query.get_or_404(job_id).serialize())
+
+# TODO: Assign List to Growing/Planting Area
+# /username/plant-list/id/add-plant
@@ -0,0 +1,256 @@
+"""Prefix index of plant names for search-as-you-type.
+
+Names are normalised (accents stripped, case folded) and kept in sorted order
+in files that every worker on the machine memory-maps, so there is one copy
+in memory however many workers there are and a lookup is a binary search
+with no database query. Common names are also indexed from each word, so
+"maple" finds "Red maple".
+
+There are two segments, each a file in AUTOCOMPLETE_DIR:
+
+    species.idx  the local species catalog, rebuilt in full after an import
+    plants.idx   saved plants that aren't in the catalog, extended with new
+                 plants as they are added
+
+Each file is a header (magic, entry count, highest plant id included, for
+information only), an array of count + 1 uint32 offsets, then the entries,
+each "key\\0name\\0scientific name\\0slug". Files are written to a
+temporary name and renamed into place, and workers reopen a segment when its
+file changes. Updates hold a lock file, so two job workers adding plants at
+once don't drop each other's entries.
+
+    python autocomplete.py        # build both segments from scratch
+"""
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import unicodedata
+from array import array
+from contextlib import contextmanager
+
+AUTOCOMPLETE_DIR = os.environ.get(
+    'AUTOCOMPLETE_DIR', os.path.join(tempfile.gettempdir(), 'tendril_autocomplete'))
+SEGMENTS = ("species", "plants")
+MAX_SUGGESTIONS = 20
+
+MAGIC = b"TAC1"
+HEADER = struct.Struct("<4sII")
+
+
+def normalize(text):
+    """Lower-case text without accents and with single spaces."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(text.casefold().split())
+
+
+def name_keys(name, every_word=False):
+    """Index keys for a name: the whole name, and if every_word the name
+    from each later word on as well."""
+    words = normalize(name).split(" ")
+    if not words[0]:
+        return []
+    if not every_word:
+        return [" ".join(words)]
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+def entries_for(slug, scientific_name, common_names):
+    """Index entries (key, name, scientific name, slug) for one plant."""
+    entries = [(key, scientific_name, scientific_name, slug) for key in name_keys(scientific_name)]
+    for name in common_names:
+        entries.extend((key, name, scientific_name, slug) for key in name_keys(name, every_word=True))
+    return entries
+
+
+#############################################################
+# Segment files
+#############################################################
+
+def segment_path(segment, root=None):
+    return os.path.join(root or AUTOCOMPLETE_DIR, f"{segment}.idx")
+
+
+def write_segment(path, entries, last_plant_id=0):
+    """Write entries to path, sorted by key, replacing any file there."""
+    records = sorted({"\0".join(entry).encode() for entry in entries})
+    offsets = array("I", [0])
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, "wb") as out:
+        out.write(HEADER.pack(MAGIC, len(records), last_plant_id))
+        out.write(offsets.tobytes())
+        for record in records:
+            out.write(record)
+    os.replace(partial, path)
+
+
+@contextmanager
+def segment_lock(path):
+    """Hold the exclusive lock for rewriting the segment at path."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+class Segment:
+    """A read-only, memory-mapped segment file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns)
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.last_plant_id = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an autocomplete index")
+        self.data_start = HEADER.size + 4 * (self.count + 1)
+        self.offsets = memoryview(self.mm)[HEADER.size:self.data_start].cast("I")
+
+    def record(self, i):
+        start = self.data_start + self.offsets[i]
+        return self.mm[start:self.data_start + self.offsets[i + 1]]
+
+    def key(self, i):
+        start = self.data_start + self.offsets[i]
+        return self.mm[start:self.mm.find(b"\0", start)]
+
+    def entries(self):
+        """Every (key, name, scientific name, slug) in the segment."""
+        return [tuple(self.record(i).decode().split("\0")) for i in range(self.count)]
+
+    def search(self, prefix, limit):
+        """Up to limit entries whose key starts with prefix (bytes), in key
+        order, skipping repeats of a slug."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        found = {}
+        for i in range(low, self.count):
+            if len(found) == limit:
+                break
+            record = self.record(i)
+            if not record.startswith(prefix):
+                break
+            key, name, scientific_name, slug = record.decode().split("\0")
+            found.setdefault(slug, (key, name, scientific_name, slug))
+        return list(found.values())
+
+
+class PrefixIndex:
+    """The segments in a directory, reopened when their files are replaced."""
+
+    def __init__(self, root=AUTOCOMPLETE_DIR):
+        self.root = root
+        self._segments = {}
+
+    def segment(self, name):
+        """Return the current Segment for name, or None if it hasn't been built."""
+        path = segment_path(name, self.root)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        segment = self._segments.get(name)
+        if segment is None or segment.identity != (stat.st_ino, stat.st_mtime_ns):
+            # The old mapping is closed once no thread is using it
+            segment = self._segments[name] = Segment(path)
+        return segment
+
+    def suggest(self, prefix, limit=10):
+        """Return up to limit plants with a name starting with prefix, as
+        dicts of name, scientific_name and slug."""
+        prefix = normalize(prefix).encode()
+        if not prefix:
+            return []
+        matches = []
+        for name in SEGMENTS:
+            segment = self.segment(name)
+            if segment is not None:
+                matches.extend(segment.search(prefix, limit))
+        suggestions = {}
+        for key, name, scientific_name, slug in sorted(matches):
+            if len(suggestions) == limit:
+                break
+            suggestions.setdefault(slug, {"name": name, "scientific_name": scientific_name, "slug": slug})
+        return list(suggestions.values())
+
+
+index = PrefixIndex()
+
+
+#############################################################
+# Building
+#############################################################
+
+def build_species(root=None):
+    """Rebuild the species segment from the local catalog."""
+    from models import Species
+
+    rows = (Species.query
+            .with_entities(Species.slug, Species.scientific_name, Species.common_name, Species.common_names)
+            .yield_per(5000))
+    entries = []
+    for slug, scientific_name, common_name, common_names in rows:
+        names = {common_name} | set((common_names or "").split(", "))
+        entries.extend(entries_for(slug, scientific_name, [name for name in names if name]))
+    write_segment(segment_path("species", root), entries)
+    return len(entries)
+
+
+def update_plants(plant_ids=None, root=None):
+    """Add saved plants to the plants segment, or rebuild it.
+
+    With plant_ids, those plants are added unless they're already in it.
+    Plant ids are FloraCodex ids rather than a sequence, so a newly saved
+    plant can have a lower id than the ones already indexed; callers say
+    which plants are new. Without plant_ids, or if the segment hasn't been
+    built, it's rebuilt from every saved plant.
+
+    Plants already in the species catalog are left out. Common names come
+    from the API cache where the plant's details are cached. Returns the
+    number of plants added.
+    """
+    from models import Plant, Species
+    from trefle_requests import cache
+
+    path = segment_path("plants", root)
+    with segment_lock(path):
+        existing = Segment(path) if plant_ids is not None and os.path.exists(path) else None
+        plants = Plant.query.with_entities(Plant.id, Plant.slug, Plant.scientific_name)
+        if existing is not None:
+            plants = plants.filter(Plant.id.in_(plant_ids))
+        entries = existing.entries() if existing else []
+        indexed = {slug for key, name, scientific_name, slug in entries}
+        plants = [plant for plant in plants.order_by(Plant.id) if plant.slug not in indexed]
+        in_catalog = {slug for slug, in Species.query.with_entities(Species.slug)
+                      .filter(Species.slug.in_([plant.slug for plant in plants]))}
+        plants = [plant for plant in plants if plant.slug not in in_catalog]
+        if not plants and existing is not None:
+            return 0
+
+        for plant in plants:
+            cached = cache.lookup(f"plant:{plant.slug}")
+            details = (cached.data.get("data") or {}) if cached is not None else {}
+            common_names = [details["common_name"]] if details.get("common_name") else []
+            entries.extend(entries_for(plant.slug, plant.scientific_name, common_names))
+        last_plant_id = max([existing.last_plant_id if existing else 0] + [plant.id for plant in plants])
+        write_segment(path, entries, last_plant_id)
+    return len(plants)
+
+
+if __name__ == "__main__":
+    from app import create_app
+
+    with create_app(migrations=False).app_context():
+        print(f"{build_species()} species names indexed.")
+        print(f"{update_plants()} saved plants indexed.")
@@ -0,0 +1,142 @@
+"""Offline stand-in for the FloraCodex API.
+
+Serves the recorded species in fixtures/species.json plus a synthetic catalog,
+with configurable latency, jitter and error rate. Slugs that aren't in the
+fixtures (like the `seed-plant-<id>` plants made by seed.py) get a generated
+record, so every plant in a seeded database resolves.
+
+Run on its own with
+    python -m benchmarks.fake_floracodex --port 5055 --latency-ms 80
+and point the app at it with FLORACODEX_BASE_URL=http://127.0.0.1:5055.
+"""
+import argparse
+import json
+import os
+import random
+import time
+import zlib
+
+from flask import Flask, request, jsonify
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "species.json")
+PAGE_SIZE = 20
+SYNTHETIC_SPECIES = 2000
+
+app = Flask(__name__)
+settings = {
+    "latency_ms": 50.0,
+    "jitter_ms": 20.0,
+    "error_rate": 0.0
+}
+
+with open(FIXTURES_PATH) as fixtures:
+    RECORDED = {record["slug"]: record for record in json.load(fixtures)}
+
+
+def synthetic_record(slug):
+    """Build a plausible species record for slug, the same every time."""
+    number = zlib.crc32(slug.encode())
+    plant_id = int(slug.rsplit("-", 1)[1]) if slug.startswith("seed-plant-") else 1000000 + number % 1000000
+    name = slug.replace("-", " ").capitalize()
+    return {
+        "id": plant_id,
+        "slug": slug,
+        "scientific_name": name,
+        "common_name": f"Common {name.lower()}",
+        "family": "Plantaceae",
+        "family_common_name": "Plant family",
+        "genus": name.split(" ")[0],
+        "image_url": None,
+        "edible": number % 3 == 0,
+        "vegetable": number % 7 == 0,
+        "common_names": {"eng": [f"Common {name.lower()}"]},
+        "growth": {
+            "light": number % 11,
+            "soil_texture": (number >> 4) % 11,
+            "soil_humidity": (number >> 8) % 11,
+            "ph_minimum": 5.0 + (number % 10) / 10,
+            "ph_maximum": 6.5 + (number % 15) / 10
+        },
+        "specifications": {"maximum_height": {"cm": 10 + number % 500}, "growth_habit": "Forb/herb"},
+        "flower": {"color": None},
+        "sources": [],
+        "links": {"self": f"/api/v1/species/{slug}"}
+    }
+
+
+CATALOG = list(RECORDED.values()) + [
+    synthetic_record(f"plantae-synthetica-{n}") for n in range(1, SYNTHETIC_SPECIES + 1)]
+
+
+def list_entry(record):
+    """The subset of fields the API returns in list/search results."""
+    fields = ("id", "slug", "scientific_name", "common_name", "family",
+              "family_common_name", "genus", "image_url", "links")
+    return {field: record.get(field) for field in fields}
+
+
+def paginate(records, path, **params):
+    """Return one page of records with FloraCodex-style links and meta."""
+    page = max(int(request.args.get("page", 1)), 1)
+    last = max((len(records) + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+    query = "".join(f"&{name}={value}" for name, value in params.items())
+    links = {
+        "self": f"{path}?page={page}{query}",
+        "first": f"{path}?page=1{query}",
+        "last": f"{path}?page={last}{query}"
+    }
+    if page < last:
+        links["next"] = f"{path}?page={page + 1}{query}"
+    if page > 1:
+        links["prev"] = f"{path}?page={page - 1}{query}"
+    start = (page - 1) * PAGE_SIZE
+    data = [list_entry(record) for record in records[start:start + PAGE_SIZE]]
+    return jsonify(data=data, links=links, meta={"total": len(records)})
+
+
+@app.before_request
+def simulate_network():
+    """Sleep for latency +/- jitter, then fail a fraction of requests."""
+    delay = settings["latency_ms"] + random.uniform(-1, 1) * settings["jitter_ms"]
+    time.sleep(max(delay, 0) / 1000)
+    if random.random() < settings["error_rate"]:
+        return jsonify(error=True, message="Simulated upstream failure"), 503
+
+
+@app.route("/api/v1/species/search")
+def search():
+    term = request.args.get("q", "").lower()
+    matches = [record for record in CATALOG
+               if term in record["scientific_name"].lower()
+               or term in (record.get("common_name") or "").lower()]
+    return paginate(matches, "/api/v1/species/search", q=term)
+
+
+@app.route("/api/v1/species")
+def list_species():
+    return paginate(CATALOG, "/api/v1/species")
+
+
+@app.route("/api/v1/species/<slug>")
+def species_detail(slug):
+    if slug.startswith("missing-"):
+        return jsonify(error=True, message="Record not found"), 404
+    record = RECORDED.get(slug) or synthetic_record(slug)
+    return jsonify(data=record, meta={"last_modified": "2021-01-01T00:00:00.000Z"})
+
+
+def configure(latency_ms=None, jitter_ms=None, error_rate=None):
+    for name, value in (("latency_ms", latency_ms), ("jitter_ms", jitter_ms), ("error_rate", error_rate)):
+        if value is not None:
+            settings[name] = value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake FloraCodex API server.")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--latency-ms", type=float, default=settings["latency_ms"])
+    parser.add_argument("--jitter-ms", type=float, default=settings["jitter_ms"])
+    parser.add_argument("--error-rate", type=float, default=settings["error_rate"])
+    args = parser.parse_args()
+    configure(args.latency_ms, args.jitter_ms, args.error_rate)
+    app.run(port=args.port, threaded=True)
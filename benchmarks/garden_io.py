@@ -0,0 +1,108 @@
+"""Throughput benchmark for garden export and import.
+
+Writes a generated garden file (by default 1M plant memberships), imports
+it for a benchmark user, then exports that user's garden again, and reports
+records per second and peak memory for each step.
+
+Needs a Postgres database (DATABASE_URL); the benchmark user's existing
+areas and lists are deleted first.
+
+Usage:
+    python -m benchmarks.garden_io
+    python -m benchmarks.garden_io --format csv --memberships 200000
+"""
+import argparse
+import os
+import random
+import resource
+import tempfile
+import time
+
+from app import create_app
+from models import db, User, GrowingArea, PlantList
+from passwords import hash_password
+import garden_io
+
+# Plant ids well clear of the ones seed.py and the API use
+FIRST_PLANT_ID = 50000000
+
+
+def generated_records(areas, lists, plants, memberships, seed):
+    """Yield garden file records for a generated garden."""
+    rng = random.Random(seed)
+    for n in range(areas):
+        yield {"type": "growing_area", "name": f"Bed {n + 1}", "description": "Generated growing area",
+               "light_level": "Full Sun", "soil_texture": "Loam", "soil_moisture": "Medium",
+               "soil_ph": round(rng.uniform(4.5, 8.5), 1), "notes": ""}
+    for n in range(lists):
+        yield {"type": "plant_list", "name": f"List {n + 1}", "description": "",
+               "growing_area": f"Bed {rng.randrange(areas) + 1}" if areas else None}
+    per_list = memberships // lists
+    for n in range(lists):
+        start = rng.randrange(plants)
+        for offset in range(min(per_list, plants)):
+            plant_id = FIRST_PLANT_ID + (start + offset) % plants
+            yield {"type": "plant", "plant_list": f"List {n + 1}", "plant_id": plant_id,
+                   "slug": f"bench-plant-{plant_id}", "scientific_name": f"Plantae benchii {plant_id}",
+                   "image_url": ""}
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def report(step, records, seconds):
+    print(f"{step}: {records} records in {seconds:.1f}s "
+          f"({records / max(seconds, 1e-9):.0f} records/s), peak RSS {peak_rss_mb():.0f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark garden export and import.")
+    parser.add_argument("--memberships", type=int, default=1000000)
+    parser.add_argument("--lists", type=int, default=200)
+    parser.add_argument("--areas", type=int, default=20)
+    parser.add_argument("--plants", type=int, default=100000, help="distinct plants to spread memberships over")
+    parser.add_argument("--format", choices=sorted(garden_io.FORMATS), default="ndjson")
+    parser.add_argument("--batch-size", type=int, default=garden_io.IMPORT_BATCH_SIZE)
+    parser.add_argument("--username", default="garden-benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), f"garden.{args.format}")
+    start = time.perf_counter()
+    records = 0
+    with open(path, "w") as out:
+        for chunk in garden_io.format_records(
+                generated_records(args.areas, args.lists, args.plants, args.memberships, args.seed), args.format):
+            out.write(chunk)
+            records += chunk.count("\n")
+    if args.format == "csv":
+        records -= 1
+    report(f"generate {path} ({os.path.getsize(path) / 1e6:.0f}MB)", records, time.perf_counter() - start)
+
+    with create_app(migrations=False).app_context():
+        user = User.query.filter_by(username=args.username).first()
+        if user is None:
+            user = User(username=args.username, email=f"{args.username}@example.com", first_name="Garden",
+                        last_name="Benchmark", password=hash_password("password"))
+            db.session.add(user)
+        else:
+            PlantList.query.filter_by(user_id=user.id).delete()
+            GrowingArea.query.filter_by(user_id=user.id).delete()
+        db.session.commit()
+
+        start = time.perf_counter()
+        with open(path, "rb") as garden_file:
+            counts = garden_io.import_garden(user.id, garden_file, args.format, args.batch_size)
+        db.session.commit()
+        report(f"import {counts}", records, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        exported = sum(chunk.count("\n") for chunk in garden_io.export_garden(user.id, args.format))
+        report("export", exported - (1 if args.format == "csv" else 0), time.perf_counter() - start)
+
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Rebuild time and memory for plant recommendations.
+
+Generates plant list memberships in memory (plant popularity is skewed as
+in seed.py) and times recommendations.neighbors_from_memberships over them,
+or with --database times a full rebuild() of the plant_recommendations table
+from DATABASE_URL.
+
+Usage:
+    python -m benchmarks.recommendations                          # 10M memberships
+    python -m benchmarks.recommendations --memberships 1000000 --block-size 256
+    python -m benchmarks.recommendations --database
+"""
+import argparse
+import resource
+import time
+import tracemalloc
+
+import numpy as np
+
+import recommendations
+
+# Same skew as seed.py's PLANT_POPULARITY_SKEW
+PLANT_POPULARITY_SKEW = 1.1
+
+
+def generated_memberships(memberships, lists, plants, seed):
+    """Parallel arrays of list ids and plant ids, without repeats."""
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, plants + 1) ** PLANT_POPULARITY_SKEW
+    weights /= weights.sum()
+    pairs = np.array([], dtype=np.int64)
+    # Popular plants land on the same list twice; draw more until there
+    # are enough distinct memberships
+    while len(pairs) < memberships:
+        wanted = (memberships - len(pairs)) * 3 // 2 + 1000
+        drawn = rng.integers(0, lists, wanted) * plants + rng.choice(plants, wanted, p=weights)
+        pairs = np.unique(np.concatenate([pairs, drawn]))
+    pairs = rng.permutation(pairs)[:memberships]
+    return pairs // plants, pairs % plants
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rebuilding plant recommendations.")
+    parser.add_argument("--memberships", type=int, default=10000000)
+    parser.add_argument("--lists", type=int, default=400000)
+    parser.add_argument("--plants", type=int, default=100000)
+    parser.add_argument("--neighbors", type=int, default=recommendations.NEIGHBORS)
+    parser.add_argument("--block-size", type=int, default=recommendations.BLOCK_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database", action="store_true",
+                        help="rebuild the plant_recommendations table from DATABASE_URL instead")
+    args = parser.parse_args()
+
+    if args.database:
+        from app import create_app
+        from models import db
+
+        with create_app(migrations=False).app_context():
+            start = time.perf_counter()
+            count = recommendations.rebuild(args.neighbors, args.block_size)
+            db.session.commit()
+        print(f"rebuild: {count} plants in {time.perf_counter() - start:.1f}s, peak RSS {peak_rss_mb():.0f}MB")
+        return
+
+    start = time.perf_counter()
+    list_ids, plant_ids = generated_memberships(args.memberships, args.lists, args.plants, args.seed)
+    print(f"generate: {len(list_ids)} memberships in {time.perf_counter() - start:.1f}s, "
+          f"peak RSS {peak_rss_mb():.0f}MB")
+
+    def run():
+        return sum(1 for row in recommendations.neighbors_from_memberships(
+            list_ids, plant_ids, args.neighbors, args.block_size))
+
+    start = time.perf_counter()
+    count = run()
+    seconds = time.perf_counter() - start
+    print(f"neighbors: {count} plants in {seconds:.1f}s ({len(list_ids) / seconds:.0f} memberships/s)")
+
+    # Again with tracing, which is slow. NumPy reports its allocations to
+    # tracemalloc, so this measures the rebuild alone, not the generated arrays.
+    tracemalloc.start()
+    run()
+    print(f"neighbors: peak allocated {tracemalloc.get_traced_memory()[1] / 1024 / 1024:.0f}MB")
+    tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""End-to-end benchmark for the plant and garden routes.
+
+Starts the fake FloraCodex API and the app in this process, then drives
+/search, /autocomplete, /plant/<slug>, /<username>/garden and
+/<username>/plant-list/<id> with concurrent clients. Reports p50/p95/p99 latency, throughput and SQL
+queries per request for each route, and saves the results as JSON so runs
+can be compared.
+
+Needs a database (DATABASE_URL) seeded with e.g.
+    python seed.py --users 1000 --lists 4000 --memberships 40000
+
+Usage:
+    python -m benchmarks.run --requests 400 --concurrency 16
+    python -m benchmarks.run --compare benchmarks/results/<earlier>.json
+    python -m benchmarks.run --url http://127.0.0.1:8000 --list-id 12   # an already running server
+    python -m benchmarks.run --routes plant --cold-plants                 # every request misses the cache
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from werkzeug.serving import make_server
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+QUERY_COUNT_HEADER = "X-Query-Count"
+
+
+def serve_in_background(wsgi_app):
+    """Serve wsgi_app on a free local port in a daemon thread. Returns base URL."""
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, wsgi_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def start_fake_api(latency_ms, jitter_ms, error_rate):
+    from benchmarks import fake_floracodex
+    fake_floracodex.configure(latency_ms, jitter_ms, error_rate)
+    return serve_in_background(fake_floracodex.app)
+
+
+def start_app():
+    """Import the app pointed at the fake API and serve it, counting the SQL
+    statements each request runs in a response header."""
+    from sqlalchemy import event
+    from app import create_app, db
+
+    app = create_app("production", migrations=False)
+    counter = threading.local()
+
+    @event.listens_for(db.engine, "before_cursor_execute")
+    def count_query(*args):
+        counter.queries = getattr(counter, "queries", 0) + 1
+
+    @app.before_request
+    def reset_query_count():
+        counter.queries = 0
+
+    @app.after_request
+    def add_query_count(response):
+        response.headers[QUERY_COUNT_HEADER] = str(getattr(counter, "queries", 0))
+        return response
+
+    return serve_in_background(app)
+
+
+def find_plant_list(username):
+    """Return the id of one of username's plant lists, or None."""
+    from models import PlantList, User
+    plant_list = (PlantList.query.join(User, User.id == PlantList.user_id)
+                  .filter(User.username == username).first())
+    return plant_list.id if plant_list else None
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def drive(base_url, path, total, concurrency):
+    """Send `total` GETs to path from `concurrency` threads. Returns stats dict.
+
+    "{n}" in path is replaced with the request number.
+    """
+    local = threading.local()
+
+    def one_request(n):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        response = local.session.get(base_url + path.format(n=n), allow_redirects=False)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        queries = response.headers.get(QUERY_COUNT_HEADER)
+        return elapsed_ms, response.status_code, int(queries) if queries is not None else None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one_request, range(total)))
+    wall_seconds = time.perf_counter() - start
+
+    latencies = sorted(result[0] for result in results)
+    query_counts = [result[2] for result in results if result[2] is not None]
+    errors = sum(1 for result in results if result[1] >= 400)
+    return {
+        "path": path,
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "mean_ms": round(statistics.mean(latencies), 2),
+        "throughput_rps": round(total / wall_seconds, 1),
+        "queries_per_request": round(statistics.mean(query_counts), 2) if query_counts else None
+    }
+
+
+def print_results(results, baseline=None):
+    header = f"{'route':<14}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}{'queries':>9}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, stats in results.items():
+        print(f"{name:<14}{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}"
+              f"{stats['throughput_rps']:>9}{str(stats['queries_per_request']):>9}{stats['errors']:>8}")
+        if baseline and name in baseline:
+            before = baseline[name]
+            changes = []
+            for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+                if before.get(key):
+                    changes.append(f"{key} {(stats[key] - before[key]) / before[key] * 100:+.1f}%")
+            print(f"{'':<14}vs baseline: {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the plant and garden routes.")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--username", default="user1")
+    parser.add_argument("--list-id", type=int, help="plant list to request (default: one of username's)")
+    parser.add_argument("--slug", default="rosa-canina")
+    parser.add_argument("--term", default="rose")
+    parser.add_argument("--cold-plants", action="store_true",
+                        help="request a different plant each time, so /plant/<slug> always goes upstream")
+    parser.add_argument("--routes", nargs="+", choices=["search", "autocomplete", "plant", "garden", "plant-list"],
+                        help="only benchmark these routes")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--url", help="benchmark an already running server instead of starting one")
+    parser.add_argument("--output", help="where to save JSON results (default: benchmarks/results/<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    if args.url:
+        base_url = args.url.rstrip("/")
+        list_id = args.list_id
+    else:
+        os.environ["FLORACODEX_BASE_URL"] = start_fake_api(args.latency_ms, args.jitter_ms, args.error_rate)
+        # Start every run with an empty response cache
+        os.environ.setdefault("FLORACODEX_CACHE_PATH",
+                              os.path.join(tempfile.mkdtemp(), "api_cache.sqlite3"))
+        base_url = start_app()
+        list_id = args.list_id or find_plant_list(args.username)
+
+    run_id = int(time.time())
+    routes = {
+        "search": f"/search?term={args.term}",
+        "autocomplete": f"/autocomplete?prefix={args.term[:3]}",
+        "plant": f"/plant/seed-plant-{run_id}{{n}}" if args.cold_plants else f"/plant/{args.slug}",
+        "garden": f"/{args.username}/garden",
+    }
+    if list_id:
+        routes["plant-list"] = f"/{args.username}/plant-list/{list_id}"
+    else:
+        print(f"No plant list found for {args.username}; skipping plant-list route.", file=sys.stderr)
+    if args.routes:
+        routes = {name: path for name, path in routes.items() if name in args.routes}
+
+    results = {name: drive(base_url, path, args.requests, args.concurrency)
+               for name, path in routes.items()}
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as previous:
+            baseline = json.load(previous)["routes"]
+    print_results(results, baseline)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, datetime.utcnow().strftime("%Y%m%dT%H%M%SZ") + ".json")
+    with open(output, "w") as out:
+        json.dump({
+            "created": datetime.utcnow().isoformat() + "Z",
+            "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+            "routes": results
+        }, out, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Import and cold-start time benchmark.
+
+Times each step of starting the app in a fresh interpreter, several times
+over, and reports the median and fastest run:
+
+    import models      what scripts like seed.py need for the database
+    import app         the routes module and everything it imports
+    create_app         the above plus building the app
+    first request      the above plus answering GET /
+    preloaded worker   GET / in a worker forked from a master that ran
+                       create_app and warm_up, as with GUNICORN_PRELOAD=1
+
+Steps only time their own work, not the interpreter starting up; `process`
+is the whole subprocess, wall clock. No database is needed. Results are
+saved as JSON, and --compare fails the run if a step got slower than
+--max-regression percent, so it can guard against regressions.
+
+Usage:
+    python -m benchmarks.startup --runs 10
+    python -m benchmarks.startup --compare benchmarks/results/startup-<earlier>.json
+    python -X importtime -c "import app" 2>&1 | sort -t'|' -k2 -n | tail   # what's slow
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+# Same place as benchmarks.run; not imported from there, as it would load
+# requests and werkzeug before the step being timed
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+STEPS = ["import models", "import app", "create_app", "first request", "preloaded worker"]
+
+
+def run_step(step):
+    """Do one step in this (fresh) process and print its time in ms."""
+    start = time.perf_counter()
+    if step == "import models":
+        import models
+    else:
+        import app
+    if step in ("create_app", "first request"):
+        web_app = app.create_app("production", migrations=False)
+    if step == "first request":
+        web_app.test_client().get("/")
+    if step == "preloaded worker":
+        import gc
+        web_app = app.create_app("production", migrations=False)
+        app.warm_up(web_app)
+        gc.freeze()
+        pid = os.fork()
+        if pid:
+            os.waitpid(pid, 0)
+            return
+        start = time.perf_counter()
+        web_app.test_client().get("/")
+    print(json.dumps((time.perf_counter() - start) * 1000))
+    sys.stdout.flush()
+    if step == "preloaded worker":
+        os._exit(0)
+
+
+def time_step(step, runs):
+    """Median and fastest ms for step, and for its whole process, over runs."""
+    step_ms, process_ms = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-m", "benchmarks.startup", "--step", step],
+                                check=True, stdout=subprocess.PIPE, text=True).stdout
+        process_ms.append((time.perf_counter() - start) * 1000)
+        step_ms.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "median_ms": round(statistics.median(step_ms), 1),
+        "min_ms": round(min(step_ms), 1),
+        "process_median_ms": round(statistics.median(process_ms), 1)
+    }
+
+
+def print_results(results, baseline=None, max_regression=None):
+    """Print results, and return the steps slower than baseline by more
+    than max_regression percent."""
+    header = f"{'step':<18}{'median':>9}{'min':>9}{'process':>9}"
+    print(header)
+    print("-" * len(header))
+    regressions = []
+    for step, stats in results.items():
+        line = f"{step:<18}{stats['median_ms']:>9}{stats['min_ms']:>9}{stats['process_median_ms']:>9}"
+        if baseline and baseline.get(step):
+            change = (stats["median_ms"] - baseline[step]["median_ms"]) / baseline[step]["median_ms"] * 100
+            line += f"   {change:+.1f}% vs baseline"
+            if max_regression is not None and change > max_regression:
+                regressions.append(step)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import and cold-start time.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per step")
+    parser.add_argument("--steps", nargs="+", choices=STEPS, help="only time these steps")
+    parser.add_argument("--output", help="where to save JSON results (default: benchmarks/results/startup-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=20,
+                        help="with --compare, exit 1 if a median is this many percent slower")
+    parser.add_argument("--step", choices=STEPS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.step:
+        run_step(args.step)
+        return
+
+    results = {step: time_step(step, args.runs) for step in args.steps or STEPS}
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as previous:
+            baseline = json.load(previous)["steps"]
+    regressions = print_results(results, baseline, args.max_regression)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, "startup-" + datetime.utcnow().strftime("%Y%m%dT%H%M%SZ") + ".json")
+    with open(output, "w") as out:
+        json.dump({
+            "created": datetime.utcnow().isoformat() + "Z",
+            "settings": {"runs": args.runs},
+            "steps": results
+        }, out, indent=2)
+    print(f"Saved results to {output}")
+
+    if regressions:
+        print(f"Slower than baseline by more than {args.max_regression}%: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
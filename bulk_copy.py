@@ -0,0 +1,28 @@
+"""Bulk writes with Postgres COPY, for scripts and jobs that write many rows
+at once (seed.py, recommendations.rebuild)."""
+import csv
+import io
+
+# Rows buffered in memory before each COPY chunk is sent
+COPY_CHUNK = 50000
+
+
+def copy_rows(cursor, table, columns, rows):
+    """COPY an iterable of row tuples into table, COPY_CHUNK rows at a time.
+    Returns number of rows written."""
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    count = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % COPY_CHUNK == 0:
+            buffer.seek(0)
+            cursor.copy_expert(statement, buffer)
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+    if buffer.tell():
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+    return count
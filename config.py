@@ -0,0 +1,55 @@
+"""Settings profiles for create_app() in app.py.
+
+    production    the default
+    development   FLASK_ENV=development: SQL echo and the debug toolbar
+    test          its own database, no CSRF tokens, cheap password hashes
+"""
+import os
+
+
+class Config:
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgres:///botanical')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SECRET_KEY = os.environ.get('SECRET_KEY') or 'SECRET-SO-SECRET'
+    DEBUG_TOOLBAR = False
+    # bcrypt cost factor; None uses passwords.ROUNDS (the BCRYPT_ROUNDS
+    # environment variable, 12 if unset)
+    BCRYPT_ROUNDS = None
+    # Users who may see the job queue (/jobs/...), e.g. ADMIN_USERNAMES=ana,raj
+    ADMIN_USERNAMES = {name.strip() for name in os.environ.get('ADMIN_USERNAMES', '').split(',') if name.strip()}
+
+
+class ProductionConfig(Config):
+    pass
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    SQLALCHEMY_ECHO = True
+    DEBUG_TOOLBAR = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', 'postgres:///botanical_test')
+    WTF_CSRF_ENABLED = False
+    # bcrypt's minimum, so logging in a test user is quick
+    BCRYPT_ROUNDS = 4
+
+
+PROFILES = {
+    "production": ProductionConfig,
+    "development": DevelopmentConfig,
+    "test": TestConfig
+}
+
+
+def get_config(name=None):
+    """Config class for a profile name. By default FLASK_ENV=development
+    picks development and anything else production, as Flask does."""
+    if name is None:
+        name = 'development' if os.environ.get('FLASK_ENV') == 'development' else 'production'
+    return PROFILES[name]
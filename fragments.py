@@ -0,0 +1,66 @@
+"""Cache of rendered HTML fragments.
+
+The parts of the plant detail page and the search results that look the same
+to every visitor are rendered once per version of the data behind them and
+kept in a ResponseCache: an in-process LRU backed by an sqlite file that every
+worker on the machine shares. The logged-in parts of those pages (the nav
+bar, the add-plant form) are still rendered on every request.
+"""
+import json
+import os
+import tempfile
+import time
+
+from flask import render_template, Markup
+
+from api_cache import DiskStore, ResponseCache, content_version
+
+FRAGMENT_CACHE_PATH = os.environ.get(
+    'FRAGMENT_CACHE_PATH',
+    os.path.join(tempfile.gettempdir(), 'tendril_fragments.sqlite3'))
+# Fragments are a few KB each, so this caps each worker at roughly 10MB
+FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 2000))
+# Keys include the data's version, so an entry is never out of date, but each
+# new version adds a row. The disk store deletes rows past their TTL, and the
+# ones soonest to expire once it holds more than FRAGMENT_CACHE_MAX_ROWS.
+FRAGMENT_TTL = int(os.environ.get('FRAGMENT_TTL', 7 * 24 * 60 * 60))
+# ...and this the shared file at roughly 100MB
+FRAGMENT_CACHE_MAX_ROWS = int(os.environ.get('FRAGMENT_CACHE_MAX_ROWS', 20000))
+
+# Called with (template, outcome, seconds) for every fragment served, where
+# outcome is "hit" or "render"
+fragment_hooks = []
+
+cache = ResponseCache(store=DiskStore(FRAGMENT_CACHE_PATH, max_rows=FRAGMENT_CACHE_MAX_ROWS),
+                      max_entries=FRAGMENT_CACHE_MAX_ENTRIES,
+                      ttl=FRAGMENT_TTL, stale_ttl=0)
+
+
+def data_version(data):
+    """Version for data that doesn't come with one, e.g. local search results."""
+    return content_version(json.dumps(data, sort_keys=True))
+
+
+def cached_fragment(template, key, version, **context):
+    """Return template rendered with context, from the cache if possible.
+
+    key identifies what is being shown (e.g. a plant slug) and version the
+    data it was rendered from. A None version renders without caching.
+    """
+    start = time.perf_counter()
+    if version is None:
+        html = render_template(template, **context)
+        outcome = "render"
+    else:
+        rendered = []
+
+        def render():
+            rendered.append(True)
+            return 200, render_template(template, **context)
+
+        html = cache.get_or_fetch(f"{template}:{key}:{version}", render)
+        outcome = "render" if rendered else "hit"
+    elapsed = time.perf_counter() - start
+    for hook in fragment_hooks:
+        hook(template, outcome, elapsed)
+    return Markup(html)
@@ -0,0 +1,289 @@
+"""Export and import of a whole garden: growing areas, plant lists and the
+plants on each list.
+
+A garden file is a stream of records, one per line, in CSV or NDJSON. Each
+has a `type`:
+
+    growing_area  name, description, light_level, soil_texture,
+                  soil_moisture, soil_ph, notes
+    plant_list    name, description, growing_area (an area name)
+    plant         plant_list (a list name), plant_id, slug,
+                  scientific_name, image_url
+
+Exports list areas, then lists, then plants, reading each with a server-side
+cursor, so memory use doesn't grow with the garden. Imports read the upload
+a line at a time and write in batches. Areas and lists are matched to the
+user's existing ones by name and updated; plants already on a list are left
+alone.
+"""
+import codecs
+import csv
+import io
+import json
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from models import (db, GrowingArea, PlantList, PlantList_Plants, Plant, SavedSearch, LIGHT_LEVELS,
+                    SOIL_TEXTURES, SOIL_MOISTURES)
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+FIELDS = ["type", "name", "description", "light_level", "soil_texture", "soil_moisture", "soil_ph",
+          "notes", "growing_area", "plant_list", "plant_id", "slug", "scientific_name", "image_url"]
+RECORD_FIELDS = {
+    "growing_area": ["name", "description", "light_level", "soil_texture", "soil_moisture", "soil_ph", "notes"],
+    "plant_list": ["name", "description", "growing_area"],
+    "plant": ["plant_list", "plant_id", "slug", "scientific_name", "image_url"]
+}
+REQUIRED_FIELDS = {
+    "growing_area": ["name"],
+    "plant_list": ["name"],
+    "plant": ["plant_list", "plant_id", "slug", "scientific_name"]
+}
+# Longest value each text field can hold, from its column's type
+MAX_LENGTHS = {
+    kind: {name: column.type.length for name, column in model.__table__.columns.items()
+           if name in RECORD_FIELDS[kind] and getattr(column.type, "length", None)}
+    for kind, model in (("growing_area", GrowingArea), ("plant_list", PlantList), ("plant", Plant))
+}
+NUMBER_FIELDS = {"soil_ph", "plant_id"}
+# Growing area conditions take the same choices as GrowingAreaForm
+CHOICES = {"light_level": LIGHT_LEVELS, "soil_texture": SOIL_TEXTURES, "soil_moisture": SOIL_MOISTURES}
+MAX_PLANT_ID = 2 ** 31 - 1
+# Rows fetched per round trip from the server-side cursor
+EXPORT_YIELD_PER = 2000
+# Records per chunk of the response body
+EXPORT_CHUNK_RECORDS = 500
+IMPORT_BATCH_SIZE = 1000
+
+
+class GardenFileError(ValueError):
+    """A garden file record couldn't be read or imported."""
+
+    def __init__(self, line, message, last_line=None):
+        where = f"lines {line}-{last_line}" if last_line and last_line != line else f"line {line}"
+        super().__init__(f"{where}: {message}")
+        self.line = line
+
+
+#############################################################
+# Export
+#############################################################
+
+def garden_records(user_id):
+    """Yield every record in a user's garden as a dict."""
+    areas = (GrowingArea.query.filter_by(user_id=user_id).order_by(GrowingArea.id)
+             .with_entities(*(getattr(GrowingArea, name) for name in RECORD_FIELDS["growing_area"]))
+             .yield_per(EXPORT_YIELD_PER))
+    for area in areas:
+        yield {"type": "growing_area", **area._asdict()}
+
+    plant_lists = (db.session.query(PlantList.name, PlantList.description,
+                                    GrowingArea.name.label("growing_area"))
+                   .outerjoin(GrowingArea, GrowingArea.id == PlantList.growing_area)
+                   .filter(PlantList.user_id == user_id).order_by(PlantList.id)
+                   .yield_per(EXPORT_YIELD_PER))
+    for plant_list in plant_lists:
+        yield {"type": "plant_list", **plant_list._asdict()}
+
+    plants = (db.session.query(PlantList.name.label("plant_list"), Plant.id.label("plant_id"),
+                               Plant.slug, Plant.scientific_name, Plant.image_url)
+              .join(PlantList_Plants, PlantList_Plants.plant_list_id == PlantList.id)
+              .join(Plant, Plant.id == PlantList_Plants.plant_id)
+              .filter(PlantList.user_id == user_id)
+              .order_by(PlantList_Plants.plant_list_id, PlantList_Plants.plant_id)
+              .yield_per(EXPORT_YIELD_PER))
+    for plant in plants:
+        yield {"type": "plant", **plant._asdict()}
+
+
+def export_garden(user_id, fmt):
+    """Yield a user's garden as chunks of CSV or NDJSON text."""
+    return format_records(garden_records(user_id), fmt)
+
+
+def format_records(records, fmt):
+    """Yield record dicts as chunks of CSV or NDJSON text."""
+    buffer = io.StringIO()
+    if fmt == "csv":
+        writer = csv.DictWriter(buffer, FIELDS)
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(record):
+            buffer.write(json.dumps(record) + "\n")
+
+    for number, record in enumerate(records, 1):
+        write(record)
+        if number % EXPORT_CHUNK_RECORDS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+#############################################################
+# Import
+#############################################################
+
+def read_records(stream, fmt):
+    """Yield (line number, record dict) from a binary garden file stream.
+
+    Values are checked and converted to the types the tables need; raises
+    GardenFileError for a record that can't be used.
+    """
+    lines = codecs.iterdecode(stream, "utf-8")
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        records = ((reader.line_num, record) for record in reader)
+    else:
+        records = ((number, line) for number, line in enumerate(lines, 1) if line.strip())
+
+    for line, record in records:
+        if fmt != "csv":
+            try:
+                record = json.loads(record)
+            except ValueError as e:
+                raise GardenFileError(line, f"not valid JSON ({e})")
+            if not isinstance(record, dict):
+                raise GardenFileError(line, "each line must be a JSON object")
+        kind = record.get("type")
+        if kind not in RECORD_FIELDS:
+            raise GardenFileError(line, f"type must be one of: {', '.join(RECORD_FIELDS)}")
+        values = {name: record.get(name) if record.get(name) != "" else None for name in RECORD_FIELDS[kind]}
+        missing = [name for name in REQUIRED_FIELDS[kind] if values[name] is None]
+        if missing:
+            raise GardenFileError(line, f"{kind} is missing {', '.join(missing)}")
+        try:
+            if values.get("soil_ph") is not None:
+                values["soil_ph"] = float(values["soil_ph"])
+            if kind == "plant":
+                values["plant_id"] = int(values["plant_id"])
+        except (TypeError, ValueError):
+            raise GardenFileError(line, "soil_ph and plant_id must be numbers")
+        if kind == "plant" and not 0 < values["plant_id"] <= MAX_PLANT_ID:
+            raise GardenFileError(line, f"plant_id must be between 1 and {MAX_PLANT_ID}")
+        for name, value in values.items():
+            if value is None or name in NUMBER_FIELDS:
+                continue
+            if not isinstance(value, str):
+                raise GardenFileError(line, f"{name} must be a string")
+            if len(value) > MAX_LENGTHS[kind].get(name, len(value)):
+                raise GardenFileError(line, f"{name} is longer than {MAX_LENGTHS[kind][name]} characters")
+            if name in CHOICES and value not in CHOICES[name]:
+                raise GardenFileError(line, f"{name} must be one of: {', '.join(CHOICES[name])}")
+        yield line, dict(values, type=kind)
+
+
+class GardenImport:
+    """Writes garden file records for one user in batches.
+
+    Areas are flushed before the lists that name them, and lists before
+    their plants, so a file only has to mention a name before it's used.
+    Nothing is committed; the caller commits once at the end, so an import
+    is all or nothing.
+    """
+
+    def __init__(self, user_id, batch_size=IMPORT_BATCH_SIZE):
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.area_ids = {}
+        for area_id, name in (GrowingArea.query.with_entities(GrowingArea.id, GrowingArea.name)
+                              .filter_by(user_id=user_id).order_by(GrowingArea.id.desc())):
+            self.area_ids[name] = area_id
+        self.list_ids = dict(PlantList.query.with_entities(PlantList.name, PlantList.id)
+                             .filter_by(user_id=user_id))
+        self.pending = {"growing_area": [], "plant_list": [], "plant": []}
+        self.counts = {"growing_areas": 0, "plant_lists": 0, "plants": 0}
+
+    def add(self, line, record):
+        batch = self.pending[record.pop("type")]
+        batch.append((line, record))
+        if len(batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write every pending record.
+
+        If the database rejects a batch (e.g. a plant whose slug another
+        plant id already has), raises GardenFileError naming its lines.
+        """
+        for kind, write in (("growing_area", self._flush_areas), ("plant_list", self._flush_lists),
+                            ("plant", self._flush_plants)):
+            lines = [line for line, record in self.pending[kind]]
+            try:
+                write()
+            except (DataError, IntegrityError) as e:
+                reason = str(e.orig).strip().splitlines()[0]
+                raise GardenFileError(lines[0], f"couldn't be saved ({reason})", lines[-1])
+
+    def _flush_areas(self):
+        batch, self.pending["growing_area"] = self.pending["growing_area"], []
+        if not batch:
+            return
+        records = {record["name"]: record for line, record in batch}
+        updates = [dict(record, area_id=self.area_ids[name])
+                   for name, record in records.items() if name in self.area_ids]
+        if updates:
+            db.session.execute(
+                GrowingArea.__table__.update().where(GrowingArea.id == db.bindparam("area_id")), updates)
+            # Conditions may have changed; the saved search is redone when
+            # the area is next shown
+            (SavedSearch.query.filter(SavedSearch.growing_area_id.in_([row["area_id"] for row in updates]))
+             .delete(synchronize_session=False))
+        inserts = [dict(record, user_id=self.user_id)
+                   for name, record in records.items() if name not in self.area_ids]
+        if inserts:
+            inserted = db.session.execute(
+                insert(GrowingArea.__table__).values(inserts)
+                .returning(GrowingArea.id, GrowingArea.name)).fetchall()
+            self.area_ids.update((name, area_id) for area_id, name in inserted)
+        self.counts["growing_areas"] += len(records)
+
+    def _flush_lists(self):
+        batch, self.pending["plant_list"] = self.pending["plant_list"], []
+        if not batch:
+            return
+        rows = {}
+        for line, record in batch:
+            area_name = record.pop("growing_area")
+            if area_name is not None and area_name not in self.area_ids:
+                raise GardenFileError(line, f"no growing area named {area_name!r}")
+            rows[record["name"]] = dict(record, user_id=self.user_id, growing_area=self.area_ids.get(area_name))
+        stmt = insert(PlantList.__table__).values(list(rows.values()))
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_plant_lists_user_id_name",
+            set_={"description": stmt.excluded.description, "growing_area": stmt.excluded.growing_area,
+                  "updated_at": db.func.now()})
+        upserted = db.session.execute(stmt.returning(PlantList.id, PlantList.name)).fetchall()
+        self.list_ids.update((name, list_id) for list_id, name in upserted)
+        self.counts["plant_lists"] += len(rows)
+
+    def _flush_plants(self):
+        batch, self.pending["plant"] = self.pending["plant"], []
+        by_list = {}
+        for line, record in batch:
+            list_id = self.list_ids.get(record["plant_list"])
+            if list_id is None:
+                raise GardenFileError(line, f"no plant list named {record['plant_list']!r}")
+            by_list.setdefault(list_id, []).append({
+                "id": record["plant_id"],
+                "slug": record["slug"],
+                "scientific_name": record["scientific_name"],
+                "image_url": record["image_url"]
+            })
+        for list_id, plants in by_list.items():
+            self.counts["plants"] += len(PlantList.query.get(list_id).add_plants(plants))
+            # add_plants bumps plant_count with an SQL expression; write it
+            # before the next batch sets it again
+            db.session.flush()
+
+
+def import_garden(user_id, stream, fmt, batch_size=IMPORT_BATCH_SIZE):
+    """Import a garden file for a user. Returns counts of growing areas and
+    plant lists written and plants added to lists. Caller should commit."""
+    garden_import = GardenImport(user_id, batch_size)
+    for line, record in read_records(stream, fmt):
+        garden_import.add(line, record)
+    garden_import.flush()
+    return garden_import.counts
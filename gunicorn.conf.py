@@ -0,0 +1,56 @@
+"""Gunicorn settings.
+
+Two serving modes, picked with GUNICORN_WORKER_CLASS:
+
+* sync (default): one request per worker at a time.
+* gevent: each worker runs requests as greenlets. Blocking socket calls,
+  including FloraCodex requests and (through psycogreen) Postgres queries,
+  yield to other requests, so a worker can hold hundreds of requests that
+  are waiting on the upstream API.
+
+See "Serving Modes" in README.md for a benchmark comparing the two.
+
+GUNICORN_PRELOAD=1 builds the app once in the master and forks the workers
+from it, so they start without importing anything and share its memory
+copy-on-write. It is for sync workers: gevent has to patch the standard
+library before the app is imported, so it's ignored with gevent.
+"""
+import gc
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 500))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# Give up on a FloraCodex call well before the worker would be killed
+os.environ.setdefault('FLORACODEX_DEADLINE', str(timeout * 2 / 3))
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+preload_app = (worker_class == 'sync'
+               and os.environ.get('GUNICORN_PRELOAD', '').lower() in ('1', 'true', 'yes'))
+
+if worker_class == 'gevent':
+    # The FloraCodex client caps in-flight requests per worker; with gevent a
+    # worker serves far more than 8 requests at once, so raise the caps.
+    os.environ.setdefault('FLORACODEX_MAX_CONCURRENCY', '100')
+    os.environ.setdefault('FLORACODEX_POOL_SIZE', '100')
+    # A bcrypt hash would block every greenlet in the worker, so hash in a
+    # process pool instead
+    os.environ.setdefault('BCRYPT_WORKERS', '2')
+
+
+def when_ready(server):
+    """Finish warming up the preloaded app before any worker is forked."""
+    if preload_app:
+        from app import warm_up
+        from wsgi import app
+        warm_up(app)
+        # Move everything loaded so far out of the collector's reach, so
+        # collections in the workers don't write to (and copy) shared pages
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    """Make psycopg2 cooperative in gevent workers."""
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
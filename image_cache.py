@@ -0,0 +1,340 @@
+"""Resized copies of plant photos, cached on disk.
+
+The API's image_url values point at full-size originals, often several
+megabytes each. /img/<plant_id>/<size> serves a resized WebP or JPEG copy
+instead. Each copy is made once and stored in a content-addressed directory:
+files are named by the sha256 of their bytes, and every worker on the machine
+shares them. An sqlite index maps (plant, size, format) to a file and records
+when it was last used, so the directory can be trimmed back to
+IMAGE_CACHE_MAX_BYTES, least recently used first.
+
+Pillow is imported on first use, so processes that never resize an image
+don't load it.
+"""
+import hashlib
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import urljoin, urlsplit
+
+import requests
+
+from api_cache import SqlitePool
+
+IMAGE_CACHE_DIR = os.environ.get(
+    'IMAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'tendril_images'))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# Originals bigger than this aren't resized; the page falls back to the original URL
+MAX_SOURCE_BYTES = int(os.environ.get('IMAGE_MAX_SOURCE_BYTES', 20 * 1024 * 1024))
+FETCH_TIMEOUT = (3.05, 15)
+# Hosts originals are downloaded from. image_url comes from the API, but it is
+# also saved from form fields and garden imports, so any other host is refused
+# rather than fetched from inside our network.
+IMAGE_HOSTS = {host.strip().lower() for host in os.environ.get(
+    'IMAGE_HOSTS', 'bs.plantnet.org,bs.floristic.org,d2seqvvyy3b8p2.cloudfront.net').split(',') if host.strip()}
+MAX_REDIRECTS = 3
+# Longest side in pixels for each size: twice the size the templates show,
+# so images stay sharp on high-density screens.
+SIZES = {"thumb": 400, "detail": 1000}
+FORMATS = {"webp": "image/webp", "jpeg": "image/jpeg"}
+# Last-used times are only rewritten this often, so most hits don't write.
+ACCESS_RESOLUTION = 60 * 60
+
+
+class ImageUnavailable(Exception):
+    """The original image couldn't be downloaded or decoded."""
+
+    def __init__(self, url):
+        super().__init__(f"could not load image {url}")
+        self.url = url
+
+
+def allowed_url(url):
+    """Return True if url is an http(s) URL on one of IMAGE_HOSTS."""
+    try:
+        parts = urlsplit(url or "")
+        return parts.scheme in ("http", "https") and parts.hostname in IMAGE_HOSTS
+    except ValueError:
+        return False
+
+
+def load_pillow():
+    """Import Pillow and return its Image and ImageOps modules."""
+    from PIL import Image, ImageOps
+    return Image, ImageOps
+
+
+def _flatten(image):
+    """Return image as RGB, putting any transparency on a white background."""
+    if image.mode == "RGB":
+        return image
+    Image, ImageOps = load_pillow()
+    image = image.convert("RGBA")
+    background = Image.new("RGB", image.size, (255, 255, 255))
+    background.paste(image, mask=image.split()[3])
+    return background
+
+
+def render(image, max_side, fmt):
+    """Return the bytes of image shrunk to fit max_side, encoded as fmt."""
+    Image, ImageOps = load_pillow()
+    variant = image.copy()
+    variant.thumbnail((max_side, max_side), Image.LANCZOS)
+    out = io.BytesIO()
+    if fmt == "webp":
+        if variant.mode not in ("RGB", "RGBA"):
+            variant = variant.convert("RGBA")
+        variant.save(out, "WEBP", quality=80, method=4)
+    else:
+        _flatten(variant).save(out, "JPEG", quality=82, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+class ImageCache:
+    """Content-addressed store of resized plant images with an LRU size bound.
+
+    Concurrent misses for the same variant in one process share a download.
+    sqlite errors are treated as misses, as in api_cache.DiskStore.
+    """
+
+    def __init__(self, root=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._pool = SqlitePool(os.path.join(root, "index.sqlite3"), schema=(
+            """CREATE TABLE IF NOT EXISTS variants (
+                plant_id INTEGER NOT NULL,
+                size TEXT NOT NULL,
+                format TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (plant_id, size, format)
+            )""",
+            "CREATE INDEX IF NOT EXISTS ix_variants_accessed ON variants (accessed)"))
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+        self._loading = {}
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "evictions": 0,
+            "errors": 0
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _get_session(self):
+        """This process's HTTP session for downloading originals."""
+        with self._lock:
+            if self._session is None or self._session_pid != os.getpid():
+                self._session = requests.Session()
+                self._session_pid = os.getpid()
+            return self._session
+
+    def path_for(self, digest, fmt):
+        return os.path.join(self.root, digest[:2], f"{digest}.{fmt}")
+
+    def lookup(self, plant_id, size, fmt):
+        """Return the digest of a stored variant, or None."""
+        now = time.time()
+        try:
+            with self._pool.connection() as conn:
+                row = conn.execute(
+                    "SELECT digest, accessed FROM variants WHERE plant_id = ? AND size = ? AND format = ?",
+                    (plant_id, size, fmt)).fetchone()
+                # The file may have been trimmed by another worker
+                if row is None or not os.path.exists(self.path_for(row[0], fmt)):
+                    return None
+                if now - row[1] > ACCESS_RESOLUTION:
+                    conn.execute(
+                        "UPDATE variants SET accessed = ? WHERE plant_id = ? AND size = ? AND format = ?",
+                        (now, plant_id, size, fmt))
+        except sqlite3.Error:
+            return None
+        return row[0]
+
+    def get(self, plant_id, size, fmt, resolve_url):
+        """Return the digest of plant_id's image at size in fmt.
+
+        On a miss, resolve_url() is called for the original's URL, which is
+        downloaded and resized. Returns None if there is no original, and
+        raises ImageUnavailable if it can't be loaded.
+        """
+        digest = self.lookup(plant_id, size, fmt)
+        if digest is not None:
+            self._count("hits")
+            return digest
+
+        key = (plant_id, size, fmt)
+        with self._lock:
+            future = self._loading.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._loading[key] = future
+        if not leader:
+            self._count("coalesced")
+            return future.result()
+
+        self._count("misses")
+        try:
+            source_url = resolve_url()
+            digest = self.build(plant_id, source_url, [(size, fmt)])[(size, fmt)] if source_url else None
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+        future.set_result(digest)
+        return digest
+
+    def _download(self, url, max_side):
+        """Fetch and decode url, decoding JPEGs at reduced scale where possible.
+        Only IMAGE_HOSTS are contacted, redirects included."""
+        Image, ImageOps = load_pillow()
+        session = self._get_session()
+        try:
+            location = url
+            for _ in range(MAX_REDIRECTS + 1):
+                if not allowed_url(location):
+                    raise ImageUnavailable(url)
+                response = session.get(location, timeout=FETCH_TIMEOUT, stream=True,
+                                       allow_redirects=False)
+                if not response.is_redirect:
+                    break
+                location = urljoin(location, response.headers["Location"])
+                response.close()
+            else:
+                raise ImageUnavailable(url)
+            with response:
+                response.raise_for_status()
+                body = io.BytesIO()
+                for chunk in response.iter_content(64 * 1024):
+                    body.write(chunk)
+                    if body.tell() > MAX_SOURCE_BYTES:
+                        raise ImageUnavailable(url)
+            body.seek(0)
+            image = Image.open(body)
+            image.draft("RGB", (max_side, max_side))
+            return ImageOps.exif_transpose(image)
+        except (requests.RequestException, OSError, Image.DecompressionBombError) as e:
+            self._count("errors")
+            raise ImageUnavailable(url) from e
+        except ImageUnavailable:
+            self._count("errors")
+            raise
+
+    def build(self, plant_id, source_url, variants):
+        """Download source_url once and store each (size, format) in variants.
+
+        Returns a dict of (size, format) -> digest.
+        """
+        image = self._download(source_url, max(SIZES[size] for size, fmt in variants))
+        digests = {}
+        for size, fmt in variants:
+            digests[(size, fmt)] = self._store(plant_id, size, fmt, render(image, SIZES[size], fmt))
+        self.trim()
+        return digests
+
+    def _store(self, plant_id, size, fmt, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest, fmt)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so other workers never see a partial file
+            partial = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(partial, "wb") as out:
+                out.write(data)
+            os.replace(partial, path)
+        try:
+            with self._pool.connection() as conn:
+                previous = conn.execute(
+                    "SELECT digest FROM variants WHERE plant_id = ? AND size = ? AND format = ?",
+                    (plant_id, size, fmt)).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO variants (plant_id, size, format, digest, bytes, accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (plant_id, size, fmt, digest, len(data), time.time()))
+                if previous and previous[0] != digest:
+                    self._remove_unreferenced(conn, previous[0], fmt)
+        except sqlite3.Error:
+            pass
+        return digest
+
+    def _remove_unreferenced(self, conn, digest, fmt):
+        """Delete digest's file if no variant points at it any more."""
+        if conn.execute("SELECT 1 FROM variants WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+            return
+        try:
+            os.remove(self.path_for(digest, fmt))
+        except FileNotFoundError:
+            pass
+
+    def trim(self):
+        """Delete least recently used variants until the cache fits in
+        max_bytes. Returns the number removed."""
+        removed = 0
+        try:
+            with self._pool.connection() as conn:
+                total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM variants").fetchone()[0]
+                while total > self.max_bytes:
+                    oldest = conn.execute(
+                        "SELECT plant_id, size, format, digest, bytes FROM variants "
+                        "ORDER BY accessed LIMIT 100").fetchall()
+                    if not oldest:
+                        break
+                    for plant_id, size, fmt, digest, size_bytes in oldest:
+                        if total <= self.max_bytes:
+                            break
+                        conn.execute("DELETE FROM variants WHERE plant_id = ? AND size = ? AND format = ?",
+                                     (plant_id, size, fmt))
+                        self._remove_unreferenced(conn, digest, fmt)
+                        total -= size_bytes
+                        removed += 1
+        except sqlite3.Error:
+            pass
+        self._count("evictions", removed)
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+cache = ImageCache()
+
+
+def prewarm_one(plant_id, image_url):
+    """Make every size and format of one plant's image that isn't stored yet."""
+    if not allowed_url(image_url):
+        return
+    missing = [(size, fmt) for size in SIZES for fmt in FORMATS
+               if cache.lookup(plant_id, size, fmt) is None]
+    if missing:
+        try:
+            cache.build(plant_id, image_url, missing)
+        except ImageUnavailable:
+            pass
+
+
+if __name__ == "__main__":
+    # Pre-warm every image we already store, e.g. after a deploy to a new machine
+    from app import create_app
+    from models import Plant
+
+    with create_app(migrations=False).app_context():
+        plants = Plant.query.with_entities(Plant.id, Plant.image_url).filter(Plant.image_url.isnot(None)).all()
+    for number, (plant_id, image_url) in enumerate(plants, 1):
+        prewarm_one(plant_id, image_url)
+        if number % 100 == 0:
+            print(f"{number}/{len(plants)} plants pre-warmed")
+    print(f"Done. {len(plants)} plants pre-warmed.")
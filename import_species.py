@@ -0,0 +1,157 @@
+"""Import the FloraCodex species catalog into the local species table.
+
+Usage:
+    python import_species.py                  # stream /api/v1/species pages
+    python import_species.py --dump FILE      # load an NDJSON dump, one species per line
+    python import_species.py --restart        # ignore saved progress, start from the top
+
+Progress is saved after every batch, so an interrupted import picks up where
+it left off. Rows are upserted on id and only rewritten when their checksum
+changes, so a re-sync of an unchanged catalog writes nothing.
+"""
+import argparse
+import hashlib
+import json
+
+from sqlalchemy.dialects.postgresql import insert
+
+from app import create_app
+from models import db, Species, CatalogSync, SavedSearch
+from trefle_requests import UpstreamUnavailable, get_species_page, trefle_token
+
+BATCH_SIZE = 500
+UPDATABLE_COLUMNS = [column.name for column in Species.__table__.columns if column.name != "id"]
+
+
+def species_row(record):
+    """Map a FloraCodex species record to a dict of Species column values."""
+    common_names = record.get("common_names") or {}
+    if isinstance(common_names, dict):
+        common_names = common_names.get("eng") or []
+    growth = record.get("growth") or {}
+    specifications = record.get("specifications") or {}
+    flower = record.get("flower") or {}
+    flower_color = flower.get("color")
+    if isinstance(flower_color, list):
+        flower_color = ",".join(flower_color)
+    maximum_height = specifications.get("maximum_height") or {}
+
+    names = [record.get("scientific_name"), record.get("common_name"),
+             *common_names, record.get("family"),
+             record.get("family_common_name"), record.get("genus")]
+
+    return {
+        "id": record["id"],
+        "slug": record["slug"],
+        "scientific_name": record["scientific_name"],
+        "common_name": record.get("common_name"),
+        "common_names": ", ".join(common_names) or None,
+        "family": record.get("family"),
+        "family_common_name": record.get("family_common_name"),
+        "genus": record.get("genus"),
+        "image_url": record.get("image_url"),
+        "light": growth.get("light"),
+        "soil_texture": growth.get("soil_texture"),
+        "soil_humidity": growth.get("soil_humidity"),
+        "ph_minimum": growth.get("ph_minimum"),
+        "ph_maximum": growth.get("ph_maximum"),
+        "maximum_height_cm": maximum_height.get("cm"),
+        "growth_habit": specifications.get("growth_habit"),
+        "flower_color": flower_color,
+        "edible": record.get("edible"),
+        "vegetable": record.get("vegetable"),
+        "search_text": " ".join(name for name in names if name),
+        "checksum": hashlib.md5(json.dumps(record, sort_keys=True).encode()).hexdigest()
+    }
+
+
+def upsert_species(rows):
+    """Insert or update a batch of rows in one executemany statement.
+
+    Existing rows are only touched if their checksum differs.
+    """
+    if not rows:
+        return
+    stmt = insert(Species.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Species.__table__.c.id],
+        set_={name: stmt.excluded[name] for name in UPDATABLE_COLUMNS},
+        where=Species.__table__.c.checksum != stmt.excluded.checksum
+    )
+    db.session.execute(stmt, rows)
+
+
+def api_batches(start_page):
+    """Yield (next_page, rows) for each page of /api/v1/species from start_page.
+
+    Pages are fetched with the same retries, backoff and circuit breaker as
+    other API calls; raises UpstreamUnavailable if a page can't be had.
+    """
+    page = start_page
+    while True:
+        status, body = get_species_page(trefle_token, page)
+        if status >= 400:
+            raise UpstreamUnavailable(f"/api/v1/species page {page} returned {status}")
+        records = body.get("data") or []
+        if not records:
+            return
+        yield page + 1, [species_row(record) for record in records]
+        if not body.get("links", {}).get("next"):
+            return
+        page += 1
+
+
+def dump_batches(path, start_line, batch_size=BATCH_SIZE):
+    """Yield (next_line, rows) for batches of an NDJSON dump from start_line."""
+    rows = []
+    line_number = 0
+    with open(path) as dump:
+        for line_number, line in enumerate(dump, start=1):
+            if line_number < start_line or not line.strip():
+                continue
+            rows.append(species_row(json.loads(line)))
+            if len(rows) >= batch_size:
+                yield line_number + 1, rows
+                rows = []
+    if rows:
+        yield line_number + 1, rows
+
+
+def run_import(dump=None, restart=False):
+    """Import species, saving progress after each batch. Returns rows processed."""
+    source = f"dump:{dump}" if dump else "api"
+    sync = CatalogSync.query.get(source)
+    if sync is None:
+        sync = CatalogSync(source=source, position=1, completed=False)
+        db.session.add(sync)
+    elif restart or sync.completed:
+        # A finished sync starts over; unchanged rows are skipped by checksum.
+        sync.position = 1
+        sync.completed = False
+    db.session.commit()
+
+    batches = dump_batches(dump, sync.position) if dump else api_batches(sync.position)
+    processed = 0
+    for next_position, rows in batches:
+        upsert_species(rows)
+        sync.position = next_position
+        db.session.commit()
+        processed += len(rows)
+        print(f"{source}: {processed} species processed (next position {next_position})")
+
+    sync.completed = True
+    # Saved searches store their results, so bring them up to date
+    SavedSearch.refresh_all()
+    db.session.commit()
+    return processed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dump", help="NDJSON file of species records to load instead of the API")
+    parser.add_argument("--restart", action="store_true", help="discard saved progress")
+    args = parser.parse_args()
+
+    with create_app(migrations=False).app_context():
+        count = run_import(dump=args.dump, restart=args.restart)
+    print(f"Done. {count} species processed.")
@@ -0,0 +1,228 @@
+"""Per-request performance instrumentation.
+
+Turned on by setting PERF_METRICS=1. For every request this records wall
+time, SQL statement count and time, and FloraCodex call count and time. The
+numbers are sent back in a Server-Timing header and added to per-route
+histograms, which /metrics serves in Prometheus text format. It also times
+every cached HTML fragment, split into cache hits and renders, and counts
+how many API requests had to open a new connection.
+
+Metrics are kept per process; with several gunicorn workers, each scrape
+sees the worker that answered it.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, has_request_context, request, Response
+from sqlalchemy import event
+
+import fragments
+import image_cache
+import trefle_requests
+
+ENABLED = os.environ.get('PERF_METRICS', '').lower() in ('1', 'true', 'yes')
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FRAGMENT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025)
+
+
+class RouteMetrics:
+    """Request duration histogram plus SQL and upstream totals for one route."""
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+
+    def observe(self, seconds, timing):
+        self.count += 1
+        self.seconds += seconds
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[index] += 1
+        self.sql_queries += timing["sql_queries"]
+        self.sql_seconds += timing["sql_seconds"]
+        self.upstream_calls += timing["upstream_calls"]
+        self.upstream_seconds += timing["upstream_seconds"]
+
+
+class FragmentMetrics:
+    """Time histogram for serving one fragment template one way (hit or render)."""
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(FRAGMENT_BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.seconds += seconds
+        for index, bound in enumerate(FRAGMENT_BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[index] += 1
+
+
+_routes = defaultdict(RouteMetrics)
+_fragments = defaultdict(FragmentMetrics)
+_lock = threading.Lock()
+
+
+def _timing():
+    """This request's counters, or None outside a request."""
+    if not has_request_context():
+        return None
+    if "perf_timing" not in g:
+        g.perf_timing = {"sql_queries": 0, "sql_seconds": 0.0,
+                         "upstream_calls": 0, "upstream_seconds": 0.0}
+    return g.perf_timing
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("perf_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["perf_query_start"].pop()
+    timing = _timing()
+    if timing is not None:
+        timing["sql_queries"] += 1
+        timing["sql_seconds"] += elapsed
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute doesn't fire for a failed statement
+    starts = exception_context.connection.info.get("perf_query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+def _record_upstream_call(path, elapsed):
+    timing = _timing()
+    if timing is not None:
+        timing["upstream_calls"] += 1
+        timing["upstream_seconds"] += elapsed
+
+
+def _record_fragment(template, outcome, elapsed):
+    with _lock:
+        _fragments[(template, outcome)].observe(elapsed)
+
+
+def _start_timer():
+    g.perf_start = time.perf_counter()
+    _timing()
+
+
+def _finish(response):
+    if "perf_start" not in g:
+        return response
+    elapsed = time.perf_counter() - g.perf_start
+    timing = _timing()
+    route = request.url_rule.rule if request.url_rule else "(unmatched)"
+    with _lock:
+        _routes[route].observe(elapsed, timing)
+
+    response.headers.add("Server-Timing", ", ".join([
+        f"app;dur={elapsed * 1000:.1f}",
+        f'db;dur={timing["sql_seconds"] * 1000:.1f};desc="{timing["sql_queries"]} queries"',
+        f'upstream;dur={timing["upstream_seconds"] * 1000:.1f};desc="{timing["upstream_calls"]} calls"'
+    ]))
+    return response
+
+
+def render_metrics():
+    """Return all metrics in Prometheus text exposition format."""
+    lines = [
+        "# HELP tendril_request_duration_seconds Request wall time by route.",
+        "# TYPE tendril_request_duration_seconds histogram",
+    ]
+    with _lock:
+        routes = sorted(_routes.items())
+        for route, metrics in routes:
+            for bound, bucket_count in zip(BUCKETS, metrics.bucket_counts):
+                lines.append(f'tendril_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {bucket_count}')
+            lines.append(f'tendril_request_duration_seconds_bucket{{route="{route}",le="+Inf"}} {metrics.count}')
+            lines.append(f'tendril_request_duration_seconds_sum{{route="{route}"}} {metrics.seconds:.6f}')
+            lines.append(f'tendril_request_duration_seconds_count{{route="{route}"}} {metrics.count}')
+
+        totals = (
+            ("tendril_sql_queries_total", "SQL statements run, by route.", "sql_queries"),
+            ("tendril_sql_seconds_total", "Time spent in SQL statements, by route.", "sql_seconds"),
+            ("tendril_upstream_calls_total", "FloraCodex API calls, by route.", "upstream_calls"),
+            ("tendril_upstream_seconds_total", "Time spent in FloraCodex API calls, by route.", "upstream_seconds"),
+        )
+        for name, help_text, attribute in totals:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for route, metrics in routes:
+                lines.append(f'{name}{{route="{route}"}} {getattr(metrics, attribute)}')
+
+        lines.append("# HELP tendril_fragment_seconds Time to serve a cached HTML fragment, by template and outcome.")
+        lines.append("# TYPE tendril_fragment_seconds histogram")
+        for (template, outcome), metrics in sorted(_fragments.items()):
+            labels = f'template="{template}",outcome="{outcome}"'
+            for bound, bucket_count in zip(FRAGMENT_BUCKETS, metrics.bucket_counts):
+                lines.append(f'tendril_fragment_seconds_bucket{{{labels},le="{bound}"}} {bucket_count}')
+            lines.append(f'tendril_fragment_seconds_bucket{{{labels},le="+Inf"}} {metrics.count}')
+            lines.append(f'tendril_fragment_seconds_sum{{{labels}}} {metrics.seconds:.6f}')
+            lines.append(f'tendril_fragment_seconds_count{{{labels}}} {metrics.count}')
+
+    cache_stats = trefle_requests.cache.stats()
+    lines.append("# HELP tendril_api_cache_entries FloraCodex responses held in memory.")
+    lines.append("# TYPE tendril_api_cache_entries gauge")
+    lines.append(f"tendril_api_cache_entries {cache_stats.pop('entries')}")
+    lines.append("# HELP tendril_api_cache_events_total FloraCodex response cache events.")
+    lines.append("# TYPE tendril_api_cache_events_total counter")
+    for name, value in sorted(cache_stats.items()):
+        lines.append(f'tendril_api_cache_events_total{{event="{name}"}} {value}')
+    client_stats = trefle_requests.get_client().stats()
+    lines.append("# HELP tendril_upstream_requests_total FloraCodex HTTP requests sent, by whether they "
+                 "opened a new connection (a handshake) or reused a pooled one.")
+    lines.append("# TYPE tendril_upstream_requests_total counter")
+    lines.append(f'tendril_upstream_requests_total{{connection="new"}} {client_stats["handshakes"]}')
+    lines.append(f'tendril_upstream_requests_total{{connection="reused"}} {client_stats["pool_hits"]}')
+    lines.append("# HELP tendril_image_cache_events_total Resized image cache events.")
+    lines.append("# TYPE tendril_image_cache_events_total counter")
+    for name, value in sorted(image_cache.cache.stats().items()):
+        lines.append(f'tendril_image_cache_events_total{{event="{name}"}} {value}')
+    fragment_stats = fragments.cache.stats()
+    lines.append("# HELP tendril_fragment_cache_entries Rendered fragments held in memory.")
+    lines.append("# TYPE tendril_fragment_cache_entries gauge")
+    lines.append(f"tendril_fragment_cache_entries {fragment_stats.pop('entries')}")
+    lines.append("# HELP tendril_fragment_cache_events_total Rendered fragment cache events.")
+    lines.append("# TYPE tendril_fragment_cache_events_total counter")
+    for name, value in sorted(fragment_stats.items()):
+        lines.append(f'tendril_fragment_cache_events_total{{event="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app, db):
+    """Hook instrumentation into app if PERF_METRICS is set.
+
+    Safe to call for any number of apps, or more than once for one: the
+    module-level hooks and engine listeners are only added once, so each
+    query and API call is still counted once.
+    """
+    if not ENABLED or "instrumentation" in app.extensions:
+        return
+    app.extensions["instrumentation"] = True
+    with app.app_context():
+        for name, listener in (("before_cursor_execute", _before_cursor_execute),
+                               ("after_cursor_execute", _after_cursor_execute),
+                               ("handle_error", _handle_error)):
+            if not event.contains(db.engine, name, listener):
+                event.listen(db.engine, name, listener)
+    if _record_upstream_call not in trefle_requests.upstream_call_hooks:
+        trefle_requests.upstream_call_hooks.append(_record_upstream_call)
+    if _record_fragment not in fragments.fragment_hooks:
+        fragments.fragment_hooks.append(_record_fragment)
+    # Run before the other before_request hooks so they're included in the time
+    app.before_request_funcs.setdefault(None, []).insert(0, _start_timer)
+    app.after_request(_finish)
+    app.add_url_rule("/metrics", "metrics",
+                     lambda: Response(render_metrics(), mimetype="text/plain; version=0.0.4"))
@@ -0,0 +1,308 @@
+"""Background jobs, queued in Postgres.
+
+Request handlers queue slow work with enqueue(), in the same transaction as
+the change that needs it, and a worker process runs it:
+
+    python jobs.py                                  # run a worker
+    python jobs.py --enqueue refresh_plants         # queue a job by hand
+    python jobs.py --enqueue sync_catalog --payload '{"dump": "species.ndjson"}'
+
+Failed jobs are retried with exponential backoff up to max_attempts, and
+finished ones are deleted after JOBS_RETENTION seconds (a week). The
+worker limits its own FloraCodex requests to FLORACODEX_RATE_LIMIT per second
+(5 unless set), so bulk jobs can't eat the API quota the web app needs.
+
+The API response and image caches and the autocomplete index are files on
+local disk, so what the worker builds is only seen by web processes on the
+same machine.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, Job, Plant
+
+POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL', 1))
+BACKOFF_BASE = float(os.environ.get('JOBS_BACKOFF_BASE', 30))
+BACKOFF_MAX = float(os.environ.get('JOBS_BACKOFF_MAX', 60 * 60))
+# A running job whose worker has been silent this long is assumed dead and
+# handed to another worker
+JOB_TIMEOUT = int(os.environ.get('JOBS_TIMEOUT', 15 * 60))
+# While a job runs, its worker renews the job's lock this often, so jobs that
+# take longer than JOB_TIMEOUT aren't handed out a second time
+HEARTBEAT_INTERVAL = float(os.environ.get('JOBS_HEARTBEAT_INTERVAL', JOB_TIMEOUT / 5))
+# Done and failed jobs are deleted this long after they finish
+RETENTION = int(os.environ.get('JOBS_RETENTION', 7 * 24 * 60 * 60))
+# How often each worker deletes them
+PURGE_INTERVAL = float(os.environ.get('JOBS_PURGE_INTERVAL', 60 * 60))
+PURGE_BATCH_SIZE = 1000
+REFRESH_BATCH_SIZE = 500
+
+logger = logging.getLogger("jobs")
+handlers = {}
+
+
+def handler(kind):
+    """Register a function as the handler for jobs of this kind. It is
+    called with the job's payload as keyword arguments."""
+    def register(fn):
+        handlers[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kind, payload=None, key=None, run_after=None):
+    """Queue a job. Caller should commit.
+
+    If a job with the same key is already queued or running, nothing is
+    added.
+    """
+    enqueue_many(kind, [(payload, key)], run_after)
+
+
+def enqueue_many(kind, jobs, run_after=None):
+    """Queue several jobs of one kind in a single statement. `jobs` is a list
+    of (payload, key) pairs. Caller should commit."""
+    if not jobs:
+        return
+    rows = [{"kind": kind, "payload": payload or {}, "key": key, "run_after": run_after or datetime.utcnow()}
+            for payload, key in jobs]
+    db.session.execute(
+        insert(Job.__table__).values(rows).on_conflict_do_nothing(
+            index_elements=["key"], index_where=db.text("status IN ('queued', 'running')")))
+
+
+def claim_job():
+    """Take the next job that is due, marking it running. Returns the Job or None."""
+    now = datetime.utcnow()
+    job = (Job.query
+           .filter(db.or_(db.and_(Job.status == "queued", Job.run_after <= now),
+                          db.and_(Job.status == "running",
+                                  Job.locked_at < now - timedelta(seconds=JOB_TIMEOUT))))
+           .order_by(Job.run_after)
+           .with_for_update(skip_locked=True)
+           .first())
+    if job is not None:
+        job.status = "running"
+        job.locked_at = now
+        job.attempts += 1
+    db.session.commit()
+    return job
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a job that has failed `attempts` times."""
+    return random.uniform(0.5, 1) * min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+
+
+@contextmanager
+def heartbeat(job):
+    """Renew job's locked_at every HEARTBEAT_INTERVAL while the block runs.
+
+    The renewals run in a thread on their own connection, so they commit
+    whatever state the handler's transaction is in. They stop if the job was
+    reclaimed after all.
+    """
+    engine = db.engine
+    job_id = job.id
+    renew = (Job.__table__.update()
+             .where(db.and_(Job.id == job_id, Job.status == "running", Job.attempts == job.attempts))
+             .values(locked_at=db.bindparam("now")))
+    stopped = threading.Event()
+
+    def beat():
+        while not stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                with engine.begin() as conn:
+                    if not conn.execute(renew, now=datetime.utcnow()).rowcount:
+                        return
+            except Exception:
+                logger.exception("Couldn't renew the lock on job %s", job_id)
+
+    thread = threading.Thread(target=beat, name=f"job-{job_id}-heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def run_job(job):
+    """Run a claimed job and record how it went."""
+    try:
+        fn = handlers.get(job.kind)
+        if fn is None:
+            raise LookupError(f"no handler for job kind {job.kind!r}")
+        with heartbeat(job):
+            fn(**job.payload)
+    except Exception as e:
+        db.session.rollback()
+        job.last_error = f"{type(e).__name__}: {e}"
+        if job.attempts < job.max_attempts:
+            job.status = "queued"
+            job.run_after = datetime.utcnow() + timedelta(seconds=backoff(job.attempts))
+            logger.warning("Job %s (%s) failed, will retry: %s", job.id, job.kind, job.last_error)
+        else:
+            job.status = "failed"
+            job.finished_at = datetime.utcnow()
+            logger.error("Job %s (%s) failed for good: %s", job.id, job.kind, job.last_error)
+    else:
+        job.status = "done"
+        job.finished_at = datetime.utcnow()
+        job.last_error = None
+    db.session.commit()
+
+
+def purge_finished():
+    """Delete done and failed jobs that finished over RETENTION seconds ago,
+    a batch per transaction. Returns the number deleted."""
+    cutoff = datetime.utcnow() - timedelta(seconds=RETENTION)
+    removed = 0
+    while True:
+        batch = (db.session.query(Job.id)
+                 .filter(Job.status.in_(("done", "failed")), Job.finished_at < cutoff)
+                 .limit(PURGE_BATCH_SIZE))
+        count = Job.query.filter(Job.id.in_(batch.subquery())).delete(synchronize_session=False)
+        db.session.commit()
+        removed += count
+        if count < PURGE_BATCH_SIZE:
+            return removed
+
+
+def work(stop=lambda: False):
+    """Claim and run jobs until stop() returns True, purging old finished
+    jobs every PURGE_INTERVAL seconds."""
+    last_purge = None
+    while not stop():
+        if last_purge is None or time.monotonic() - last_purge >= PURGE_INTERVAL:
+            removed = purge_finished()
+            if removed:
+                logger.info("Deleted %s finished jobs", removed)
+            last_purge = time.monotonic()
+        job = claim_job()
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        run_job(job)
+
+
+def status():
+    """Counts of jobs by kind and status, and how late the oldest due job is."""
+    counts = {}
+    for kind, job_status, count in (db.session.query(Job.kind, Job.status, db.func.count())
+                                    .group_by(Job.kind, Job.status)):
+        counts.setdefault(kind, {})[job_status] = count
+    oldest_due = (db.session.query(db.func.min(Job.run_after))
+                  .filter(Job.status == "queued", Job.run_after <= datetime.utcnow())
+                  .scalar())
+    return {
+        "jobs": counts,
+        "oldest_due_seconds": round((datetime.utcnow() - oldest_due).total_seconds(), 1) if oldest_due else 0
+    }
+
+
+#############################################################
+# Jobs
+#############################################################
+
+@handler("enrich_plant")
+def enrich_plant(plant_id, slug):
+    """Bring a saved plant up to date with the API, warming the API cache,
+    and make its resized images."""
+    import image_cache
+    from trefle_requests import get_one_plant, trefle_token
+
+    data = get_one_plant(trefle_token, slug).get("data")
+    plant = Plant.query.get(plant_id)
+    if data and plant is not None:
+        plant.scientific_name = data["scientific_name"]
+        if data.get("image_url"):
+            plant.image_url = data["image_url"]
+        db.session.commit()
+    if plant is not None:
+        image_cache.prewarm_one(plant.id, plant.image_url)
+
+
+@handler("refresh_plants")
+def refresh_plants():
+    """Queue enrichment for every saved plant."""
+    last_id = 0
+    while True:
+        batch = (Plant.query.with_entities(Plant.id, Plant.slug)
+                 .filter(Plant.id > last_id).order_by(Plant.id)
+                 .limit(REFRESH_BATCH_SIZE).all())
+        if not batch:
+            return
+        enqueue_many("enrich_plant", [({"plant_id": plant_id, "slug": slug}, f"enrich_plant:{plant_id}")
+                                      for plant_id, slug in batch])
+        db.session.commit()
+        last_id = batch[-1].id
+
+
+@handler("sync_catalog")
+def sync_catalog(dump=None, restart=False):
+    """Import the species catalog (see import_species.py) and rebuild its
+    autocomplete index."""
+    import autocomplete
+    from import_species import run_import
+    run_import(dump=dump, restart=restart)
+    autocomplete.build_species()
+
+
+@handler("update_autocomplete")
+def update_autocomplete(plant_ids=None):
+    """Add newly saved plants to the autocomplete index, or rebuild its
+    saved plants if plant_ids isn't given."""
+    import autocomplete
+    autocomplete.update_plants(plant_ids)
+
+
+@handler("update_recommendations")
+def update_recommendations(plant_list_id, plant_ids):
+    """Count plants newly added to a list towards their recommendations."""
+    import recommendations
+    recommendations.add_to_list(plant_list_id, plant_ids)
+    db.session.commit()
+
+
+@handler("rebuild_recommendations")
+def rebuild_recommendations():
+    """Work out every plant's recommendations from scratch, e.g. nightly, so
+    removals from lists are counted."""
+    import recommendations
+    recommendations.rebuild()
+    db.session.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background jobs, or queue one.")
+    parser.add_argument("--enqueue", metavar="KIND", choices=sorted(handlers), help="queue a job instead of working")
+    parser.add_argument("--payload", default="{}", help="JSON arguments for the queued job")
+    args = parser.parse_args()
+
+    # Must be set before the app creates its FloraCodex client
+    os.environ.setdefault("FLORACODEX_RATE_LIMIT", "5")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    from app import create_app
+
+    with create_app(migrations=False).app_context():
+        if args.enqueue:
+            enqueue(args.enqueue, json.loads(args.payload))
+            db.session.commit()
+            print(f"Queued {args.enqueue}.")
+        else:
+            stopping = []
+            signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+            logger.info("Worker started; handling %s", ", ".join(sorted(handlers)))
+            work(stop=lambda: bool(stopping))
+            logger.info("Worker stopped")
@@ -0,0 +1,74 @@
+"""local species catalog for search
+
+The species and catalog_syncs tables were added to db.create_all() after the
+app first shipped, so a database stamped at 9b68faa19f72 may or may not
+have them already; they are only created if missing.
+
+Revision ID: 2a6d1c8e4b73
+Revises: 9b68faa19f72
+Create Date: 2026-10-17 17:22:00.000000
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2a6d1c8e4b73'
+down_revision = '9b68faa19f72'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    # Offline (--sql) there's no database to look at; assume a fresh one
+    existing = [] if context.is_offline_mode() else sa.inspect(op.get_bind()).get_table_names()
+    if 'species' not in existing:
+        op.create_table('species',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('slug', sa.String(), nullable=False),
+        sa.Column('scientific_name', sa.String(), nullable=False),
+        sa.Column('common_name', sa.String(), nullable=True),
+        sa.Column('common_names', sa.Text(), nullable=True),
+        sa.Column('family', sa.String(), nullable=True),
+        sa.Column('family_common_name', sa.String(), nullable=True),
+        sa.Column('genus', sa.String(), nullable=True),
+        sa.Column('image_url', sa.String(), nullable=True),
+        sa.Column('light', sa.SmallInteger(), nullable=True),
+        sa.Column('soil_texture', sa.SmallInteger(), nullable=True),
+        sa.Column('soil_humidity', sa.SmallInteger(), nullable=True),
+        sa.Column('ph_minimum', sa.Float(), nullable=True),
+        sa.Column('ph_maximum', sa.Float(), nullable=True),
+        sa.Column('maximum_height_cm', sa.Integer(), nullable=True),
+        sa.Column('growth_habit', sa.String(), nullable=True),
+        sa.Column('flower_color', sa.String(), nullable=True),
+        sa.Column('edible', sa.Boolean(), nullable=True),
+        sa.Column('vegetable', sa.Boolean(), nullable=True),
+        sa.Column('search_text', sa.Text(), nullable=False),
+        sa.Column('checksum', sa.String(length=32), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('slug')
+        )
+        op.create_index('ix_species_search_fts', 'species',
+                        [sa.text("to_tsvector('simple', search_text)")],
+                        postgresql_using='gin')
+        op.create_index('ix_species_search_trgm', 'species', ['search_text'],
+                        postgresql_using='gin',
+                        postgresql_ops={'search_text': 'gin_trgm_ops'})
+    if 'catalog_syncs' not in existing:
+        op.create_table('catalog_syncs',
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('completed', sa.Boolean(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('source')
+        )
+
+
+def downgrade():
+    op.drop_table('catalog_syncs')
+    op.drop_index('ix_species_search_trgm', table_name='species')
+    op.drop_index('ix_species_search_fts', table_name='species')
+    op.drop_table('species')
@@ -0,0 +1,26 @@
+"""updated_at on growing areas and plant lists, for page ETags
+
+Revision ID: 3c2d8e5a61b4
+Revises: 7f1e65470312
+Create Date: 2026-10-17 17:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c2d8e5a61b4'
+down_revision = '7f1e65470312'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('growing_areas', sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False))
+    op.add_column('plant_lists', sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False))
+
+
+def downgrade():
+    op.drop_column('plant_lists', 'updated_at')
+    op.drop_column('growing_areas', 'updated_at')
@@ -0,0 +1,53 @@
+"""saved searches; indexes for matching species to growing conditions
+
+Revision ID: 5e91c0b7d2a8
+Revises: 3c2d8e5a61b4
+Create Date: 2026-10-17 17:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '5e91c0b7d2a8'
+down_revision = '3c2d8e5a61b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_species_light'), 'species', ['light'], unique=False)
+    op.create_index(op.f('ix_species_soil_texture'), 'species', ['soil_texture'], unique=False)
+    op.create_index(op.f('ix_species_soil_humidity'), 'species', ['soil_humidity'], unique=False)
+    op.create_index('ix_species_ph_range', 'species', ['ph_minimum', 'ph_maximum'], unique=False)
+
+    op.create_table('saved_searches',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('growing_area_id', sa.Integer(), nullable=True),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('light_level', sa.String(), nullable=True),
+    sa.Column('soil_texture', sa.String(), nullable=True),
+    sa.Column('soil_moisture', sa.String(), nullable=True),
+    sa.Column('soil_ph', sa.Float(), nullable=True),
+    sa.Column('species_ids', postgresql.ARRAY(sa.Integer()), nullable=False),
+    sa.Column('result_count', sa.Integer(), nullable=False),
+    sa.Column('computed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['growing_area_id'], ['growing_areas.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_saved_searches_growing_area_id'), 'saved_searches', ['growing_area_id'], unique=False)
+    op.create_index(op.f('ix_saved_searches_user_id'), 'saved_searches', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_saved_searches_user_id'), table_name='saved_searches')
+    op.drop_index(op.f('ix_saved_searches_growing_area_id'), table_name='saved_searches')
+    op.drop_table('saved_searches')
+    op.drop_index('ix_species_ph_range', table_name='species')
+    op.drop_index(op.f('ix_species_soil_humidity'), table_name='species')
+    op.drop_index(op.f('ix_species_soil_texture'), table_name='species')
+    op.drop_index(op.f('ix_species_light'), table_name='species')
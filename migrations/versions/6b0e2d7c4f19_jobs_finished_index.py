@@ -0,0 +1,25 @@
+"""index for deleting old finished jobs
+
+Revision ID: 6b0e2d7c4f19
+Revises: f81c3a9d5e27
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b0e2d7c4f19'
+down_revision = 'f81c3a9d5e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_jobs_finished', 'jobs', ['finished_at'], unique=False,
+                    postgresql_where=sa.text("status IN ('done', 'failed')"))
+
+
+def downgrade():
+    op.drop_index('ix_jobs_finished', table_name='jobs')
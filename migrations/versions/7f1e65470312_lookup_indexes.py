@@ -0,0 +1,44 @@
+"""index foreign keys on hot lookup paths; unique plant list names per user
+
+Revision ID: 7f1e65470312
+Revises: 2a6d1c8e4b73
+Create Date: 2026-10-17 17:25:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f1e65470312'
+down_revision = '2a6d1c8e4b73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_growing_areas_user_id'), 'growing_areas', ['user_id'], unique=False)
+    op.create_index(op.f('ix_plant_lists_growing_area'), 'plant_lists', ['growing_area'], unique=False)
+    op.create_index(op.f('ix_plant_list_plants_plant_id'), 'plant_list_plants', ['plant_id'], unique=False)
+    # Names weren't unique before, so rename all but the oldest of a user's
+    # lists with the same name to "name (id)", cut to fit String(30)
+    op.execute("""
+        UPDATE plant_lists
+        SET name = left(name, 30 - length(' (' || id || ')')) || ' (' || id || ')'
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (PARTITION BY user_id, name ORDER BY id) AS n
+                FROM plant_lists
+            ) ranked
+            WHERE n > 1
+        )
+    """)
+    # Also serves lookups of a user's plant lists by user_id
+    op.create_unique_constraint('uq_plant_lists_user_id_name', 'plant_lists', ['user_id', 'name'])
+
+
+def downgrade():
+    op.drop_constraint('uq_plant_lists_user_id_name', 'plant_lists', type_='unique')
+    op.drop_index(op.f('ix_plant_list_plants_plant_id'), table_name='plant_list_plants')
+    op.drop_index(op.f('ix_plant_lists_growing_area'), table_name='plant_lists')
+    op.drop_index(op.f('ix_growing_areas_user_id'), table_name='growing_areas')
@@ -0,0 +1,80 @@
+"""initial schema
+
+Tables as created by db.create_all() in seed.py before the species catalog
+was added. Databases created that way should be marked as up to date with
+`flask db stamp 9b68faa19f72` before running `flask db upgrade`.
+
+Revision ID: 9b68faa19f72
+Revises:
+Create Date: 2026-10-17 17:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b68faa19f72'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('email', sa.Text(), nullable=False),
+    sa.Column('username', sa.Text(), nullable=False),
+    sa.Column('first_name', sa.Text(), nullable=False),
+    sa.Column('last_name', sa.Text(), nullable=False),
+    sa.Column('password', sa.Text(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('username')
+    )
+    op.create_table('plants',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('slug', sa.String(), nullable=False),
+    sa.Column('scientific_name', sa.String(), nullable=False),
+    sa.Column('image_url', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('slug')
+    )
+    op.create_table('growing_areas',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=True),
+    sa.Column('description', sa.String(length=200), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('light_level', sa.String(), nullable=True),
+    sa.Column('soil_texture', sa.String(), nullable=True),
+    sa.Column('soil_moisture', sa.String(), nullable=True),
+    sa.Column('soil_ph', sa.Float(), nullable=True),
+    sa.Column('notes', sa.String(length=400), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('plant_lists',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=30), nullable=False),
+    sa.Column('description', sa.String(length=300), nullable=True),
+    sa.Column('growing_area', sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['growing_area'], ['growing_areas.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('plant_list_plants',
+    sa.Column('plant_list_id', sa.Integer(), nullable=False),
+    sa.Column('plant_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['plant_id'], ['plants.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['plant_list_id'], ['plant_lists.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('plant_list_id', 'plant_id')
+    )
+
+
+def downgrade():
+    op.drop_table('plant_list_plants')
+    op.drop_table('plant_lists')
+    op.drop_table('growing_areas')
+    op.drop_table('plants')
+    op.drop_table('users')
@@ -0,0 +1,30 @@
+"""plant_lists.plant_count counter
+
+Revision ID: d2b6e4f0a913
+Revises: a4f3b9e17c05
+Create Date: 2026-10-17 18:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b6e4f0a913'
+down_revision = 'a4f3b9e17c05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('plant_lists', sa.Column('plant_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute("""
+        UPDATE plant_lists SET plant_count = counts.plant_count
+        FROM (SELECT plant_list_id, count(*) AS plant_count
+              FROM plant_list_plants GROUP BY plant_list_id) AS counts
+        WHERE plant_lists.id = counts.plant_list_id
+    """)
+
+
+def downgrade():
+    op.drop_column('plant_lists', 'plant_count')
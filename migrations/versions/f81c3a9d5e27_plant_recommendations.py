@@ -0,0 +1,32 @@
+"""plant_recommendations lookup table
+
+Revision ID: f81c3a9d5e27
+Revises: d2b6e4f0a913
+Create Date: 2026-10-17 18:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f81c3a9d5e27'
+down_revision = 'd2b6e4f0a913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('plant_recommendations',
+    sa.Column('plant_id', sa.Integer(), nullable=False),
+    sa.Column('neighbor_ids', postgresql.ARRAY(sa.Integer()), nullable=False),
+    sa.Column('counts', postgresql.ARRAY(sa.Integer()), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['plant_id'], ['plants.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('plant_id')
+    )
+
+
+def downgrade():
+    op.drop_table('plant_recommendations')
@@ -1,9 +1,35 @@
-from flask_bcrypt import Bcrypt
+from urllib.parse import urlencode
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, insert
+from passwords import hash_password, check_password, needs_rehash
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
+# Growing area conditions (the choices in GrowingAreaForm) as ranges on the
+# FloraCodex 0-10 scales stored in Species
+LIGHT_LEVELS = {
+    "Full Sun": (7, 10),
+    "Partial Sun/Shade": (4, 6),
+    "Full Shade": (0, 3)
+}
+# 0 is clay, 10 is rock
+SOIL_TEXTURES = {
+    "Clay": (0, 2),
+    "Loam": (3, 5),
+    "Sandy": (6, 8),
+    "Rocky": (9, 10)
+}
+# 0 is very dry (xerophile), 10 is underwater
+SOIL_MOISTURES = {
+    "Dry": (0, 3),
+    "Medium": (4, 5),
+    "Damp": (6, 7),
+    "Wet": (8, 10)
+}
+# Most results a saved search stores
+SAVED_SEARCH_LIMIT = 500
+
 class User(db.Model):
     """User in the system."""
 
@@ -52,7 +78,7 @@ class User(db.Model):
     def signup(cls, username, email, password, first_name, last_name):
         """Sign up user. Hashes password and adds user to system."""
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hash_password(password)
 
         user = User(
             username=username,
@@ -71,13 +97,18 @@ class User(db.Model):
         If can't find matching user or password is wrong, returns False.
         If user is found and password is correct,
         returns user instance.
+
+        If the stored hash uses an outdated cost factor, it is replaced with
+        a fresh hash (caller should commit).
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = check_password(user.password, password)
             if is_auth:
+                if needs_rehash(user.password):
+                    user.password = hash_password(password)
                 return user
 
         return False
@@ -102,7 +133,8 @@ class GrowingArea(db.Model):
     )
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete="cascade")
+        db.ForeignKey('users.id', ondelete="cascade"),
+        index=True
     )
     user = db.relationship('User', backref="growing_areas")
 
@@ -121,6 +153,13 @@ class GrowingArea(db.Model):
     notes = db.Column(
         db.String(400)
     )
+    # Bumped on every change, for page ETags
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.func.now(),
+        onupdate=db.func.now()
+    )
 
     def __repr__(self):
         return f"<Growing Area #{self.id}: {self.name}, User #{self.user}>"
@@ -149,6 +188,205 @@ class Plant(db.Model):
         db.String
     )
 
+class Species(db.Model):
+    """Local copy of the FloraCodex species catalog.
+
+    Filled by import_species.py so that /search can be answered from our own
+    database. Needs the pg_trgm extension for the trigram index.
+    """
+    __tablename__ = "species"
+
+    id = db.Column(
+        db.Integer,
+        primary_key = True
+    )
+    slug = db.Column(
+        db.String,
+        nullable=False,
+        unique=True
+    )
+    scientific_name = db.Column(
+        db.String,
+        nullable=False
+    )
+    common_name = db.Column(
+        db.String
+    )
+    # Comma-separated English common names
+    common_names = db.Column(
+        db.Text
+    )
+    family = db.Column(
+        db.String
+    )
+    family_common_name = db.Column(
+        db.String
+    )
+    genus = db.Column(
+        db.String
+    )
+    image_url = db.Column(
+        db.String
+    )
+    # Filterable growing attributes (FloraCodex 0-10 scales where noted).
+    # Each has its own index so Postgres can AND together whichever ones a
+    # search filters on with a bitmap scan.
+    light = db.Column(
+        db.SmallInteger,
+        index=True
+    )
+    soil_texture = db.Column(
+        db.SmallInteger,
+        index=True
+    )
+    soil_humidity = db.Column(
+        db.SmallInteger,
+        index=True
+    )
+    ph_minimum = db.Column(
+        db.Float
+    )
+    ph_maximum = db.Column(
+        db.Float
+    )
+    maximum_height_cm = db.Column(
+        db.Integer
+    )
+    growth_habit = db.Column(
+        db.String
+    )
+    flower_color = db.Column(
+        db.String
+    )
+    edible = db.Column(
+        db.Boolean
+    )
+    vegetable = db.Column(
+        db.Boolean
+    )
+    # All names in one string; this is what the search indexes cover
+    search_text = db.Column(
+        db.Text,
+        nullable=False,
+        default=""
+    )
+    # md5 of the source record, so re-syncs only rewrite rows that changed
+    checksum = db.Column(
+        db.String(32),
+        nullable=False
+    )
+
+    __table_args__ = (
+        db.Index('ix_species_search_fts',
+                 db.func.to_tsvector('simple', search_text),
+                 postgresql_using='gin'),
+        db.Index('ix_species_search_trgm', search_text,
+                 postgresql_using='gin',
+                 postgresql_ops={'search_text': 'gin_trgm_ops'}),
+        db.Index('ix_species_ph_range', 'ph_minimum', 'ph_maximum'),
+    )
+
+    def __repr__(self):
+        return f"<Species #{self.id}: {self.scientific_name}>"
+
+    def serialize(self):
+        """Return dict in the same shape as a FloraCodex species record."""
+        return {
+            "id": self.id,
+            "slug": self.slug,
+            "scientific_name": self.scientific_name,
+            "common_name": self.common_name,
+            "family": self.family,
+            "family_common_name": self.family_common_name,
+            "genus": self.genus,
+            "image_url": self.image_url
+        }
+
+    # Path of the local search's page cursors, which stand in for the API's
+    # links.next; /search/next answers them from the catalog
+    SEARCH_PATH = "/search/local"
+
+    @classmethod
+    def search(cls, search_term, page=1, limit=30):
+        """Search the local catalog by name, a page of `limit` at a time.
+
+        Returns a dict shaped like a FloraCodex search response, so callers
+        can use it in place of quick_search.
+        """
+        term = search_term.strip()
+        if not term:
+            return {"data": [], "links": {}, "meta": {"total": 0}}
+        ts_query = db.func.plainto_tsquery('simple', term)
+        document = db.func.to_tsvector('simple', cls.search_text)
+        # % and _ in the term are meant literally
+        pattern = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = cls.query.filter(db.or_(document.op('@@')(ts_query),
+                                        cls.search_text.ilike(f'%{pattern}%', escape='\\')))
+        results = (query
+                   .order_by(db.func.ts_rank(document, ts_query).desc(),
+                             cls.scientific_name)
+                   .offset((page - 1) * limit)
+                   .limit(limit + 1)
+                   .all())
+        links = {"self": f"{cls.SEARCH_PATH}?{urlencode({'q': term, 'page': page, 'limit': limit})}"}
+        if len(results) > limit:
+            links["next"] = f"{cls.SEARCH_PATH}?{urlencode({'q': term, 'page': page + 1, 'limit': limit})}"
+        # Only count when there is more than this one page
+        if page == 1 and len(results) <= limit:
+            total = len(results)
+        else:
+            total = query.order_by(None).count()
+        return {
+            "data": [species.serialize() for species in results[:limit]],
+            "links": links,
+            "meta": {"total": total}
+        }
+
+    @classmethod
+    def matching_conditions(cls, light_level=None, soil_texture=None, soil_moisture=None, soil_ph=None):
+        """Query for species suited to a growing area's conditions.
+
+        Takes the GrowingArea values, e.g. light_level="Full Sun". Conditions
+        left as None are ignored; the others only match species whose
+        attribute is known and in range.
+        """
+        query = cls.query
+        for column, scale, value in ((cls.light, LIGHT_LEVELS, light_level),
+                                     (cls.soil_texture, SOIL_TEXTURES, soil_texture),
+                                     (cls.soil_humidity, SOIL_MOISTURES, soil_moisture)):
+            if value:
+                low, high = scale[value]
+                query = query.filter(column.between(low, high))
+        if soil_ph is not None:
+            query = query.filter(cls.ph_minimum <= soil_ph, cls.ph_maximum >= soil_ph)
+        return query.order_by(cls.scientific_name)
+
+class CatalogSync(db.Model):
+    """Progress marker for a species catalog import, so it can resume."""
+    __tablename__ = "catalog_syncs"
+
+    source = db.Column(
+        db.String,
+        primary_key = True
+    )
+    # Next upstream page, or next line of a dump file, to import
+    position = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1
+    )
+    completed = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False
+    )
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=db.func.now(),
+        onupdate=db.func.now()
+    )
+
 class PlantList(db.Model):
     __tablename__ = "plant_lists"
 
@@ -168,15 +406,95 @@ class PlantList(db.Model):
     growing_area = db.Column(
         db.Integer,
         db.ForeignKey('growing_areas.id', ondelete="cascade"),
-        nullable=True
+        nullable=True,
+        index=True
     )
+    # Lookups by user_id are covered by the (user_id, name) unique index
     user_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id', ondelete="cascade"),
         nullable=False
     )
+    # Bumped on every change, for page ETags; plant lists are also touched
+    # when plants are added to or removed from them
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.func.now(),
+        onupdate=db.func.now()
+    )
+    # Kept up to date by add_plants and remove_plants, so showing how many
+    # plants a list has doesn't need a COUNT(*)
+    plant_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0"
+    )
     plants = db.relationship('Plant', secondary="plant_list_plants", backref="plant_lists")
     user = db.relationship('User', backref="plant_lists")
+    area = db.relationship('GrowingArea', backref="plant_lists")
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'name', name='uq_plant_lists_user_id_name'),
+    )
+
+    def add_plants(self, plants):
+        """Add plants to this list in two statements, however many there are.
+
+        `plants` is a list of dicts of Plant column values. Plants missing
+        from the plants table are inserted; plants already on the list are
+        skipped. Returns the ids newly added to the list. Caller should
+        commit.
+        """
+        rows = {plant["id"]: {"id": plant["id"],
+                              "slug": plant["slug"],
+                              "scientific_name": plant["scientific_name"],
+                              "image_url": plant.get("image_url")}
+                for plant in plants}
+        if not rows:
+            return []
+        db.session.execute(insert(Plant.__table__).values(list(rows.values())).on_conflict_do_nothing())
+        added = db.session.execute(
+            insert(PlantList_Plants.__table__)
+            .values([{"plant_list_id": self.id, "plant_id": plant_id} for plant_id in rows])
+            .on_conflict_do_nothing()
+            .returning(PlantList_Plants.plant_id)).fetchall()
+        if added:
+            self.updated_at = db.func.now()
+            self.plant_count = PlantList.plant_count + len(added)
+        return [row[0] for row in added]
+
+    def remove_plants(self, plant_ids):
+        """Take plants off this list in one statement. Returns the number
+        removed. Caller should commit."""
+        if not plant_ids:
+            return 0
+        removed = (PlantList_Plants.query
+                   .filter(PlantList_Plants.plant_list_id == self.id,
+                           PlantList_Plants.plant_id.in_(plant_ids))
+                   .delete(synchronize_session=False))
+        if removed:
+            self.updated_at = db.func.now()
+            self.plant_count = PlantList.plant_count - removed
+        return removed
+
+    def plant_page_query(self, after=0, limit=60):
+        """Query for up to `limit` plants on this list with ids greater than
+        `after`, in id order, for keyset pagination along the primary key.
+
+        Selects just the columns a plant card shows: id, slug,
+        scientific_name and image_url.
+        """
+        return (db.session.query(Plant.id, Plant.slug, Plant.scientific_name, Plant.image_url)
+                .join(PlantList_Plants, PlantList_Plants.plant_id == Plant.id)
+                .filter(PlantList_Plants.plant_list_id == self.id, PlantList_Plants.plant_id > after)
+                .order_by(PlantList_Plants.plant_id)
+                .limit(limit))
+
+    def plant_page(self, after=0, limit=60):
+        """Rows of plant_page_query()."""
+        return self.plant_page_query(after, limit).all()
 
 class PlantList_Plants(db.Model):
     __tablename__="plant_list_plants"
@@ -189,20 +507,237 @@ class PlantList_Plants(db.Model):
     plant_id = db.Column(
         db.Integer,
         db.ForeignKey('plants.id', ondelete="cascade"),
-        primary_key = True
+        primary_key = True,
+        index = True
+    )
+
+
+class SavedSearch(db.Model):
+    """A search for species suited to a set of growing conditions.
+
+    Results are stored as a list of species ids when the search is saved
+    (and again after each catalog import), so showing them is a primary key
+    lookup rather than a search.
+    """
+    __tablename__ = "saved_searches"
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True
+    )
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        nullable=False,
+        index=True
+    )
+    growing_area_id = db.Column(
+        db.Integer,
+        db.ForeignKey('growing_areas.id', ondelete="cascade"),
+        nullable=True,
+        index=True
+    )
+    name = db.Column(
+        db.String(50),
+        nullable=False
+    )
+    light_level = db.Column(
+        db.String
+    )
+    soil_texture = db.Column(
+        db.String
+    )
+    soil_moisture = db.Column(
+        db.String
+    )
+    soil_ph = db.Column(
+        db.Float
+    )
+    # Up to SAVED_SEARCH_LIMIT matching species ids, in display order
+    species_ids = db.Column(
+        ARRAY(db.Integer),
+        nullable=False,
+        default=list
+    )
+    # Total matches, which may be more than were stored
+    result_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0
+    )
+    computed_at = db.Column(
+        db.DateTime
+    )
+    growing_area = db.relationship('GrowingArea', backref="saved_searches")
+
+    def __repr__(self):
+        return f"<SavedSearch #{self.id}: {self.name}, {self.result_count} results>"
+
+    @classmethod
+    def for_growing_area(cls, area):
+        """Save a search for plants suited to area, with its results. Caller
+        should commit."""
+        saved_search = cls(
+            user_id=area.user_id,
+            growing_area=area,
+            name=f"Plants for {area.name}"[:50],
+            light_level=area.light_level,
+            soil_texture=area.soil_texture,
+            soil_moisture=area.soil_moisture,
+            soil_ph=area.soil_ph
+        )
+        saved_search.refresh()
+        db.session.add(saved_search)
+        return saved_search
+
+    def refresh(self):
+        """Run the search again and store its results. Caller should commit."""
+        query = Species.matching_conditions(
+            light_level=self.light_level,
+            soil_texture=self.soil_texture,
+            soil_moisture=self.soil_moisture,
+            soil_ph=self.soil_ph)
+        self.species_ids = [row.id for row in query.with_entities(Species.id).limit(SAVED_SEARCH_LIMIT)]
+        if len(self.species_ids) < SAVED_SEARCH_LIMIT:
+            self.result_count = len(self.species_ids)
+        else:
+            self.result_count = query.order_by(None).count()
+        self.computed_at = db.func.now()
+
+    def species(self):
+        """The stored results as Species, in order."""
+        if not self.species_ids:
+            return []
+        by_id = {species.id: species for species in Species.query.filter(Species.id.in_(self.species_ids))}
+        return [by_id[species_id] for species_id in self.species_ids if species_id in by_id]
+
+    @classmethod
+    def refresh_all(cls):
+        """Re-run every saved search, e.g. after the catalog changes. Caller
+        should commit."""
+        for saved_search in cls.query:
+            saved_search.refresh()
+
+
+class PlantRecommendation(db.Model):
+    """The plants most often on the same plant lists as a plant, for "gardeners
+    also grow" suggestions. Kept up to date by recommendations.py."""
+    __tablename__ = "plant_recommendations"
+
+    plant_id = db.Column(
+        db.Integer,
+        db.ForeignKey('plants.id', ondelete="cascade"),
+        primary_key=True
+    )
+    # Best first: the plants sharing the most lists with this one
+    neighbor_ids = db.Column(
+        ARRAY(db.Integer),
+        nullable=False,
+        default=list
+    )
+    # How many lists each neighbor shares with this plant, in the same order
+    counts = db.Column(
+        ARRAY(db.Integer),
+        nullable=False,
+        default=list
+    )
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.func.now(),
+        onupdate=db.func.now()
+    )
+
+
+class Job(db.Model):
+    """Background job, run by the worker in jobs.py.
+
+    Workers claim queued jobs with SELECT ... FOR UPDATE SKIP LOCKED, so any
+    number of them can share the table without taking the same job.
+    """
+    __tablename__ = "jobs"
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True
+    )
+    kind = db.Column(
+        db.String(50),
+        nullable=False
+    )
+    payload = db.Column(
+        JSONB,
+        nullable=False,
+        default=dict
+    )
+    # queued, running, done or failed
+    status = db.Column(
+        db.String(10),
+        nullable=False,
+        default="queued"
+    )
+    # Only one queued or running job can have a given key, e.g.
+    # "enrich_plant:123", so repeats of the same job aren't queued
+    key = db.Column(
+        db.String
+    )
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0
+    )
+    max_attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=5
+    )
+    # Not before this time; pushed back after each failed attempt
+    run_after = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.func.now()
+    )
+    locked_at = db.Column(
+        db.DateTime
+    )
+    finished_at = db.Column(
+        db.DateTime
+    )
+    last_error = db.Column(
+        db.Text
+    )
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.func.now()
     )
 
+    __table_args__ = (
+        # Workers only ever look for queued or running jobs
+        db.Index('ix_jobs_pending', 'run_after',
+                 postgresql_where=db.text("status IN ('queued', 'running')")),
+        db.Index('uq_jobs_pending_key', 'key', unique=True,
+                 postgresql_where=db.text("status IN ('queued', 'running')")),
+        # For deleting finished jobs once they are old enough
+        db.Index('ix_jobs_finished', 'finished_at',
+                 postgresql_where=db.text("status IN ('done', 'failed')")),
+    )
 
-# SavedSearch
-# -
-# id PK int
-# user FK >- User.id User
-# light_needs FK >- LightLevel.id LightLevel NULL
-# soil_type_needs FK >- SoilType.id NULL
-# soil_moisture_needs FK >- SoilMoisture.id NULL
-# min_height int NULL
-# max_height int NULL
-# spread int NULL
+    def __repr__(self):
+        return f"<Job #{self.id}: {self.kind}, {self.status}>"
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "payload": self.payload,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "run_after": self.run_after.isoformat() if self.run_after else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "last_error": self.last_error
+        }
 
 
 ####################################################
@@ -0,0 +1,145 @@
+"""Password hashing, with a host-wide limit on how many hashes run at once.
+
+bcrypt is deliberately slow and CPU-bound. Every gunicorn worker on a host
+shares MAX_CONCURRENT slots, held as locks on files in BCRYPT_SLOTS_DIR. A
+hash waits up to QUEUE_WAIT for a free slot and then raises HashingBusy, so
+the request can be answered with a 503 instead of piling up, and logins
+can't take every CPU away from page requests.
+
+A sync worker hashes in-process: it can only serve one request at a time
+either way. Under gevent a hash would block every greenlet in the worker,
+so gunicorn.conf.py sets BCRYPT_WORKERS and hashes go to a process pool.
+
+The cost factor is a fixed setting, BCRYPT_ROUNDS, so every worker and host
+agrees on it. `python passwords.py` suggests one for this machine.
+"""
+import fcntl
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import bcrypt
+from flask import current_app, has_app_context
+
+# Size of each worker's hashing process pool; 0 hashes in the worker itself
+HASH_WORKERS = int(os.environ.get('BCRYPT_WORKERS', 0))
+# Most hashes and checks running at once on this host, across all workers
+MAX_CONCURRENT = int(os.environ.get('BCRYPT_MAX_CONCURRENT', max(1, (os.cpu_count() or 2) // 2)))
+# How long a hash may wait for a free slot before HashingBusy
+QUEUE_WAIT = float(os.environ.get('BCRYPT_QUEUE_WAIT', 1))
+HASH_TIMEOUT = float(os.environ.get('BCRYPT_TIMEOUT', 10))
+SLOTS_DIR = os.environ.get('BCRYPT_SLOTS_DIR', os.path.join(tempfile.gettempdir(), 'tendril_bcrypt'))
+# Cost factor for new hashes, unless the app's BCRYPT_ROUNDS setting says otherwise
+ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+# suggest_rounds() aims for one hash taking about this long
+TARGET_MS = float(os.environ.get('BCRYPT_TARGET_MS', 250))
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+_executor = None
+_executor_pid = None
+
+
+class HashingBusy(Exception):
+    """Raised when every hashing slot on the host stays busy too long."""
+
+
+def _hash(password, cost):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(cost)).decode('utf-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        # Not forked from the worker, or the pool processes would inherit
+        # the slot lock held while the pool starts and never release it
+        _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS,
+                                        mp_context=multiprocessing.get_context("forkserver"))
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _acquire_slot():
+    """Lock a free slot file, waiting up to QUEUE_WAIT, or raise HashingBusy.
+    Returns the open slot file; closing it frees the slot."""
+    os.makedirs(SLOTS_DIR, exist_ok=True)
+    deadline = time.monotonic() + QUEUE_WAIT
+    while True:
+        for slot in range(MAX_CONCURRENT):
+            slot_file = open(os.path.join(SLOTS_DIR, f"slot{slot}"), "a")
+            try:
+                fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot_file
+            except BlockingIOError:
+                slot_file.close()
+        if time.monotonic() >= deadline:
+            raise HashingBusy()
+        time.sleep(0.01)
+
+
+def _run(fn, *args):
+    """Run fn in a hashing slot and return its result, or raise HashingBusy."""
+    slot_file = _acquire_slot()
+    if not HASH_WORKERS:
+        try:
+            return fn(*args)
+        finally:
+            slot_file.close()
+    try:
+        future = _get_executor().submit(fn, *args)
+    except BaseException:
+        slot_file.close()
+        raise
+    # The slot stays taken until the hash is done, even if we stop waiting
+    future.add_done_callback(lambda done: slot_file.close())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except TimeoutError:
+        raise HashingBusy()
+
+
+def cost():
+    """The cost factor for new hashes."""
+    if has_app_context() and current_app.config.get('BCRYPT_ROUNDS'):
+        return current_app.config['BCRYPT_ROUNDS']
+    return ROUNDS
+
+
+def suggest_rounds(target_ms=TARGET_MS):
+    """Return the cost factor at which one hash takes roughly target_ms here.
+
+    Times a single MIN_ROUNDS hash; each extra round doubles the cost.
+    """
+    start = time.perf_counter()
+    _hash("calibration", MIN_ROUNDS)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    extra = int(math.log2(target_ms / elapsed_ms)) if elapsed_ms < target_ms else 0
+    return max(MIN_ROUNDS, min(MAX_ROUNDS, MIN_ROUNDS + extra))
+
+
+def hash_password(password):
+    """Return a bcrypt hash of password at the current cost factor."""
+    return _run(_hash, password, cost())
+
+
+def check_password(hashed, password):
+    """Return True if password matches the bcrypt hash."""
+    return _run(_check, hashed, password)
+
+
+def needs_rehash(hashed):
+    """Return True if hashed was made with a lower cost factor than new
+    hashes use. Stronger hashes are left alone."""
+    # bcrypt hashes look like $2b$12$<salt+hash>
+    return int(hashed.split('$')[2]) < cost()
+
+
+if __name__ == "__main__":
+    print(f"Suggested BCRYPT_ROUNDS for about {TARGET_MS:.0f}ms per hash here: {suggest_rounds()}")
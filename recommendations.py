@@ -0,0 +1,204 @@
+"""Recommendations ("gardeners also grow") from plant list co-occurrence.
+
+Two plants co-occur once for every plant list they are both on. For each
+plant, the NEIGHBORS plants it co-occurs with most are stored in the
+plant_recommendations table, so showing suggestions is a primary key lookup.
+
+rebuild() works them out from scratch. It reads plant_list_plants into a
+sparse list-by-plant matrix M and multiplies M.T @ M a block of plants at a
+time, so memory is bounded by the block rather than the whole plant-by-plant
+matrix. numpy and scipy are only imported for a rebuild, so the web
+workers, which only call recommended(), don't load them.
+
+add_to_list() keeps them up to date as plants are added to lists. Adding only
+raises counts, so a plant's new top neighbors are among its old ones and the
+pairs that just changed, and one query gives exact counts for those pairs.
+Removals are left for the next rebuild.
+
+    python recommendations.py        # rebuild
+"""
+import io
+import os
+from collections import Counter
+
+from sqlalchemy.dialects.postgresql import insert
+
+from bulk_copy import copy_rows
+from models import db, Plant, PlantList_Plants, PlantRecommendation
+
+# Neighbors stored per plant
+NEIGHBORS = int(os.environ.get('RECOMMENDATION_NEIGHBORS', 12))
+# Plants per block of M.T @ M in a rebuild; the block's product holds up to
+# this many rows of the plant-by-plant matrix
+BLOCK_SIZE = int(os.environ.get('RECOMMENDATION_BLOCK_SIZE', 512))
+# Suggestions shown on a page
+SHOWN = 6
+# Key for the Postgres advisory lock that keeps a rebuild and incremental
+# updates from overwriting each other
+LOCK_KEY = 0x7265636f
+
+
+def lock():
+    """Wait for the recommendations lock, held until the transaction ends."""
+    db.session.execute(db.text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOCK_KEY})
+
+
+def top_neighbors(neighbors, k=NEIGHBORS):
+    """The k best of a dict of neighbor id -> count, as (ids, counts) lists.
+    Ties go to the lower id, so results are stable."""
+    best = sorted(neighbors.items(), key=lambda item: (-item[1], item[0]))[:k]
+    return [plant_id for plant_id, count in best], [count for plant_id, count in best]
+
+
+#############################################################
+# Rebuild
+#############################################################
+
+def neighbors_from_memberships(list_ids, plant_ids, k=NEIGHBORS, block_size=BLOCK_SIZE):
+    """Yield (plant id, neighbor ids, counts) for every plant with neighbors.
+
+    list_ids and plant_ids are parallel int arrays, one entry per plant list
+    membership. Neighbors are picked and ordered as top_neighbors() does.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    plants, plant_index = np.unique(plant_ids, return_inverse=True)
+    lists, list_index = np.unique(list_ids, return_inverse=True)
+    memberships = sparse.csr_matrix(
+        (np.ones(len(plant_index), dtype=np.int32), (list_index, plant_index)),
+        shape=(len(lists), len(plants)))
+    lists_by_plant = memberships.T.tocsr()
+
+    for start in range(0, len(plants), block_size):
+        block = (lists_by_plant[start:start + block_size] @ memberships).tocsr()
+        for row in range(block.shape[0]):
+            columns = block.indices[block.indptr[row]:block.indptr[row + 1]]
+            counts = block.data[block.indptr[row]:block.indptr[row + 1]]
+            others = columns != start + row
+            columns, counts = columns[others], counts[others]
+            if not len(columns):
+                continue
+            if len(columns) > k:
+                # Everything above the k-th highest count, then the lowest
+                # plant ids tied at it, as in top_neighbors. Columns are in
+                # plant id order.
+                threshold = np.partition(counts, len(counts) - k)[len(counts) - k]
+                above = np.flatnonzero(counts > threshold)
+                tied = np.flatnonzero(counts == threshold)
+                tied = tied[np.argsort(columns[tied])][:k - len(above)]
+                best = np.concatenate([above, tied])
+                columns, counts = columns[best], counts[best]
+            order = np.lexsort((plants[columns], -counts))
+            yield int(plants[start + row]), plants[columns[order]].tolist(), counts[order].tolist()
+
+
+def load_memberships():
+    """Read plant_list_plants into two int arrays: list ids and plant ids."""
+    import numpy as np
+
+    buffer = io.StringIO()
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert("COPY plant_list_plants (plant_list_id, plant_id) TO STDOUT", buffer)
+    pairs = np.fromstring(buffer.getvalue(), dtype=np.int64, sep=" ").reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def rebuild(k=NEIGHBORS, block_size=BLOCK_SIZE):
+    """Recompute every plant's neighbors and replace the table's contents.
+    Returns the number of plants with recommendations. Caller should commit."""
+    lock()
+    list_ids, plant_ids = load_memberships()
+    PlantRecommendation.query.delete()
+
+    def pg_array(values):
+        return "{" + ",".join(str(value) for value in values) + "}"
+
+    cursor = db.session.connection().connection.cursor()
+    return copy_rows(cursor, "plant_recommendations", ["plant_id", "neighbor_ids", "counts"],
+                     ((plant_id, pg_array(neighbor_ids), pg_array(counts))
+                      for plant_id, neighbor_ids, counts
+                      in neighbors_from_memberships(list_ids, plant_ids, k, block_size)))
+
+
+#############################################################
+# Incremental updates
+#############################################################
+
+def add_to_list(plant_list_id, plant_ids, k=NEIGHBORS):
+    """Update recommendations after plant_ids were added to a plant list.
+    Caller should commit."""
+    if not plant_ids:
+        return
+    lock()
+    # Exact co-occurrence counts for each new plant with everything on the list
+    added = db.aliased(PlantList_Plants)
+    other = db.aliased(PlantList_Plants)
+    on_list = db.session.query(PlantList_Plants.plant_id).filter(PlantList_Plants.plant_list_id == plant_list_id)
+    pairs = (db.session.query(added.plant_id, other.plant_id, db.func.count())
+             .join(other, other.plant_list_id == added.plant_list_id)
+             .filter(added.plant_id.in_(plant_ids), other.plant_id.in_(on_list.subquery()),
+                     added.plant_id != other.plant_id)
+             .group_by(added.plant_id, other.plant_id))
+    changes = {}
+    for plant_id, other_id, count in pairs:
+        changes.setdefault(plant_id, {})[other_id] = count
+        changes.setdefault(other_id, {})[plant_id] = count
+    if not changes:
+        return
+
+    rows = []
+    current = PlantRecommendation.query.filter(PlantRecommendation.plant_id.in_(changes))
+    current = {row.plant_id: dict(zip(row.neighbor_ids, row.counts)) for row in current}
+    for plant_id, changed in changes.items():
+        neighbors = current.get(plant_id, {})
+        neighbors.update(changed)
+        neighbor_ids, counts = top_neighbors(neighbors, k)
+        rows.append({"plant_id": plant_id, "neighbor_ids": neighbor_ids, "counts": counts})
+    stmt = insert(PlantRecommendation.__table__).values(rows)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=["plant_id"],
+        set_={"neighbor_ids": stmt.excluded.neighbor_ids, "counts": stmt.excluded.counts,
+              "updated_at": db.func.now()}))
+
+
+#############################################################
+# Suggestions
+#############################################################
+
+def recommended(plant_ids, on_list_id=None, limit=SHOWN):
+    """Plants most often grown alongside plant_ids, best first.
+
+    Scores add up across plant_ids, so a page of a plant list gets
+    suggestions for the page as a whole. Plants in plant_ids, or on the list
+    on_list_id, are left out. Returns rows of id, slug, scientific_name and
+    image_url.
+    """
+    scores = Counter()
+    for row in PlantRecommendation.query.filter(PlantRecommendation.plant_id.in_(plant_ids)):
+        scores.update(dict(zip(row.neighbor_ids, row.counts)))
+    for plant_id in plant_ids:
+        scores.pop(plant_id, None)
+    if on_list_id is not None and scores:
+        for (plant_id,) in (db.session.query(PlantList_Plants.plant_id)
+                            .filter(PlantList_Plants.plant_list_id == on_list_id,
+                                    PlantList_Plants.plant_id.in_(list(scores)))):
+            del scores[plant_id]
+    best, counts = top_neighbors(scores, limit)
+    if not best:
+        return []
+    by_id = {plant.id: plant for plant in
+             db.session.query(Plant.id, Plant.slug, Plant.scientific_name, Plant.image_url)
+             .filter(Plant.id.in_(best))}
+    return [by_id[plant_id] for plant_id in best if plant_id in by_id]
+
+
+if __name__ == "__main__":
+    import time
+    from app import create_app
+
+    with create_app(migrations=False).app_context():
+        start = time.perf_counter()
+        count = rebuild()
+        db.session.commit()
+    print(f"Recommendations for {count} plants rebuilt in {time.perf_counter() - start:.1f}s.")
@@ -1,10 +1,164 @@
-"""Seed database for Tendril."""
+"""Seed database for Tendril.
 
-from app import db
-from models import User, GrowingArea
+Brings the schema up to date by running the Alembic migrations in
+migrations/ (same as `flask db upgrade`).
 
+Can also fill the database with generated data for load testing, e.g.
 
-# db.drop_all()
-db.create_all()
+    python seed.py --users 100000 --lists 400000 --memberships 2000000
 
-db.session.commit()
+Output is deterministic for a given --seed. Rows are written with COPY, and
+every user shares one precomputed password hash (password: "password").
+"""
+import argparse
+import random
+import time
+
+from bulk_copy import copy_rows
+from models import db, User, GrowingArea
+from passwords import hash_password
+from forms import GrowingAreaForm
+
+SEED_PASSWORD = "password"
+# Plant popularity follows a Zipf distribution with this exponent
+PLANT_POPULARITY_SKEW = 1.1
+
+LIGHT_LEVELS = list(GrowingAreaForm.light_level.kwargs["choices"])
+SOIL_TEXTURES = list(GrowingAreaForm.soil_texture.kwargs["choices"])
+SOIL_MOISTURES = list(GrowingAreaForm.soil_moisture.kwargs["choices"])
+
+
+def next_id(cursor, table):
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")
+    return cursor.fetchone()[0]
+
+
+def skewed_count(rng, mean):
+    """Non-negative int with the given mean and a long tail (exponential)."""
+    return int(rng.expovariate(1 / mean)) if mean > 0 else 0
+
+
+def generate(users, areas_per_user, lists, plants, memberships, seed):
+    """Write a generated dataset using COPY. Prints row counts and timings."""
+    rng = random.Random(seed)
+    password = hash_password(SEED_PASSWORD)
+
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        first_user = next_id(cursor, "users")
+        first_area = next_id(cursor, "growing_areas")
+        first_plant = next_id(cursor, "plants")
+        first_list = next_id(cursor, "plant_lists")
+        timings = {}
+
+        start = time.perf_counter()
+        user_ids = range(first_user, first_user + users)
+        copy_rows(cursor, "users",
+                  ["id", "email", "username", "first_name", "last_name", "password"],
+                  ((uid, f"user{uid}@example.com", f"user{uid}", "Seed", f"User {uid}", password)
+                   for uid in user_ids))
+        timings["users"] = (users, time.perf_counter() - start)
+
+        # Each user's growing areas get consecutive ids; remember the range
+        start = time.perf_counter()
+        area_ranges = []
+        area_id = first_area
+
+        def area_rows():
+            nonlocal area_id
+            for uid in user_ids:
+                count = skewed_count(rng, areas_per_user)
+                area_ranges.append((area_id, count))
+                for n in range(count):
+                    yield (area_id, f"Bed {n + 1}", "Generated growing area", uid,
+                           rng.choice(LIGHT_LEVELS), rng.choice(SOIL_TEXTURES),
+                           rng.choice(SOIL_MOISTURES), round(rng.uniform(4.5, 8.5), 1), "")
+                    area_id += 1
+
+        area_count = copy_rows(cursor, "growing_areas",
+                               ["id", "name", "description", "user_id", "light_level",
+                                "soil_texture", "soil_moisture", "soil_ph", "notes"],
+                               area_rows())
+        timings["growing_areas"] = (area_count, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        plant_ids = list(range(first_plant, first_plant + plants))
+        copy_rows(cursor, "plants", ["id", "slug", "scientific_name", "image_url"],
+                  ((pid, f"seed-plant-{pid}", f"Plantae seedii {pid}", "") for pid in plant_ids))
+        timings["plants"] = (plants, time.perf_counter() - start)
+
+        # Most users have a list or two; a few have dozens
+        start = time.perf_counter()
+        list_ids = []
+        lists_per_user = lists / users if users else 0
+
+        def list_rows():
+            list_id = first_list
+            for uid, (area_start, area_total) in zip(user_ids, area_ranges):
+                for n in range(skewed_count(rng, lists_per_user)):
+                    area = area_start + rng.randrange(area_total) if area_total and rng.random() < 0.5 else ""
+                    list_ids.append(list_id)
+                    yield (list_id, f"List {n + 1}", "", area, uid)
+                    list_id += 1
+
+        list_count = copy_rows(cursor, "plant_lists",
+                               ["id", "name", "description", "growing_area", "user_id"],
+                               list_rows())
+        timings["plant_lists"] = (list_count, time.perf_counter() - start)
+
+        # A few plants are on many lists, most plants on few
+        start = time.perf_counter()
+        weights = [1 / (rank ** PLANT_POPULARITY_SKEW) for rank in range(1, plants + 1)]
+        cum_weights = []
+        total = 0
+        for weight in weights:
+            total += weight
+            cum_weights.append(total)
+        plants_per_list = memberships / list_count if list_count else 0
+
+        def membership_rows():
+            for list_id in list_ids:
+                size = min(plants, skewed_count(rng, plants_per_list))
+                for pid in set(rng.choices(plant_ids, cum_weights=cum_weights, k=size)):
+                    yield (list_id, pid)
+
+        membership_count = copy_rows(cursor, "plant_list_plants",
+                                     ["plant_list_id", "plant_id"], membership_rows())
+        timings["plant_list_plants"] = (membership_count, time.perf_counter() - start)
+        cursor.execute("UPDATE plant_lists SET plant_count = counts.plant_count "
+                       "FROM (SELECT plant_list_id, count(*) AS plant_count FROM plant_list_plants "
+                       "      WHERE plant_list_id >= %s GROUP BY plant_list_id) AS counts "
+                       "WHERE plant_lists.id = counts.plant_list_id", (first_list,))
+
+        for table in ("users", "growing_areas", "plants", "plant_lists"):
+            cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                           f"(SELECT COALESCE(MAX(id), 1) FROM {table}))")
+        connection.commit()
+    finally:
+        connection.close()
+
+    for table, (count, seconds) in timings.items():
+        print(f"{table}: {count} rows in {seconds:.1f}s ({count / max(seconds, 1e-9):.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate the database and optionally generate load-test data.")
+    parser.add_argument("--users", type=int, default=0, help="number of users to generate")
+    parser.add_argument("--areas-per-user", type=float, default=2, help="average growing areas per user")
+    parser.add_argument("--lists", type=int, default=0, help="approximate number of plant lists")
+    parser.add_argument("--plants", type=int, default=20000, help="number of plants")
+    parser.add_argument("--memberships", type=int, default=0, help="approximate number of plant list memberships")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    from flask_migrate import upgrade
+    from app import create_app
+
+    with create_app().app_context():
+        upgrade()
+        if args.users:
+            generate(args.users, args.areas_per_user, args.lists, args.plants,
+                     args.memberships, args.seed)
+
+    db.session.commit()
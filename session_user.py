@@ -0,0 +1,72 @@
+"""Lazy stand-in for the logged-in user.
+
+g.user used to be a User row queried on every request. LazyUser answers the
+common attributes (id, username, name, email) from the signed session and a
+short-lived per-worker cache, and only loads the User row when a handler
+touches something else, like g.user.plant_lists.
+"""
+import os
+import threading
+import time
+
+from flask import session, abort
+from sqlalchemy import event
+
+from models import User
+
+PROFILE_TTL = float(os.environ.get('SESSION_USER_TTL', 30))
+PROFILE_FIELDS = ("email", "first_name", "last_name")
+
+_profiles = {}
+_profiles_lock = threading.Lock()
+
+
+def forget_user(user_id):
+    """Drop a user from this worker's profile cache."""
+    with _profiles_lock:
+        _profiles.pop(user_id, None)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, user):
+    forget_user(user.id)
+
+
+class LazyUser:
+    """Logged-in user that only hits the database when it has to."""
+
+    def __init__(self, user_id, username=None):
+        self.id = user_id
+        self._username = username
+        self._user = None
+
+    def __repr__(self):
+        return f"<LazyUser #{self.id}: {self._username}>"
+
+    def _load(self):
+        """Load the User row for this request, logging out if it's gone."""
+        if self._user is None:
+            self._user = User.query.get(self.id)
+            if self._user is None:
+                session.clear()
+                abort(401)
+            with _profiles_lock:
+                _profiles[self.id] = (
+                    time.monotonic() + PROFILE_TTL,
+                    {field: getattr(self._user, field) for field in PROFILE_FIELDS})
+        return self._user
+
+    @property
+    def username(self):
+        if self._username is None:
+            self._username = self._load().username
+        return self._username
+
+    def __getattr__(self, name):
+        if name in PROFILE_FIELDS and self._user is None:
+            with _profiles_lock:
+                cached = _profiles.get(self.id)
+            if cached and cached[0] > time.monotonic():
+                return cached[1][name]
+        return getattr(self._load(), name)
@@ -0,0 +1,111 @@
+/* Infinite scroll for search results.
+ * The results container carries the API's `links.next` cursor; when the user
+ * nears the bottom of the page, fetch that page from /search/next and append
+ * its cards. The server prefetches each following page, so this is usually
+ * answered from cache. */
+
+const DEFAULT_THUMBNAIL = "/static/images/thumbnail_default.png";
+const SCROLL_MARGIN_PX = 600;
+
+let $searchResults = $("#search-results");
+let loadingNextPage = false;
+
+function escapeHtml(text) {
+  return $("<div>").text(text || "").html();
+}
+
+function plantCardHtml(plant) {
+  let imageUrl = plant.image_url ? `/img/${encodeURIComponent(plant.id)}/thumb` : DEFAULT_THUMBNAIL;
+  return `
+    <div class="card col-12 col-lg-6 col-xl-4 float-left">
+        <div class="card-body">
+            <a href="/plant/${encodeURIComponent(plant.slug)}">
+                <img src="${escapeHtml(imageUrl)}" alt="Photo of ${escapeHtml(plant.common_name)}"
+                    class="search img-thumbnail rounded mr-4 float-left">
+            </a>
+            <div class="card-text">
+                <a class="h5 card-title search-results" href="/plant/${encodeURIComponent(plant.slug)}">${escapeHtml(plant.common_name)}</a>
+                <h6 class="card-subtitle scientific-name mb-2 text-muted">${escapeHtml(plant.scientific_name)}</h6>
+            </div>
+        </div>
+    </div>`;
+}
+
+async function loadNextPage() {
+  let nextPageUrl = $searchResults.data("next");
+  if (!nextPageUrl || loadingNextPage) return;
+
+  loadingNextPage = true;
+  try {
+    let response = await axios.get("/search/next", { params: { url: nextPageUrl } });
+    $searchResults.append(response.data.data.map(plantCardHtml).join(""));
+    $searchResults.data("next", response.data.links.next || "");
+  } catch (err) {
+    // Stop trying; the results already on the page are still usable.
+    $searchResults.data("next", "");
+  } finally {
+    loadingNextPage = false;
+  }
+}
+
+if ($searchResults.length) {
+  $(window).on("scroll", function () {
+    let distanceToBottom = $(document).height() - ($(window).scrollTop() + $(window).height());
+    if (distanceToBottom < SCROLL_MARGIN_PX) loadNextPage();
+  });
+}
+
+/* Search-as-you-type suggestions for the navbar search box.
+ * Asks /autocomplete once typing pauses for AUTOCOMPLETE_DELAY_MS, and only
+ * shows the answer to the latest request. Choosing a suggestion goes
+ * straight to that plant; pressing enter still runs a full search. */
+
+const AUTOCOMPLETE_DELAY_MS = 150;
+const AUTOCOMPLETE_MIN_LENGTH = 2;
+
+let $searchTerm = $("#term");
+let $suggestions = $('<div class="dropdown-menu autocomplete-menu" id="autocomplete-menu"></div>');
+let autocompleteTimer = null;
+let latestPrefix = "";
+
+function suggestionHtml(suggestion) {
+  let scientificName = suggestion.name === suggestion.scientific_name ? ""
+    : ` <small class="text-muted scientific-name">${escapeHtml(suggestion.scientific_name)}</small>`;
+  return `<a class="dropdown-item" href="/plant/${encodeURIComponent(suggestion.slug)}">${escapeHtml(suggestion.name)}${scientificName}</a>`;
+}
+
+function hideSuggestions() {
+  $suggestions.removeClass("show").empty();
+}
+
+async function showSuggestions(prefix) {
+  try {
+    let response = await axios.get("/autocomplete", { params: { prefix } });
+    if (prefix !== latestPrefix) return;
+    let suggestions = response.data.suggestions;
+    if (!suggestions.length) return hideSuggestions();
+    $suggestions.html(suggestions.map(suggestionHtml).join("")).addClass("show");
+  } catch (err) {
+    // Suggestions are optional; the search box works without them.
+    hideSuggestions();
+  }
+}
+
+if ($searchTerm.length) {
+  $searchTerm.attr("autocomplete", "off").after($suggestions);
+
+  $searchTerm.on("input", function () {
+    clearTimeout(autocompleteTimer);
+    latestPrefix = $searchTerm.val().trim();
+    if (latestPrefix.length < AUTOCOMPLETE_MIN_LENGTH) return hideSuggestions();
+    let prefix = latestPrefix;
+    autocompleteTimer = setTimeout(() => showSuggestions(prefix), AUTOCOMPLETE_DELAY_MS);
+  });
+
+  $searchTerm.on("keydown", function (evt) {
+    if (evt.key === "Escape") hideSuggestions();
+  });
+
+  // Clicking elsewhere closes the list; mousedown on a suggestion lands first
+  $searchTerm.on("blur", () => setTimeout(hideSuggestions, 200));
+}
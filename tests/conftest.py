@@ -0,0 +1,46 @@
+"""Fixtures for tests that need Postgres.
+
+Set TEST_DATABASE_URL to an empty database that may be wiped, e.g.
+
+    createdb botanical_test
+    TEST_DATABASE_URL=postgresql:///botanical_test python -m pytest tests
+
+Without it the database tests are skipped. The schema is built by running the
+migrations, so the tests see the same indexes production does.
+"""
+import os
+
+import pytest
+
+from app import create_app
+from models import db
+
+
+@pytest.fixture(scope="session")
+def app():
+    if not os.environ.get("TEST_DATABASE_URL"):
+        pytest.skip("TEST_DATABASE_URL is not set")
+    from flask_migrate import upgrade
+
+    app = create_app("test")
+    with app.app_context():
+        db.session.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public")
+        db.session.commit()
+        upgrade()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def database(app):
+    """The database, emptied after the test."""
+    yield db
+    db.session.rollback()
+    tables = ", ".join(table.name for table in db.metadata.sorted_tables)
+    db.session.execute(f"TRUNCATE {tables} RESTART IDENTITY CASCADE")
+    db.session.commit()
+
+
+@pytest.fixture
+def client(app, database):
+    return app.test_client()
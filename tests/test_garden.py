@@ -0,0 +1,60 @@
+"""The garden page's query count doesn't grow with the number of lists."""
+import pytest
+from sqlalchemy import event
+
+from app import CURR_USER_KEY, CURR_USERNAME_KEY
+from models import db, User, GrowingArea, PlantList, Plant
+
+
+def make_garden(lists):
+    """A user with `lists` plant lists, each holding a plant, and half as
+    many growing areas, with most lists in one."""
+    user = User(username=f"gardener{lists}", email=f"gardener{lists}@example.com", first_name="Garden",
+                last_name="Er", password="not-a-real-hash")
+    db.session.add(user)
+    db.session.flush()
+    areas = [GrowingArea(name=f"Bed {n}", user_id=user.id) for n in range(lists // 2)]
+    db.session.add_all(areas)
+    db.session.flush()
+    plant = Plant(id=1000 + lists, slug=f"plant-{lists}", scientific_name=f"Plantae {lists}")
+    db.session.add(plant)
+    for n in range(lists):
+        plant_list = PlantList(name=f"List {n}", user_id=user.id,
+                               growing_area=areas[n // 2].id if n % 3 else None)
+        db.session.add(plant_list)
+        db.session.flush()
+        plant_list.add_plants([{"id": plant.id, "slug": plant.slug, "scientific_name": plant.scientific_name,
+                                "image_url": None}])
+    db.session.commit()
+    user_id = user.id
+    # Start the request with nothing loaded, as a real one would
+    db.session.remove()
+    return User.query.get(user_id)
+
+
+def garden_page_queries(client, user):
+    """Statements run to render user's garden page for them."""
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = user.id
+        session[CURR_USERNAME_KEY] = user.username
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        response = client.get(f"/{user.username}/garden")
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    assert f"List {len(user.plant_lists) - 1}".encode() in response.data
+    return statements
+
+
+def test_query_count_is_flat(client):
+    few = garden_page_queries(client, make_garden(2))
+    many = garden_page_queries(client, make_garden(40))
+    assert len(many) == len(few), many
+    # The user, the ETag versions, growing areas and plant lists
+    assert len(few) <= 4, few
@@ -0,0 +1,82 @@
+"""Garden file imports through /<username>/garden/import."""
+import io
+
+from flask import session
+from flask_wtf.csrf import generate_csrf
+
+from app import CURR_USER_KEY, CURR_USERNAME_KEY
+from models import db, User, GrowingArea, PlantList, Plant
+
+CSV_HEADER = "type,name,description,light_level,soil_texture,soil_moisture,soil_ph,notes,growing_area," \
+             "plant_list,plant_id,slug,scientific_name,image_url\n"
+
+
+def make_user():
+    user = User(username="importer", email="importer@example.com", first_name="Im", last_name="Porter",
+                password="not-a-real-hash")
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def log_in(client, user_id, csrf=False):
+    """Log in as importer. With csrf, return a token for the session."""
+    token = None
+    if csrf:
+        with client.application.test_request_context():
+            token = generate_csrf()
+            raw_token = session["csrf_token"]
+    with client.session_transaction() as client_session:
+        client_session[CURR_USER_KEY] = user_id
+        client_session[CURR_USERNAME_KEY] = "importer"
+        if csrf:
+            client_session["csrf_token"] = raw_token
+    return token
+
+
+def test_form_uploads_need_a_csrf_token(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", True)
+    token = log_in(client, make_user(), csrf=True)
+    garden = CSV_HEADER + "growing_area,Bed,,,,,,,,,,,,\n"
+
+    def upload(**fields):
+        return client.post("/importer/garden/import",
+                           data=dict(fields, file=(io.BytesIO(garden.encode()), "garden.csv")))
+
+    assert upload().status_code == 400
+    assert client.post("/importer/garden/import?format=csv", data=garden,
+                       content_type="text/plain").status_code == 400
+    assert GrowingArea.query.count() == 0
+
+    assert upload(csrf_token=token).status_code == 200
+    response = client.post("/importer/garden/import?format=csv", data=garden, content_type="text/csv")
+    assert response.status_code == 200
+    assert response.json["imported"]["growing_areas"] == 1
+
+
+def test_records_the_database_would_reject_are_400s(client):
+    log_in(client, make_user())
+    db.session.add(Plant(id=1, slug="rosa-canina", scientific_name="Rosa canina"))
+    db.session.commit()
+
+    def post(*lines):
+        return client.post("/importer/garden/import?format=csv", data=CSV_HEADER + "".join(lines),
+                           content_type="text/csv")
+
+    response = post("plant_list,Roses,,,,,,,,,,,,\n", f"plant_list,{'x' * 31},,,,,,,,,,,,\n")
+    assert response.status_code == 400
+    assert response.json["errors"] == ["line 3: name is longer than 30 characters"]
+
+    response = post("plant_list,Roses,,,,,,,,,,,,\n", "plant,,,,,,,,,Roses,2,rosa-canina,Rosa canina,\n")
+    assert response.status_code == 400
+    assert response.json["errors"][0].startswith("line 3: couldn't be saved (")
+    assert PlantList.query.count() == 0
+
+
+def test_growing_area_conditions_must_be_form_choices(client):
+    log_in(client, make_user())
+    response = client.post("/importer/garden/import?format=csv",
+                           data=CSV_HEADER + "growing_area,Bed,,Blazing,Loam,Dry,,,,,,,,\n", content_type="text/csv")
+    assert response.status_code == 400
+    assert response.json["errors"] == ["line 2: light_level must be one of: Full Sun, Partial Sun/Shade, Full Shade"]
+    assert GrowingArea.query.count() == 0
@@ -0,0 +1,74 @@
+"""The garden and plant list queries use indexes at 100k-row scale.
+
+Loads about 100k plant lists and memberships with seed.generate(), then
+checks EXPLAIN plans for the lookups the garden and plant list pages make.
+"""
+import pytest
+from sqlalchemy.dialects import postgresql
+
+import seed
+from models import db, GrowingArea, PlantList, PlantList_Plants
+
+
+@pytest.fixture(scope="module")
+def seeded(app):
+    seed.generate(users=20000, areas_per_user=2, lists=100000, plants=20000, memberships=100000, seed=0)
+    db.session.execute("ANALYZE")
+    db.session.commit()
+    yield
+    tables = ", ".join(table.name for table in db.metadata.sorted_tables)
+    db.session.execute(f"TRUNCATE {tables} RESTART IDENTITY CASCADE")
+    db.session.commit()
+
+
+def plan_nodes(query):
+    """Every node of the EXPLAIN plan for an ORM query."""
+    sql = str(query.statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    plan = db.session.execute(f"EXPLAIN (FORMAT JSON) {sql}").scalar()[0]["Plan"]
+    nodes, pending = [], [plan]
+    while pending:
+        node = pending.pop()
+        nodes.append(node)
+        pending.extend(node.get("Plans", []))
+    return nodes
+
+
+def assert_uses_index(query, table, index):
+    nodes = plan_nodes(query)
+    scans = [node for node in nodes if node.get("Relation Name") == table or node.get("Index Name") == index]
+    assert not any(node["Node Type"] == "Seq Scan" for node in scans), scans
+    assert any(node.get("Index Name") == index for node in scans), scans
+
+
+def some_value(column):
+    return db.session.query(column).filter(column.isnot(None)).limit(1).scalar()
+
+
+def test_growing_areas_by_user(seeded):
+    user_id = some_value(GrowingArea.user_id)
+    assert_uses_index(GrowingArea.query.filter_by(user_id=user_id), "growing_areas", "ix_growing_areas_user_id")
+
+
+def test_plant_lists_by_user(seeded):
+    user_id = some_value(PlantList.user_id)
+    query = (db.session.query(PlantList, PlantList.plant_count)
+             .options(db.joinedload(PlantList.area))
+             .filter(PlantList.user_id == user_id)
+             .order_by(PlantList.id))
+    assert_uses_index(query, "plant_lists", "uq_plant_lists_user_id_name")
+
+
+def test_plant_lists_by_growing_area(seeded):
+    area_id = some_value(PlantList.growing_area)
+    assert_uses_index(PlantList.query.filter_by(growing_area=area_id), "plant_lists", "ix_plant_lists_growing_area")
+
+
+def test_plant_list_page(seeded):
+    plant_list = PlantList.query.get(some_value(PlantList_Plants.plant_list_id))
+    assert_uses_index(plant_list.plant_page_query(limit=61), "plant_list_plants", "plant_list_plants_pkey")
+
+
+def test_lists_containing_plant(seeded):
+    plant_id = some_value(PlantList_Plants.plant_id)
+    query = PlantList_Plants.query.filter_by(plant_id=plant_id)
+    assert_uses_index(query, "plant_list_plants", "ix_plant_list_plants_plant_id")
@@ -0,0 +1,24 @@
+"""Turning on instrumentation in more than one app."""
+from sqlalchemy import event
+
+import fragments
+import instrumentation
+import trefle_requests
+from app import create_app
+from models import db
+
+
+def test_init_app_adds_hooks_once(monkeypatch):
+    monkeypatch.setattr(instrumentation, "ENABLED", True)
+    monkeypatch.setattr(trefle_requests, "upstream_call_hooks", [])
+    monkeypatch.setattr(fragments, "fragment_hooks", [])
+
+    app = create_app("test", migrations=False)
+    create_app("test", migrations=False)
+    instrumentation.init_app(app, db)
+
+    assert trefle_requests.upstream_call_hooks == [instrumentation._record_upstream_call]
+    assert fragments.fragment_hooks == [instrumentation._record_fragment]
+    assert app.before_request_funcs[None].count(instrumentation._start_timer) == 1
+    with app.app_context():
+        assert event.contains(db.engine, "before_cursor_execute", instrumentation._before_cursor_execute)
@@ -0,0 +1,60 @@
+"""The job queue's routes and bookkeeping."""
+import time
+from datetime import datetime, timedelta
+
+import jobs
+from app import CURR_USER_KEY, CURR_USERNAME_KEY
+from models import db, Job
+
+
+def log_in(client, user_id, username):
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = user_id
+        session[CURR_USERNAME_KEY] = username
+
+
+def test_job_routes_are_admin_only(app, client):
+    jobs.enqueue("refresh_plants", {"secret": "payload"})
+    db.session.commit()
+    job_id = Job.query.one().id
+
+    assert client.get("/jobs/status").status_code == 403
+    log_in(client, 1, "visitor")
+    assert client.get("/jobs/status").status_code == 403
+    assert client.get(f"/jobs/{job_id}").status_code == 403
+
+    app.config["ADMIN_USERNAMES"] = {"keeper"}
+    try:
+        log_in(client, 2, "keeper")
+        assert client.get("/jobs/status").json["jobs"] == {"refresh_plants": {"queued": 1}}
+        assert client.get(f"/jobs/{job_id}").json["payload"] == {"secret": "payload"}
+    finally:
+        app.config["ADMIN_USERNAMES"] = set()
+
+
+def test_purge_keeps_recent_and_pending_jobs(database):
+    now = datetime.utcnow()
+    old = now - timedelta(seconds=jobs.RETENTION + 60)
+    db.session.add_all([
+        Job(kind="old_done", status="done", finished_at=old),
+        Job(kind="old_failed", status="failed", finished_at=old),
+        Job(kind="recent_done", status="done", finished_at=now),
+        Job(kind="queued", status="queued", run_after=old),
+    ])
+    db.session.commit()
+
+    assert jobs.purge_finished() == 2
+    assert sorted(kind for kind, in db.session.query(Job.kind)) == ["queued", "recent_done"]
+
+
+def test_heartbeat_renews_the_lock_of_a_long_job(database, monkeypatch):
+    monkeypatch.setattr(jobs, "HEARTBEAT_INTERVAL", 0.05)
+    monkeypatch.setitem(jobs.handlers, "slow", lambda: time.sleep(0.5))
+    jobs.enqueue("slow")
+    db.session.commit()
+    job = jobs.claim_job()
+    claimed_at = job.locked_at
+
+    jobs.run_job(job)
+    assert job.status == "done"
+    assert job.locked_at > claimed_at
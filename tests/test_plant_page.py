@@ -0,0 +1,43 @@
+"""Cache headers on the plant detail page."""
+import pytest
+
+import trefle_requests
+from api_cache import DiskStore, ResponseCache
+from app import CURR_USER_KEY, CURR_USERNAME_KEY
+from models import db, User
+
+PLANT = {"id": 77, "slug": "test-rosa-canina", "scientific_name": "Rosa canina", "common_name": "dog rose",
+         "family": "Rosaceae", "family_common_name": "Rose family", "image_url": None,
+         "common_names": {"eng": ["dog rose"]}}
+
+
+@pytest.fixture
+def plant_page(client, tmp_path, monkeypatch):
+    """Path of a plant page whose data is already in the API cache."""
+    monkeypatch.setattr(trefle_requests, "cache", ResponseCache(store=DiskStore(str(tmp_path / "api.sqlite3"))))
+    trefle_requests.cache.put(f"plant:{PLANT['slug']}", 200, {"data": PLANT})
+    return f"/plant/{PLANT['slug']}"
+
+
+def test_anonymous_page_may_be_reused(client, plant_page):
+    response = client.get(plant_page)
+    assert response.status_code == 200
+    assert response.cache_control.public
+    assert response.cache_control.max_age == 5 * 60
+
+
+def test_logged_in_page_is_revalidated_every_time(client, plant_page):
+    user = User(username="visitor", email="visitor@example.com", first_name="Vis", last_name="Itor",
+                password="not-a-real-hash")
+    db.session.add(user)
+    db.session.commit()
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = user.id
+        session[CURR_USERNAME_KEY] = user.username
+
+    response = client.get(plant_page)
+    assert response.status_code == 200
+    assert response.cache_control.private
+    assert response.cache_control.no_cache
+    assert response.cache_control.max_age is None
+    assert client.get(plant_page, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
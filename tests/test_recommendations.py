@@ -0,0 +1,31 @@
+"""Working out recommendations from plant list memberships."""
+import random
+from collections import Counter
+from itertools import combinations
+
+import pytest
+
+from recommendations import neighbors_from_memberships, top_neighbors
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("scipy")
+
+
+def test_rebuild_breaks_ties_like_top_neighbors():
+    rng = random.Random(0)
+    # Few plants on many small lists, so most counts are tied
+    lists = {list_id: rng.sample(range(1, 40), rng.randint(2, 5)) for list_id in range(300)}
+    list_ids = np.array([list_id for list_id, plants in lists.items() for plant in plants])
+    plant_ids = np.array([plant for plants in lists.values() for plant in plants])
+
+    pairs = Counter()
+    for plants in lists.values():
+        for a, b in combinations(plants, 2):
+            pairs[a, b] += 1
+            pairs[b, a] += 1
+    expected = {}
+    for (plant, other), count in pairs.items():
+        expected.setdefault(plant, {})[other] = count
+
+    for plant_id, neighbor_ids, counts in neighbors_from_memberships(list_ids, plant_ids, k=5, block_size=7):
+        assert (neighbor_ids, counts) == tuple(top_neighbors(expected[plant_id], 5))
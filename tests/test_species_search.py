@@ -0,0 +1,29 @@
+"""Searching the local species catalog."""
+from models import db, Species
+
+
+def add_species(*names):
+    for number, name in enumerate(names, 1):
+        db.session.add(Species(id=number, slug=name.lower().replace(" ", "-"), scientific_name=name,
+                               search_text=name.lower(), checksum=str(number)))
+    db.session.commit()
+
+
+def test_pages_have_a_total_and_a_next_cursor(client):
+    add_species("Rosa canina", "Rosa gallica", "Rosa rugosa", "Acer rubrum")
+
+    first = Species.search("rosa", limit=2)
+    assert [plant["scientific_name"] for plant in first["data"]] == ["Rosa canina", "Rosa gallica"]
+    assert first["meta"]["total"] == 3
+
+    second = client.get("/search/next", query_string={"url": first["links"]["next"]}).json
+    assert [plant["scientific_name"] for plant in second["data"]] == ["Rosa rugosa"]
+    assert second["meta"]["total"] == 3
+    assert "next" not in second["links"]
+
+
+def test_like_wildcards_are_literal(database):
+    add_species("Rosa canina", "Rosa_canina")
+
+    assert Species.search("%")["data"] == []
+    assert [plant["scientific_name"] for plant in Species.search("a_c")["data"]] == ["Rosa_canina"]
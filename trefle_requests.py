@@ -2,36 +2,400 @@
 Updated to use FloraCodex.
 """
 import os
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from api_cache import ResponseCache
 
 trefle_token = os.environ.get('TREFLE_TOKEN')
 
-BASE_URL = "https://api.floracodex.com"
+# Can point at benchmarks/fake_floracodex.py for offline runs
+BASE_URL = os.environ.get('FLORACODEX_BASE_URL', "https://api.floracodex.com")
+
+# Connection settings for the upstream API. Can be overridden via environ
+# variables, e.g. to size the pool to the number of gunicorn threads.
+POOL_SIZE = int(os.environ.get('FLORACODEX_POOL_SIZE', 10))
+CONNECT_TIMEOUT = float(os.environ.get('FLORACODEX_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('FLORACODEX_READ_TIMEOUT', 10))
+# Search results go stale faster than species detail.
+SEARCH_CACHE_TTL = int(os.environ.get('FLORACODEX_SEARCH_CACHE_TTL', 60 * 60))
+# Most requests allowed in flight to the API at once from one worker, and the
+# number of threads used for batch lookups.
+MAX_CONCURRENCY = int(os.environ.get('FLORACODEX_MAX_CONCURRENCY', 8))
+# Retries after a failed GET, with exponential backoff and full jitter
+RETRIES = int(os.environ.get('FLORACODEX_RETRIES', 2))
+BACKOFF_BASE = float(os.environ.get('FLORACODEX_BACKOFF_BASE', 0.2))
+BACKOFF_MAX = float(os.environ.get('FLORACODEX_BACKOFF_MAX', 2))
+# After this many failures in a row, stop calling the API for the cooldown
+BREAKER_THRESHOLD = int(os.environ.get('FLORACODEX_BREAKER_THRESHOLD', 5))
+BREAKER_COOLDOWN = float(os.environ.get('FLORACODEX_BREAKER_COOLDOWN', 30))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Most seconds one API call may take, retries and backoff included. Kept
+# under the gunicorn worker timeout (gunicorn.conf.py sets it from there), so
+# the request gets a 503 or a stale copy instead of the worker being killed.
+DEADLINE = float(os.environ.get('FLORACODEX_DEADLINE', 20))
+# Most API requests per second from one process; 0 for no limit. The job
+# worker sets this so bulk jobs leave room for the web app.
+RATE_LIMIT = float(os.environ.get('FLORACODEX_RATE_LIMIT', 0))
+
+# Functions called as hook(path, elapsed_seconds) after every API request;
+# used by instrumentation.py
+upstream_call_hooks = []
+
+class UpstreamUnavailable(Exception):
+    """The API is failing or the circuit breaker is open, and there is no
+    cached copy of the response to fall back on."""
+
+#############################################################
+# HTTP client
+#############################################################
+
+class RateLimiter:
+    """Token bucket allowing `rate` calls per second, in bursts of up to
+    `burst`. Callers over the limit wait their turn."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Take a token now, even if that puts the bucket in debt, and
+            # sleep until it would have been there
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+_request_state = threading.local()
+
+class _TrackingMixin:
+    """Notes the connection each request is sent on, so a watchdog can cut
+    it off at the request's deadline."""
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        holder = getattr(_request_state, "holder", None)
+        if holder is not None:
+            holder["conn"] = conn
+        return conn
+
+class _TrackingHTTPConnectionPool(_TrackingMixin, HTTPConnectionPool):
+    pass
+
+class _TrackingHTTPSConnectionPool(_TrackingMixin, HTTPSConnectionPool):
+    pass
+
+class DeadlineAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools report the connection in use to get()."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TrackingHTTPConnectionPool,
+            "https": _TrackingHTTPSConnectionPool
+        }
+
+def _cut_off(holder):
+    """Shut down the socket of a request that ran past its deadline; the
+    read blocked on it fails at once."""
+    if holder.get("done"):
+        return
+    sock = getattr(holder.get("conn"), "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class FloraCodexClient:
+    """Keep-alive HTTP client for the FloraCodex API.
+
+    Wraps a requests.Session with a pooled adapter, so repeat calls reuse
+    an open TCP/TLS connection instead of doing a fresh DNS lookup and
+    handshake each time.
+    """
+
+    def __init__(self, base_url=BASE_URL, pool_size=POOL_SIZE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_concurrency=MAX_CONCURRENCY, rate_limit=RATE_LIMIT):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        # Caps concurrent requests to this host, however many threads call get()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.adapter = DeadlineAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate"
+        })
+
+    def get(self, path, params=None, deadline=None):
+        """GET a path on the API. Returns the requests Response.
+
+        deadline is a time.monotonic() by which the whole response must have
+        arrived. The timeouts only bound each socket read, so a response
+        trickling in slower than that is cut off when the deadline passes.
+        """
+        if self._limiter is not None:
+            self._limiter.wait()
+        start = time.perf_counter()
+        timeout = self.timeout
+        watchdog = None
+        try:
+            with self._slots:
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise requests.Timeout(f"deadline passed before requesting {path}")
+                    timeout = (min(timeout[0], remaining), min(timeout[1], remaining))
+                    _request_state.holder = holder = {}
+                    watchdog = threading.Timer(remaining, _cut_off, [holder])
+                    watchdog.daemon = True
+                    watchdog.start()
+                try:
+                    return self.session.get(f'{self.base_url}{path}', params=params, timeout=timeout)
+                finally:
+                    if watchdog is not None:
+                        holder["done"] = True
+                        watchdog.cancel()
+                        _request_state.holder = None
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in upstream_call_hooks:
+                hook(path, elapsed)
+
+    def stats(self):
+        """Return request, handshake and pool-hit counts for this client.
+
+        A handshake is a newly opened connection; every other request was
+        served over a connection already in the pool.
+        """
+        requests_made = 0
+        handshakes = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            requests_made += pool.num_requests
+            handshakes += pool.num_connections
+        return {
+            "requests": requests_made,
+            "handshakes": handshakes,
+            "pool_hits": requests_made - handshakes
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_pid = None
+_executor = None
+_executor_pid = None
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+class CircuitBreaker:
+    """Fails fast once the API has failed `threshold` times in a row.
+
+    After `cooldown` seconds one trial request is let through; success
+    closes the breaker, failure opens it for another cooldown.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """Return True if a request may be sent now."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._trial_in_flight and time.monotonic() - self.opened_at >= self.cooldown:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+breaker = CircuitBreaker()
+
+def get_client():
+    """Return this process's FloraCodexClient, creating it if needed.
+
+    Sockets must not be shared across forked gunicorn workers, so a new
+    client is built whenever the process id changes.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = FloraCodexClient()
+        _client_pid = os.getpid()
+    return _client
+
+def get_executor():
+    """Return this process's thread pool for concurrent API lookups."""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="floracodex")
+        _executor_pid = os.getpid()
+    return _executor
+
+cache = ResponseCache()
+
+def _backoff(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def _fetch_json(path, params):
+    """GET path from the API. Returns (status_code, JSON response as dict).
+
+    Timeouts, connection errors and 429/5xx responses are retried with
+    backoff, all within DEADLINE seconds. Raises UpstreamUnavailable if
+    every attempt fails, time runs out or the circuit breaker is open.
+    """
+    deadline = time.monotonic() + DEADLINE
+    for attempt in range(RETRIES + 1):
+        if not breaker.allow():
+            raise UpstreamUnavailable(f"circuit open; not requesting {path}")
+        try:
+            response = get_client().get(path, params=params, deadline=deadline)
+            if response.status_code not in RETRY_STATUSES:
+                data = response.json()
+                breaker.record_success()
+                return response.status_code, data
+            error = UpstreamUnavailable(f"{path} returned {response.status_code}")
+        except (requests.RequestException, ValueError) as e:
+            error = UpstreamUnavailable(f"{path} failed: {e}")
+        breaker.record_failure()
+        if attempt < RETRIES:
+            delay = _backoff(attempt)
+            if time.monotonic() + delay >= deadline:
+                break
+            time.sleep(delay)
+    raise error
+
+#############################################################
+# API requests
+#############################################################
 
 def quick_search(token, search_term):
     """Simple single-field search request. Returns JSON response as dict."""
-    response = requests.get(f'{BASE_URL}/api/v1/species/search', params={"q": search_term, "token": token})
-    return response.json()
+    key = f'search:{search_term.strip().lower()}'
+    return cache.get_or_fetch(
+        key,
+        lambda: _fetch_json('/api/v1/species/search', {"q": search_term, "token": token}),
+        ttl=SEARCH_CACHE_TTL)
 
 def get_next_page(token, next_page_url):
-    response = requests.get(f'{BASE_URL}{next_page_url}', params={"token": token})
-    return response.json()
+    """Retrieves a page from a `links` cursor, e.g. links["next"]. Returns JSON response as dict."""
+    return cache.get_or_fetch(
+        f'page:{next_page_url}',
+        lambda: _fetch_json(next_page_url, {"token": token}),
+        ttl=SEARCH_CACHE_TTL)
+
+def prefetch_page(token, page_url):
+    """Start loading a page into the cache in the background, so that the
+    request for it is answered without waiting on the API."""
+    if not page_url or cache.lookup(f'page:{page_url}') is not None:
+        return
+    _in_flight_future(f'page:{page_url}', get_next_page, token, page_url)
+
+def get_species_page(token, page):
+    """Retrieves one page of the whole species catalog, uncached, for a
+    catalog sync. Returns (status code, JSON response as dict)."""
+    return _fetch_json('/api/v1/species', {"token": token, "page": page})
 
 def get_one_plant(token, plant_slug):
     """Retrieves data for a specific plant. Returns JSON response as dict."""
-    response = requests.get(f'{BASE_URL}/api/v1/species/{plant_slug}', params={"token": token})
-    return response.json()
+    return cache.get_or_fetch(
+        f'plant:{plant_slug}',
+        lambda: _fetch_json(f'/api/v1/species/{plant_slug}', {"token": token}))
 
+def plant_version(plant_slug):
+    """Version of the cached data for a plant, or None if it isn't cached."""
+    entry = cache.lookup(f'plant:{plant_slug}')
+    return entry.version if entry is not None else None
+
+def _in_flight_future(key, fn, *args):
+    """Run fn(*args) on the thread pool and return its Future, sharing a
+    Future already in flight for the same key."""
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        if future is not None:
+            return future
+        future = get_executor().submit(fn, *args)
+        _in_flight[key] = future
+
+    def forget(done):
+        with _in_flight_lock:
+            if _in_flight.get(key) is done:
+                del _in_flight[key]
+
+    future.add_done_callback(forget)
+    return future
+
+def get_many_plants(token, plant_slugs):
+    """Retrieves data for several plants concurrently.
+
+    Returns dict of slug -> JSON response as dict, or None for slugs whose
+    request failed or was still waiting for the pool after DEADLINE seconds.
+    Cached plants are answered without touching the pool.
+    """
+    deadline = time.monotonic() + DEADLINE
+    results = {}
+    futures = {}
+    for slug in dict.fromkeys(plant_slugs):
+        entry = cache.lookup(f'plant:{slug}')
+        if entry is not None and entry.is_fresh(time.time()):
+            results[slug] = entry.data
+        else:
+            futures[slug] = _in_flight_future(f'plant:{slug}', get_one_plant, token, slug)
+    for slug, future in futures.items():
+        try:
+            results[slug] = future.result(timeout=max(0, deadline - time.monotonic()))
+        except (UpstreamUnavailable, TimeoutError):
+            results[slug] = None
+    return results
 
-advanced_search_tester = {
-    "range[maximum_height_cm]": "20,120",
-    "filter[flower_color]": "red",
-    "filter[flower_conspicuous]": "true"
-}
 
 def advanced_search(token, search_terms):
     """Multi-field search request to API. Returns JSON response as dict."""
-    search_terms["token"] = token
-    response = requests.get(f'{BASE_URL}/api/v1/species', params=search_terms)
-    return response.json()
-
+    key = 'advanced:' + '&'.join(f'{name}={value}' for name, value in sorted(search_terms.items()))
+    params = dict(search_terms, token=token)
+    return cache.get_or_fetch(
+        key,
+        lambda: _fetch_json('/api/v1/species', params),
+        ttl=SEARCH_CACHE_TTL)